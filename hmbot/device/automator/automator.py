@@ -127,15 +127,16 @@ class Automator(ABC):
         pass
 
     @abstractmethod
-    def screenshot(self, path=''):
+    def screenshot(self, path='', raw=False):
         """
         Take a screenshot of the device display.
 
         Args:
             path (str): The local path to save the screenshot.
+            raw (bool): Return the encoded image bytes instead of decoding them.
 
         Returns:
-            str: The path where the screenshot is saved.
+            numpy.ndarray | bytes: The decoded BGR image, or the encoded bytes if raw.
         """
         pass
 
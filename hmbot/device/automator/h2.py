@@ -4,14 +4,16 @@ from hmbot.utils.proto import SwipeDirection, DisplayInfo
 from hmbot.app.app import App
 from hmdriver2.driver import Driver
 from hmdriver2.proto import KeyCode
+from hmbot.utils.exception import HDCError, ShellSessionError
 from loguru import logger
-import uuid, os, shutil, logging
+import uuid, os, logging, base64, binascii, subprocess
 h2_logger = logging.getLogger('hmdriver2')
 h2_logger.setLevel(logging.CRITICAL)
 
 class H2(Automator):
     def __init__(self, device):
         self._serial = device.serial
+        self._connector = device.connector
         self._driver = Driver(self._serial)
         self._display_info = None
         logger.debug("hmdriver2 is connected to device:%s" %(self._serial))
@@ -74,18 +76,39 @@ class H2(Automator):
     def dump_hierarchy(self, device):
         return VHTParser._parse_hdc_json(self._driver.dump_hierarchy(), device)
 
-    def screenshot(self, path=''):
+    def screenshot(self, path='', raw=False):
         if isinstance(path, str):
-            _uuid = uuid.uuid4().hex
-            _tmp_path = f"_tmp_{_uuid}.jpeg"
-            from hmbot.utils.cv import read
-            img = read(self._driver.screenshot(_tmp_path))
+            data = self._screenshot_bytes()
             if path:
-                shutil.copyfile(_tmp_path, path)
-            os.remove(_tmp_path)
-            return img
+                with open(path, 'wb') as f:
+                    f.write(data)
+            if raw:
+                return data
+            from hmbot.utils.cv import decode
+            return decode(data)
         else:
             raise TypeError('expected an str, not %s' % type(path).__name__)
+
+    def _screenshot_bytes(self):
+        # Capture on the device and stream the JPEG back as base64 over the shell session,
+        # so that no temporary file is written on the host.
+        _remote_path = f"/data/local/tmp/_hmbot_{uuid.uuid4().hex}.jpeg"
+        try:
+            out = self._connector.shell(f"snapshot_display -f {_remote_path} >/dev/null && base64 {_remote_path}; "
+                                        f"rm -f {_remote_path}")
+            data = base64.b64decode(''.join(out.split()), validate=True)
+            if data[:2] == b'\xff\xd8':
+                return data
+            logger.warning('in-memory screenshot is not a JPEG, fall back to hmdriver2')
+        except (HDCError, ShellSessionError, subprocess.CalledProcessError, binascii.Error) as e:
+            logger.warning('in-memory screenshot failed, fall back to hmdriver2: %s' % e)
+        _tmp_path = f"_tmp_{uuid.uuid4().hex}.jpeg"
+        try:
+            with open(self._driver.screenshot(_tmp_path), 'rb') as f:
+                return f.read()
+        finally:
+            if os.path.exists(_tmp_path):
+                os.remove(_tmp_path)
     
     # def display_size(self):
     #     return self._driver.display_size
@@ -47,37 +47,30 @@ class U2(Automator):
         self._driver.app_start(bundle)
 
     def click(self, x, y):
-        self.display_info(refresh=True)
-        width = self._display_info.width
-        height = self._display_info.height
         if x < 1 and y < 1:
-            x = x * width
-            y = y * height
+            x, y = self._to_absolute(x, y)
         return self._driver.click(x, y)
 
     def long_click(self, x, y):
         return self._driver.long_click(x, y)
 
     def drag(self, x1, y1, x2, y2, duration=0.5):
-        self.display_info(refresh=True)
-        width = self._display_info.width
-        height = self._display_info.height
         if x1 < 1 and y1 < 1:
-            x1 = x1*width
-            y1 = y1*height
+            x1, y1 = self._to_absolute(x1, y1)
         if x2 < 1 and y2 < 1:
-            x2 = x2*width
-            y2 = y2*height
+            x2, y2 = self._to_absolute(x2, y2)
         return self._driver.drag(x1, y1, x2, y2, duration)
 
     def swipe(self, x1, y1, x2, y2, duration=0.5):
         if x1 < 1 and y1 < 1 and x2 < 1 and y2 < 1:
-            self.display_info(refresh=True)
-            width = self._display_info.width
-            height = self._display_info.height
-            return self._driver.swipe(x1 * width, y1 * height, x2 * width, y2 * height, duration)
-        else:
-            return self._driver.swipe(x1, y1, x2, y2, duration)
+            x1, y1 = self._to_absolute(x1, y1)
+            x2, y2 = self._to_absolute(x2, y2)
+        return self._driver.swipe(x1, y1, x2, y2, duration)
+
+    def _to_absolute(self, x, y):
+        # The display geometry is cached and only refreshed when dump_hierarchy sees it change.
+        info = self.display_info(refresh=False)
+        return x * info.width, y * info.height
 
     def swipe_ext(self, direction, scale=0.4):
         if direction == SwipeDirection.LEFT :
@@ -107,21 +100,27 @@ class U2(Automator):
 
     def dump_hierarchy(self, device):
         root = VHTParser._parse_adb_xml(self._driver.dump_hierarchy(compressed=True), device)._root
+        self._check_display(root)
         # root_child = max(root._children, key=lambda child:
         #     (child.attribute['bounds'][1][0] - child.attribute['bounds'][0][0]) * (child.attribute['bounds'][1][1] - child.attribute['bounds'][0][1]))
         # root_child.attribute['type'] = 'root'
         # root_child.attribute['page'] = self._current()['activity']
         return VHT(root)
 
-    def screenshot(self, path=''):
-        img = self._driver.screenshot(format='opencv')
-        if isinstance(path, str):
-            if path:
-                from ..cv import write
-                write(path, img)
-            return img
-        else:
+    def screenshot(self, path='', raw=False):
+        if not isinstance(path, str):
             raise TypeError('expected an str, not %s' % type(path).__name__)
+        if raw:
+            data = self._driver.screenshot(format='raw')
+            if path:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            return data
+        img = self._driver.screenshot(format='opencv')
+        if path:
+            from hmbot.utils.cv import write
+            write(path, img)
+        return img
     
     def display_info(self, refresh=True):
         if self._display_info is None or refresh:
@@ -132,6 +131,23 @@ class U2(Automator):
                                              rotation=info['displayRotation'])
         return self._display_info
 
+    def _check_display(self, root):
+        """
+        Invalidate the cached display info if the window bounds show that the display
+        was rotated or resized.
+        """
+        if self._display_info is None or not root._children:
+            return
+        width = max(child.attribute['bounds'][1][0] for child in root._children)
+        height = max(child.attribute['bounds'][1][1] for child in root._children)
+        if width <= 0 or height <= 0:
+            return
+        info = self._display_info
+        rotated = (width > height) != (info.width > info.height)
+        if rotated or width > info.width or height > info.height:
+            logger.debug("display changed to %dx%d, refresh display info" % (width, height))
+            self._display_info = None
+
     def home(self):
         self._driver.press(SystemKey.HOME)
 
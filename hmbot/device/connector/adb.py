@@ -29,6 +29,9 @@ class ADB(Connector):
             logger.warning(msg)
             raise ADBError(msg)
 
+        if len(extra_args) > 1 and extra_args[0] == 'shell':
+            return self._session_shell(' '.join(extra_args[1:]))
+
         args = [] + self.cmd_prefix
         args += extra_args
 
@@ -59,18 +62,10 @@ class ADB(Connector):
             logger.warning(msg)
             raise ADBError(msg)
 
-        args = self.cmd_prefix + ['shell'] + [quote(arg) for arg in extra_args]
-        grep_args = ['grep'] + [quote(arg) for arg in grep_args]
-
-        proc1 = subprocess.Popen(args, stdout=subprocess.PIPE)
-        proc2 = subprocess.Popen(grep_args, stdin=proc1.stdout,
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        proc1.stdout.close()  # Allow proc1 to receive a SIGPIPE if proc2 exits.
-        out, err = proc2.communicate()
-        if not isinstance(out, str):
-            out = out.decode()
-        return out
+        cmd = ' '.join([quote(arg) for arg in extra_args])
+        grep_cmd = self._grep_cmd(grep_args)
+        # grep exits with 1 when nothing matches, which is an empty result rather than an error
+        return self._session_shell('%s | %s' % (cmd, grep_cmd), check=False)
 
     def grep(self, shell_out, grep_args):
         shell_out = shell_out.splitlines()
@@ -1,4 +1,9 @@
 from abc import ABC, abstractmethod
+from hmbot.utils.exception import ShellSessionError
+from .shell import ShellSessionPool
+from loguru import logger
+import subprocess
+from shlex import quote
 
 class Connector(ABC):
     """
@@ -21,6 +26,52 @@ class Connector(ABC):
         """
         pass
 
+    def _session_shell(self, cmd, timeout=None, check=True):
+        """
+        Run a shell-command in the pooled shell session of the device.
+        Falls back to a one-shot process if the session cannot be used.
+
+        Args:
+            cmd (str): the command line to run in the device shell
+            check (bool): raise CalledProcessError if the command exits with a non-zero status
+
+        Returns:
+            str: output of command
+        """
+        pool = ShellSessionPool.of(self.cmd_prefix)
+        try:
+            out, status = pool.run(cmd, timeout)
+        except ShellSessionError as e:
+            # a broken pool was already reported when its session failed to start
+            log = logger.debug if pool.broken else logger.warning
+            log('shell session failed, fall back to one-shot process: %s' % e)
+            proc = subprocess.run(self.cmd_prefix + ['shell', cmd], stdout=subprocess.PIPE)
+            out, status = proc.stdout.decode(errors='replace').strip(), proc.returncode
+        if status != 0 and check:
+            raise subprocess.CalledProcessError(status, self.cmd_prefix + ['shell', cmd], output=out)
+        return out
+
+    @staticmethod
+    def _grep_cmd(grep_args):
+        """
+        Build the device-side grep command of shell_grep. The first character of the pattern is
+        put in a bracket expression, so that the grep process never matches its own command line
+        in ps output.
+
+        Args:
+            grep_args (list): arguments to grep, the pattern last
+
+        Returns:
+            str: the grep command line
+        """
+        args = list(grep_args)
+        for i in range(len(args) - 1, -1, -1):
+            if not args[i].startswith('-'):
+                if args[i][:1].isalnum():
+                    args[i] = '[%s]%s' % (args[i][0], args[i][1:])
+                break
+        return ' '.join(['grep'] + [quote(arg) for arg in args])
+
     @abstractmethod
     def shell(self, extra_args):
         """
@@ -9,6 +9,11 @@ try:
 except ImportError:
     from pipes import quote  # Python 2
 
+_SESSION_RE = re.compile(r'.*sessionId: (\d+).*appUid: (\d+).*appPid: (\d+).*')
+_STREAM_RE = re.compile(r'.*Stream Id: (\d+).*')
+_STATUS_RE = re.compile(r'.*Status:(.*)')
+_DUMP_MARK = '__HMBOT_AUDIO_DUMP__'
+
 
 class HDC(Connector):
     def __init__(self, device=None):
@@ -20,6 +25,7 @@ class HDC(Connector):
         else:
             raise DeviceError
         self.cmd_prefix = ['hdc', "-t", self.serial]
+        self._processes = {}
         self.info = self.page_info()
 
     def run_cmd(self, extra_args):
@@ -30,6 +36,9 @@ class HDC(Connector):
             logger.warning(msg)
             raise HDCError(msg)
 
+        if len(extra_args) > 1 and extra_args[0] == 'shell':
+            return self._session_shell(' '.join(extra_args[1:]))
+
         args = [] + self.cmd_prefix
         args += extra_args
 
@@ -68,18 +77,10 @@ class HDC(Connector):
             logger.warning(msg)
             raise HDCError(msg)
 
-        args = self.cmd_prefix + ['shell'] + [quote(arg) for arg in extra_args]
-        grep_args = ['grep'] + [quote(arg) for arg in grep_args]
-
-        proc1 = subprocess.Popen(args, stdout=subprocess.PIPE)
-        proc2 = subprocess.Popen(grep_args, stdin=proc1.stdout,
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        proc1.stdout.close()  # Allow proc1 to receive a SIGPIPE if proc2 exits.
-        out, err = proc2.communicate()
-        if not isinstance(out, str):
-            out = out.decode()
-        return out
+        cmd = ' '.join([quote(arg) for arg in extra_args])
+        grep_cmd = self._grep_cmd(grep_args)
+        # grep exits with 1 when nothing matches, which is an empty result rather than an error
+        return self._session_shell('%s | %s' % (cmd, grep_cmd), check=False)
 
     def page_info(self):
         missions = self._hidumper(ability='AbilityManagerService', extra_args='-l')
@@ -111,18 +112,41 @@ class HDC(Connector):
             if not self.info:
                 self.info = self.page_info()
             bundle = self.info.bundle
-        ps_info = self.shell_grep("ps -ef", bundle).split()
-        if len(ps_info) > 2:
-            return ps_info[0]
+        process = self._process(bundle)
+        if process:
+            return process[0]
 
     def get_pid(self, bundle=None):
         if not bundle:
             if not self.info:
                 self.info = self.page_info()
             bundle = self.info.bundle
-        ps_info = self.shell_grep("ps -ef", bundle).split()
-        if len(ps_info) > 2:
-            return ps_info[1]
+        process = self._process(bundle)
+        if process:
+            return process[1]
+
+    def _process(self, bundle, verify=True):
+        """
+        Get the (uid, pid) of the bundle's process. The result is cached until the process restarts.
+
+        Args:
+            bundle (str): the bundle name of the app
+            verify (bool): check that the cached pid still belongs to the bundle
+        """
+        if bundle in self._processes and verify:
+            cmdline = self.shell(f'cat /proc/{self._processes[bundle][1]}/cmdline 2>/dev/null')
+            self._check_process(bundle, cmdline)
+        if bundle not in self._processes:
+            ps_info = self.shell_grep("ps -ef", bundle).split()
+            if len(ps_info) <= 2:
+                return None
+            self._processes[bundle] = (ps_info[0], ps_info[1])
+        return self._processes[bundle]
+
+    def _check_process(self, bundle, cmdline):
+        if bundle not in cmdline.replace('\x00', ' ').split():
+            logger.debug('process of %s restarted, drop cached uid/pid' % bundle)
+            self._processes.pop(bundle, None)
 
     def get_resources(self, bundle=None):
         if not bundle:
@@ -133,43 +157,46 @@ class HDC(Connector):
                         camera=self.get_camera(bundle))
 
     def get_audio(self, bundle=None):
-        uid = self.get_uid(bundle)
-        pid = self.get_pid(bundle)
+        if not bundle:
+            if not self.info:
+                self.info = self.page_info()
+            bundle = self.info.bundle
         # todo
         type = AudioType.MUSIC
 
-        session_id_infos = self.shell_grep("hidumper -s AudioDistributed", "sessionId").splitlines()
+        # One round trip: check that the cached process is alive and dump the audio service
+        cached = self._processes.get(bundle)
+        if cached:
+            out = self.shell(f'cat /proc/{cached[1]}/cmdline 2>/dev/null; echo; echo {_DUMP_MARK}; '
+                             f'hidumper -s AudioDistributed')
+            cmdline, _, dump = out.partition(_DUMP_MARK)
+            self._check_process(bundle, cmdline)
+        else:
+            dump = self.shell('hidumper -s AudioDistributed')
+        process = self._process(bundle, verify=False)
+        uid, pid = process if process else (None, None)
+
         session_id = 0
-        for session_id_info in session_id_infos:
-            session_id_info = session_id_info.strip()
-            session_id_re = re.compile(f'.*sessionId: (\d+).*appUid: {uid}.*appPid: {pid}.*')
-            match = session_id_re.match(session_id_info)
-            if match:
-                session_id = match.group(1)
-
-        stream_id_infos = self.shell_grep("hidumper -s AudioDistributed", "Stream").splitlines()
         stream_id_list = []
-        for stream_id_info in stream_id_infos:
-            stream_id_re = re.compile('.*Stream Id: (\d+).*')
-            match = stream_id_re.match(stream_id_info)
-            if match:
-                stream_id = match.groups()[0]
-                stream_id_list.append(stream_id)
-
-        status_infos = self.shell_grep("hidumper -s AudioDistributed", "Status").splitlines()
         status_list = []
-        for status_info in status_infos:
-            status_info = status_info.strip()
-            status_re = re.compile('.*Status:(.*)')
-            match = status_re.match(status_info)
-            if match:
-                status = match.groups()[0]
-                status_list.append(status)
+        for line in dump.splitlines():
+            if 'sessionId' in line:
+                match = _SESSION_RE.match(line.strip())
+                if match and match.group(2) == uid and match.group(3) == pid:
+                    session_id = match.group(1)
+            if 'Stream' in line:
+                match = _STREAM_RE.match(line)
+                if match:
+                    stream_id_list.append(match.group(1))
+            if 'Status' in line:
+                match = _STATUS_RE.match(line.strip())
+                if match:
+                    status_list.append(match.group(1))
         status = ''
         for index, stream_id in enumerate(stream_id_list):
-            if stream_id == session_id:
+            if stream_id == session_id and index < len(status_list):
                 status = status_list[index]
-        print(f'status={status}')
+        logger.debug(f'audio status of {bundle}: {status}')
         if status in ['RUNNING']:
             return AudioInfo(type, Status.RUNNING)
         return AudioInfo(type, Status.STOPPED)
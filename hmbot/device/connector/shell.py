@@ -0,0 +1,209 @@
+from hmbot.utils.exception import ShellSessionError
+from loguru import logger
+import subprocess, threading, queue, atexit, uuid, time, re
+
+
+class ShellSession(object):
+    """
+    A long-lived interactive shell on a device (``adb shell`` / ``hdc shell``).
+
+    Commands are written to the shell's stdin one at a time, and the output of
+    each command is framed by a sentinel line carrying its exit status, so a
+    single host process serves any number of commands.
+    """
+    def __init__(self, cmd_prefix, timeout=30, startup_timeout=5):
+        """
+        Args:
+            cmd_prefix (list): The connector command prefix, e.g. ['hdc', '-t', serial].
+            timeout (float): Default seconds to wait for a command to finish.
+            startup_timeout (float): Seconds to wait for the shell to answer its first command.
+        """
+        self.cmd_prefix = list(cmd_prefix)
+        self.timeout = timeout
+        self._token = '__HMBOT_%s__' % uuid.uuid4().hex
+        self._sentinel_re = re.compile(r'%s(\d+)$' % self._token)
+        self._lines = queue.Queue()
+        try:
+            self._proc = subprocess.Popen(self.cmd_prefix + ['shell'],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.PIPE)
+        except OSError as e:
+            raise ShellSessionError('cannot start shell session: %s' % e)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        # stderr is kept out of the command output, and only logged
+        self._err_reader = threading.Thread(target=self._read_err, daemon=True)
+        self._err_reader.start()
+        # Silence prompt and echo, in case the shell was given a pty.
+        try:
+            self._write("export PS1=''; stty -echo 2>/dev/null")
+            self.run('true', startup_timeout)
+        except ShellSessionError:
+            self.close()
+            raise
+
+    def _read(self):
+        for line in iter(self._proc.stdout.readline, b''):
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read_err(self):
+        for line in iter(self._proc.stderr.readline, b''):
+            logger.debug('shell stderr: %s' % line.decode(errors='replace').rstrip())
+
+    def _write(self, text):
+        try:
+            self._proc.stdin.write((text + '\n').encode())
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise ShellSessionError('shell session is closed: %s' % e)
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def run(self, cmd, timeout=None):
+        """
+        Run a command in the session and return its output.
+
+        Args:
+            cmd (str): The shell command line to run on the device.
+            timeout (float, optional): Seconds to wait, defaults to the session timeout.
+
+        Returns:
+            (str, int): The stripped output and the exit status of the command.
+        """
+        if not self.alive():
+            raise ShellSessionError('shell session is closed')
+        timeout = self.timeout if timeout is None else timeout
+        # stdin is redirected so that the command cannot swallow the sentinel
+        self._write("( %s ) </dev/null; printf '\\n%s%%d\\n' $?" % (cmd, self._token))
+        out = []
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                self.close()
+                raise ShellSessionError('command timed out after %ss: %s' % (timeout, cmd))
+            if line is None:
+                raise ShellSessionError('shell session exited while running: %s' % cmd)
+            line = line.decode(errors='replace').rstrip('\r\n')
+            match = self._sentinel_re.search(line)
+            if match:
+                out.append(line[:match.start()])
+                return '\n'.join(out).strip(), int(match.group(1))
+            out.append(line)
+
+    def close(self):
+        if self.alive():
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc.kill()
+        self._proc.wait()
+
+
+class ShellSessionPool(object):
+    """
+    A pool of shell sessions for one device, shared by every connector of that device.
+
+    When a session fails to start, the pool is marked broken and refuses to start
+    another one for a while, doubling the wait after each further failure.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, cmd_prefix, size=2, timeout=30, retry_after=30, max_retry_after=600):
+        """
+        Args:
+            cmd_prefix (list): The connector command prefix, e.g. ['adb', '-s', serial].
+            size (int): The maximum number of concurrent sessions for the device.
+            timeout (float): Default seconds to wait for a command to finish.
+            retry_after (float): Seconds before a session is started again after a failed start.
+            max_retry_after (float): The longest wait between failed starts.
+        """
+        self.cmd_prefix = list(cmd_prefix)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._failures = 0
+        self._broken_until = 0.0
+
+    @classmethod
+    def of(cls, cmd_prefix, size=2):
+        """
+        Get the pool of the device addressed by cmd_prefix, creating it on first use.
+        """
+        key = tuple(cmd_prefix)
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(cmd_prefix, size)
+            return cls._pools[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def run(self, cmd, timeout=None):
+        """
+        Run a command on an idle session of the pool.
+
+        Returns:
+            (str, int): The stripped output and the exit status of the command.
+        """
+        with self._slots:
+            session = self._acquire()
+            try:
+                result = session.run(cmd, timeout)
+            except ShellSessionError:
+                session.close()
+                raise
+            self._idle.put(session)
+            return result
+
+    def _acquire(self):
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                return self._start()
+            if session.alive():
+                return session
+
+    @property
+    def broken(self):
+        """Whether no session is started because the last start failed."""
+        return time.monotonic() < self._broken_until
+
+    def _start(self):
+        if self.broken:
+            raise ShellSessionError('shell sessions of %s are broken, retry in %.0fs'
+                                    % (self.cmd_prefix, self._broken_until - time.monotonic()))
+        logger.debug('start shell session: %s' % self.cmd_prefix)
+        try:
+            session = ShellSession(self.cmd_prefix, self.timeout)
+        except ShellSessionError:
+            wait = min(self.max_retry_after, self.retry_after * 2 ** self._failures)
+            self._failures += 1
+            self._broken_until = time.monotonic() + wait
+            logger.warning('shell session of %s failed to start, not retried for %.0fs' % (self.cmd_prefix, wait))
+            raise
+        self._failures = 0
+        return session
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+atexit.register(ShellSessionPool.close_all)
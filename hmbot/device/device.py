@@ -1,26 +1,32 @@
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 from loguru import logger
 from ..utils.exception import*
 from ..utils.proto import SwipeDirection
 from ..utils.rfl.system_rfl import system_rfl
 from ..model.page import Page
+from .settle import UISettleDetector
 
 class Device(object):
     """
     The class describes a connected device
     """
 
-    def __init__(self, device_serial, operating_system):
+    def __init__(self, device_serial, operating_system, concurrent_capture=False):
         """
         Initialize a device connection
         Args:
             device_serial (str): The serial of device.
             operating_system (str): The operating system of device.
+            concurrent_capture (bool): Run the probes of dump_page at the same time.
         """
         self.serial = device_serial
         self.operating_system = operating_system
+        self.concurrent_capture = concurrent_capture
+        self.capture_timings = {}
+        self._capture_pool = None
         try:
             connector_cls, automator_cls = system_rfl[self.operating_system]
             self.connector = connector_cls(self)
@@ -29,6 +35,7 @@ class Device(object):
             logger.error("%s is not supported" % operating_system)
             sys.exit(-1)
         self.page = None
+        self.settle_detector = UISettleDetector(self)
 
     def __call__(self, **kwds):
         self.dump_page(refresh=True)
@@ -83,8 +90,17 @@ class Device(object):
             device = self
         return self.automator.dump_hierarchy(device)
 
-    def screenshot(self, path=''):
-        return self.automator.screenshot(path)
+    def screenshot(self, path='', raw=False):
+        return self.automator.screenshot(path, raw)
+
+    def wait_settle(self, timeout=3.0, min_wait=None):
+        """
+        Wait until the UI of the device stops changing, at most timeout seconds.
+
+        Returns:
+            bool: True if the UI settled before the timeout.
+        """
+        return self.settle_detector.wait(timeout, min_wait)
 
     def home(self):
         self.automator.home()
@@ -98,17 +114,49 @@ class Device(object):
     def page_info(self):
         return self.connector.page_info()
     
-    def dump_page(self, device=None, refresh=False):
+    def dump_page(self, device=None, refresh=False, concurrent=None):
+        """
+        Capture the current page of the device.
+
+        Args:
+            refresh (bool): Capture a new page even if one has been captured before.
+            concurrent (bool, optional): Run the hierarchy, screenshot, resource and page-info
+                probes at the same time. Defaults to self.concurrent_capture.
+
+        Returns:
+            Page: The captured page. The seconds taken by each probe are kept in self.capture_timings.
+        """
         if device is None:
             device = self
+        if concurrent is None:
+            concurrent = self.concurrent_capture
         if self.page == None or refresh:
-            vht = self.dump_hierarchy(device=device)
-            img = self.screenshot()
-            rsc = self.resources()
-            info = self.page_info()
-            self.page = Page(vht=vht, img=img, rsc=rsc, info=info)
+            probes = {'vht': lambda: self.dump_hierarchy(device=device),
+                      'img': self.screenshot,
+                      'rsc': self.resources,
+                      'info': self.page_info}
+            start = time.perf_counter()
+            if concurrent:
+                if self._capture_pool is None:
+                    self._capture_pool = ThreadPoolExecutor(max_workers=len(probes),
+                                                            thread_name_prefix='capture-%s' % self.serial)
+                futures = {name: self._capture_pool.submit(self._timed, probe) for name, probe in probes.items()}
+                results = {name: future.result() for name, future in futures.items()}
+            else:
+                results = {name: self._timed(probe) for name, probe in probes.items()}
+            self.capture_timings = {name: elapsed for name, (_, elapsed) in results.items()}
+            self.capture_timings['total'] = time.perf_counter() - start
+            logger.debug('dump_page timings: %s' % ', '.join(
+                '%s=%.3fs' % (name, elapsed) for name, elapsed in self.capture_timings.items()))
+            values = {name: value for name, (value, _) in results.items()}
+            self.page = Page(vht=values['vht'], img=values['img'], rsc=values['rsc'], info=values['info'])
         return self.page
 
+    def _timed(self, probe):
+        start = time.perf_counter()
+        value = probe()
+        return value, time.perf_counter() - start
+
     def hop(self, dst_device_name=None, app_name=None):
         return self.automator.hop(dst_device_name, app_name)
     
@@ -0,0 +1,117 @@
+from loguru import logger
+import numpy as np
+import cv2
+import time
+
+
+class UISettleDetector(object):
+    """
+    Wait until the screen of a device stops changing, instead of sleeping for a fixed time.
+
+    The detector polls cheap signals of the device and returns as soon as the
+    same signals have been observed for a number of consecutive samples, or
+    when the timeout expires.
+    """
+    SIGNALS = ('screen', 'vht', 'ability')
+
+    def __init__(self, device, signals=('screen',), interval=0.2, min_wait=0.3,
+                 stable_samples=2, screen_size=(36, 64), screen_threshold=2.0):
+        """
+        Args:
+            device (Device): The device to watch.
+            signals (tuple): The signals to poll, any of 'screen' (low resolution screenshot diff),
+                'vht' (node count and structure hash of the hierarchy) and 'ability' (foreground ability).
+                'vht' and 'ability' cost a hierarchy dump or a hidumper call per sample, so only
+                the screen is polled by default.
+            interval (float): Seconds between two samples.
+            min_wait (float): Seconds to wait before the first sample, so that the action takes effect.
+            stable_samples (int): The number of consecutive unchanged samples to consider the UI settled.
+            screen_size ((int, int)): The (width, height) the screenshot is reduced to before comparing.
+            screen_threshold (float): The maximum mean absolute gray-level difference of two stable screens.
+        """
+        for signal in signals:
+            if signal not in self.SIGNALS:
+                raise ValueError('unknown settle signal: %s' % signal)
+        self.device = device
+        self.signals = tuple(signals)
+        self.interval = interval
+        self.min_wait = min_wait
+        self.stable_samples = stable_samples
+        self.screen_size = screen_size
+        self.screen_threshold = screen_threshold
+
+    def wait(self, timeout=3.0, min_wait=None):
+        """
+        Block until the UI is settled or the timeout passes.
+
+        Args:
+            timeout (float): The maximum seconds to wait, i.e. the fixed sleep this wait replaces.
+            min_wait (float, optional): Overrides the minimum wait of the detector.
+
+        Returns:
+            bool: True if the UI settled before the timeout.
+        """
+        start = time.perf_counter()
+        time.sleep(min(self.min_wait if min_wait is None else min_wait, timeout))
+        last = None
+        stable = 0
+        while True:
+            sample = self._sample()
+            if last is not None and self._same(last, sample):
+                stable += 1
+            else:
+                stable = 0
+            last = sample
+            elapsed = time.perf_counter() - start
+            if stable >= self.stable_samples:
+                logger.debug('UI settled after %.2fs' % elapsed)
+                return True
+            if elapsed + self.interval >= timeout:
+                logger.debug('UI not settled after %.2fs' % elapsed)
+                return False
+            time.sleep(self.interval)
+
+    def _sample(self):
+        sample = {}
+        if 'screen' in self.signals:
+            gray = self._screen()
+            if gray is not None:
+                sample['screen'] = cv2.resize(gray, self.screen_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+        if 'vht' in self.signals:
+            sample['vht'] = self._vht_signature(self.device.dump_hierarchy())
+        if 'ability' in self.signals:
+            info = self.device.page_info()
+            sample['ability'] = (info.bundle, info.ability) if info else None
+        return sample
+
+    def _screen(self):
+        # Decode the encoded screenshot straight to a 1/8 scale gray image, which skips most
+        # of the JPEG decoding work and the full resolution color array.
+        data = self.device.screenshot(raw=True)
+        if data is None or len(data) == 0:
+            return None
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+    def _same(self, last, sample):
+        for signal, value in sample.items():
+            if signal not in last:
+                return False
+            if signal == 'screen':
+                if last[signal].shape != value.shape:
+                    return False
+                if np.abs(last[signal] - value).mean() > self.screen_threshold:
+                    return False
+            elif last[signal] != value:
+                return False
+        return True
+
+    def _vht_signature(self, vht):
+        count = 0
+        types = []
+        stack = [vht._root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            types.append(node.attribute['type'])
+            stack.extend(reversed(node._children))
+        return count, hash(tuple(types))
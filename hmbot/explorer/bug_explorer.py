@@ -1,10 +1,15 @@
 from hmbot.explorer.llm import *
 from hmbot.model.page import Page
+from hmbot.model.ptg_store import PTGStore
 from hmbot.device.device import Device
 from langchain_core.messages import HumanMessage, AIMessage
 from hmbot.explorer.action_parser import action_parser
 from hmbot.model.event import *
-from hmbot.utils.cv import encode_image
+from hmbot.utils.bktree import BKTree
+from hmbot.utils.taskgraph import TaskGraph
+from concurrent.futures import ThreadPoolExecutor
+from hmbot.explorer.equivalence import (EquivalenceEngine, PairCache, AbilityTier, StructureTier, PerceptualTier,
+                                        TreeDistanceTier, JudgeTier)
 from loguru import logger
 import json, time, re, os, cv2, threading, collections
 from typing import Dict, List, Optional
@@ -25,6 +30,8 @@ class PageNode:
             widget_list (list): 页面上所有控件的列表。
             function_list (list): 页面上所有功能的列表。
         """
+        # 节点所属的页面图，加入PageGraph时设置
+        self.graph = None
         self.index = index
         self.page = page
         self.page_abstract = page_abstract
@@ -32,6 +39,17 @@ class PageNode:
         self.widgets = list(widget_list) if widget_list else []
         self.functions = list(function_list) if function_list else []
 
+    @property
+    def page(self) -> Page:
+        return self._page
+
+    @page.setter
+    def page(self, page: Page):
+        old = getattr(self, '_page', None)
+        self._page = page
+        if self.graph is not None and old is not page:
+            self.graph._page_replaced(self, old)
+
     def describe(self) -> str:
         """
         生成节点的统一描述。
@@ -70,6 +88,80 @@ class PageNode:
             "operation": operation,
             "dest_index": dest_index
         })
+        if self.graph is not None:
+            self.graph._add_edge(self.index, dest_index)
+
+
+class PageGraph(list):
+    """
+    页面节点列表，同时维护页面之间的正向和反向边索引，以及按页面缓存的局部化探索地图。
+    某个页面的局部地图只在其邻域（邻居集合或邻居的描述）变化时失效。
+    """
+    def __init__(self, nodes=()):
+        super().__init__()
+        # 页面索引 -> 出邻居索引集合 / 入邻居索引集合
+        self.forward: Dict[int, set] = collections.defaultdict(set)
+        self.reverse: Dict[int, set] = collections.defaultdict(set)
+        self._map_cache: Dict[int, str] = {}
+        # 节点页面被替换时的回调 listener(node, old_page)，用于更新页面索引
+        self.page_listeners = []
+        for node in nodes:
+            self.append(node)
+
+    def append(self, node: PageNode):
+        super().append(node)
+        node.graph = self
+        for op in node.explored_operations:
+            self._add_edge(node.index, op.get('dest_index', -1))
+        # 之前指向该页面的操作现在可以显示该页面了
+        self._invalidate({node.index} | self.reverse[node.index])
+
+    def neighbors(self, index: int) -> set:
+        """页面自身及其出邻居和入邻居中已存在的页面索引。"""
+        indices = {index} | self.forward[index] | self.reverse[index]
+        return {i for i in indices if 0 <= i < len(self)}
+
+    def _add_edge(self, src_index: int, dest_index: int):
+        if dest_index == -1:
+            # 没有目标页面的操作也会出现在源页面的描述中
+            self._invalidate({src_index} | self.forward[src_index] | self.reverse[src_index])
+            return
+        self.forward[src_index].add(dest_index)
+        self.reverse[dest_index].add(src_index)
+        # 源页面的描述变化，包含源页面的所有局部地图都失效；目标页面多了一个入邻居
+        self._invalidate({src_index, dest_index} | self.forward[src_index] | self.reverse[src_index])
+
+    def _page_replaced(self, node: PageNode, old_page: Page):
+        for listener in self.page_listeners:
+            listener(node, old_page)
+
+    def _invalidate(self, indices):
+        for index in indices:
+            self._map_cache.pop(index, None)
+
+    def localized_map(self, current_page_index: int) -> str:
+        """
+        生成（或从缓存中取出）页面的局部化探索地图字符串。
+        """
+        if not self:
+            return "No pages explored yet."
+        cached = self._map_cache.get(current_page_index)
+        if cached is not None:
+            return cached
+
+        localized_descriptions = []
+        # 对索引进行排序以保证输出顺序的稳定性
+        for index in sorted(self.neighbors(current_page_index)):
+            description = self[index].describe()
+            # 为了保持可读性，我们手动为当前页面的描述添加一个特殊标记
+            if index == current_page_index:
+                localized_descriptions.append(f"(*** THIS IS THE CURRENT PAGE ***)\n{description}")
+            else:
+                localized_descriptions.append(description)
+
+        result = "\n---\n".join(localized_descriptions)
+        self._map_cache[current_page_index] = result
+        return result
 
 def show_comparison(before_img: np.ndarray, after_img: np.ndarray, operation_text: str):
     """
@@ -108,18 +200,48 @@ def show_comparison(before_img: np.ndarray, after_img: np.ndarray, operation_tex
     cv2.destroyAllWindows()
 
 class BugExplorer:
-    def __init__(self, device: Device, app: App = None):
+    def __init__(self, device: Device, app: App = None, speculative_page_info: bool = False,
+                 store: PTGStore = None):
+        """
+        Args:
+            device (Device): 被测设备。
+            app (App): 被测应用。
+            speculative_page_info (bool): 推测式页面摘要，截取到未见过的页面时立即在后台生成页面摘要，
+                与PTG构建器的页面等价判定并行进行。
+            store (PTGStore): 增量持久化存储，探索过程中逐步写入页面、边、执行步骤和Bug，
+                运行崩溃时最多丢失最后一步。
+        """
         self.device = device
         self.app = app
-        self.llm_flash = llm_flash
-        self.llm_pro = llm_pro
-        self.uitars = uitars
+        self.store = store
+        self.speculative_page_info = speculative_page_info
+        # 页面结构指纹到推测式页面摘要请求(Future)的映射
+        self.page_info_futures: dict = {}
+        self.page_info_lock = threading.Lock()
+        # 通过异步请求层调用模型，主线程与PTG构建线程共享各模型的并发与速率限制
+        self.llm_flash = llm_flash_async
+        self.llm_pro = llm_pro_async
+        self.uitars = uitars_async
         self.app_bundle = ""
         self.last_page_index = -1
         self.curr_page_index = 0
-        self.pages: list[PageNode] = []
+        self.pages: PageGraph = PageGraph()
+        self.pages.page_listeners.append(self._reindex_page)
         self.bugs_report: list[str] = []
         self.explored_abilities: list[str] = []
+        # 页面截图感知哈希的BK树，值为页面索引，用于快速查找相似页面
+        self.page_hashes = BKTree()
+        # 页面结构指纹到页面索引列表的映射，布局相同的页面可直接命中
+        self.page_fingerprints: dict[str, list[int]] = {}
+        # 页面对的树编辑距离按内容缓存，每一步都会与相同的候选页面比较
+        self.distance_cache = PairCache()
+        self.equivalence = EquivalenceEngine([
+            AbilityTier(),
+            StructureTier(index=self.page_fingerprints),
+            PerceptualTier(threshold=5, index=self.page_hashes),
+            TreeDistanceTier(same_below=3, different_above=30, cache=self.distance_cache),
+            JudgeTier(self._judge_pages_with_llm),
+        ])
 
         # 最近的5次操作历史，包含截图和操作描述
         self.history: collections.deque[dict] = collections.deque(maxlen=5) 
@@ -139,22 +261,33 @@ class BugExplorer:
         self.explore_coarse()
         # self._execute_instruction("将当前软件的主题调整成light模式")
 
-    def explore_coarse(self, max_minutes: int = 60, output_dir: str = "output"):
+    def explore_coarse(self, max_minutes: int = 60, output_dir: str = "output", pipelined: bool = False):
+        """
+        粗粒度探索：循环规划指令、执行指令、验证结果并构建PTG。
+
+        Args:
+            max_minutes (int): 探索时长上限（分钟）。
+            output_dir (str): Bug报告的输出目录。
+            pipelined (bool): 流水线模式，验证、PTG构建与下一步规划并行进行，
+                每一步的耗时约为其中最长的一次调用，而不是全部调用之和。
+        """
         self.ptg_thread_stop_event.clear()
         self.ptg_builder_thread = threading.Thread(target=self._build_PTG, daemon=True)
         self.ptg_builder_thread.start()
 
         start_time = time.time()
         max_seconds = max_minutes * 60
+        step_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="explore-step") if pipelined else None
 
         try:
             verification_feedback = ""
+            instruction = None
             logger.info(f"=========== 探索开始 (时长上限: {max_minutes} 分钟) ==========")
             
             initial_page = self.device.dump_page(refresh=True)
             self.app_bundle = initial_page.info.bundle if initial_page.info else ""
             current_page_node = self._get_page_info(initial_page, 0)
-            self.pages.append(current_page_node)
+            self._add_page_node(current_page_node)
             self.curr_page_index = current_page_node.index
 
             while True:
@@ -168,6 +301,11 @@ class BugExplorer:
                 elapsed_minutes = elapsed_time / 60
                 logger.info(f"当前位于页面 (索引 {self.curr_page_index}) | 已运行: {elapsed_minutes:.1f}/{max_minutes} 分钟")
 
+                if pipelined:
+                    instruction, verification_feedback = self._explore_step_pipelined(
+                        step_executor, instruction, verification_feedback)
+                    continue
+
                 # 更新页面状态
                 page = self.device.dump_page(refresh=True)
                 current_page_node.page = page    
@@ -180,6 +318,7 @@ class BugExplorer:
                 records = self._execute_instruction(instruction)
 
                 verification_feedback = self._verify_instruction(records, instruction)
+                self._record_step(instruction, verification_feedback)
                 
                 with self.ptg_data_lock:
                     while len(self.shared_ptg_data) > 0 or self.is_ptg_builder_processing:
@@ -199,6 +338,13 @@ class BugExplorer:
             if self.ptg_builder_thread:
                 self.ptg_builder_thread.join()
             logger.info("PTG构建器后台线程已停止。")
+            if step_executor:
+                step_executor.shutdown()
+            with self.page_info_lock:
+                for future in self.page_info_futures.values():
+                    future.cancel()
+                self.page_info_futures.clear()
+            self.equivalence.report()
             self._save_bugs_report(output_dir=output_dir)
 
     def _build_PTG(self):
@@ -221,11 +367,18 @@ class BugExplorer:
                 if page_index_after == len(self.pages):
                     # 发现新页面
                     logger.info(f"发现新页面 (索引 {page_index_after})")
-                    new_page_node = self._get_page_info(data_item["page"], page_index_after)
-                    self.pages.append(new_page_node)
+                    new_page_node = self._get_page_info(data_item["page"], page_index_after,
+                                                        self._take_page_info_future(data_item["page"]))
+                    self._add_page_node(new_page_node)
                 else:
-                    # 跳转至已知页面
+                    # 跳转至已知页面，推测式摘要不再需要
                     logger.info(f"跳转至已知页面 (索引 {page_index_after})")
+                    future = self._take_page_info_future(data_item["page"])
+                    if future:
+                        future.cancel()
+                if self.store:
+                    # 目标页面写入之后再写入边，崩溃时不会留下指向缺失页面的边
+                    self.store.put_edge(current_page_node.index, page_index_after, operation=data_item["operation"])
 
 
                 # 处理完成后，更新状态并通知主线程
@@ -239,6 +392,58 @@ class BugExplorer:
                 time.sleep(0.5)
         logger.info("PTG构建器线程接收到停止信号，即将退出。")
 
+    def _explore_step_pipelined(self, executor: ThreadPoolExecutor, instruction: Optional[str], verification_feedback: str):
+        """
+        流水线模式下的一步：执行指令后，按下面的依赖图并行运行各任务，最后协调结果。
+
+            verify  : 验证刚执行的指令
+            capture : 采集当前页面
+            ptg     : 等待PTG构建器处理完本步产生的页面
+            plan    : 依赖 capture 和 ptg，在不等待验证结果的情况下规划下一步指令
+            reconcile: 验证未通过（发现故障或验证出错）时，结合验证反馈重新规划
+
+        Returns:
+            (str, str): 下一步指令与本步的验证反馈。
+        """
+        if instruction is None:
+            # 第一步之前没有可以重叠的工作，直接规划
+            self.pages[self.curr_page_index].page = self.device.dump_page(refresh=True)
+            instruction = self._get_next_instruction(verification_feedback)
+        logger.info(f"下一步指令: {instruction}")
+        self.instruction_history.append(instruction)
+
+        records = self._execute_instruction(instruction)
+
+        graph = TaskGraph(executor)
+        graph.add("verify", self._verify_instruction_status, records, instruction)
+        graph.add("capture", self.device.dump_page, refresh=True)
+        graph.add("ptg", self._wait_ptg_idle)
+        graph.add("plan", self._plan_on_page, deps=("capture", "ptg"))
+
+        status, verification_feedback = graph.result("verify")
+        next_instruction = graph.result("plan")
+        if status != "success":
+            logger.info(f"验证状态为 {status}，根据验证反馈重新规划下一步指令")
+            next_instruction = self._get_next_instruction(verification_feedback)
+        self._record_step(instruction, verification_feedback)
+        return next_instruction, verification_feedback
+
+    def _record_step(self, instruction: str, verification_feedback: str):
+        """将执行过的指令及其验证反馈写入持久化存储。"""
+        if self.store:
+            self.store.log("step", {"instruction": instruction, "feedback": verification_feedback})
+
+    def _wait_ptg_idle(self):
+        """阻塞直到PTG构建器处理完队列中的全部页面。"""
+        with self.ptg_data_lock:
+            while len(self.shared_ptg_data) > 0 or self.is_ptg_builder_processing:
+                self.ptg_idle_condition.wait()
+
+    def _plan_on_page(self, page: Page, _=None) -> str:
+        """用最新采集的页面更新当前页面节点，并在没有验证反馈的情况下预先规划下一步指令。"""
+        self.pages[self.curr_page_index].page = page
+        return self._get_next_instruction("")
+
     def _get_next_instruction(self, verification_feedback: str = "") -> str:
         """根据验证反馈获取下一步指令"""
         current_page_node = self.pages[self.curr_page_index]
@@ -275,25 +480,25 @@ class BugExplorer:
 
             # 构建包含6张图片的消息体
             # 1. 添加“初始状态”截图，即第一个动作之前的截图
-            initial_state_img = self.history[0]['before'].img
+            initial_state_page = self.history[0]['before']
             message_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encode_image(initial_state_img)}"}
+                "image_url": {"url": f"data:image/jpeg;base64,{initial_state_page.encoded_image()}"}
             })
 
             # 2. 依次添加5个动作之后的“结果状态”截图
             for item in self.history:
-                result_state_img = item['after'].img
+                result_state_page = item['after']
                 message_content.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{encode_image(result_state_img)}"}
+                    "image_url": {"url": f"data:image/jpeg;base64,{result_state_page.encoded_image()}"}
                 })
         else:
             # 如果历史记录为空（即第一步），则只提供当前截图
             history_str = "This is the first action. No history yet."
             message_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encode_image(current_page_node.page.img)}"}
+                "image_url": {"url": f"data:image/jpeg;base64,{current_page_node.page.encoded_image()}"}
             })
 
         logger.debug(f"当前页面已探索的操作: {explored_ops_str}")
@@ -313,23 +518,14 @@ class BugExplorer:
         message_content.insert(0, {"type": "text", "text": prompt_text})
         message = HumanMessage(content=message_content)
 
-        MAX_RETRIES = 3
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = self.llm_pro.invoke([message])
-                return response.text()
-            except Exception as e:
-                logger.error(f"处理 LLM 响应时发生未知错误: {e}")
-            
-            # 如果失败，则会继续下一次循环尝试
-        
-        # 如果所有尝试都失败了，则抛出异常
-        raise RuntimeError(f"在 {MAX_RETRIES} 次尝试后，仍未能从 LLM 获取有效的操作指令。")
+        # 下一条指令需要随探索变化，不读取缓存；请求失败时由 AsyncLLM 统一退避重试
+        response = self.llm_pro.invoke([message], cache=False)
+        return response.text()
         
     def _execute_instruction(self, instruction: str):
         """根据给定的指令执行一系列连续动作"""
         page = self.device.dump_page(refresh=True)
-        base64_image = encode_image(page.img)
+        base64_image = page.encoded_image()
 
         records = []
 
@@ -355,7 +551,7 @@ class BugExplorer:
         parse_retry_count = 0
         
         while True:
-            response = self.uitars.invoke(conversation_history)
+            response = self.uitars.invoke(conversation_history, cache=False)
             logger.debug(f"LLM response: {response.text()}")
             conversation_history.append(AIMessage(content=response.text()))
 
@@ -371,7 +567,6 @@ class BugExplorer:
                 if parse_retry_count >= MAX_PARSE_RETRIES:
                     logger.error("已达到最大重试次数，任务失败。")
                     break
-                time.sleep(1)  # 等待1秒后重试
                 continue
 
             page_before_operation = page
@@ -391,11 +586,14 @@ class BugExplorer:
                 SwipeExtEvent(self.device, page, parsed_output["direction"]).execute()
             elif action_type == "press_back":
                 KeyEvent(self.device, page, "back").execute()
-            time.sleep(3)
+            self.device.wait_settle(timeout=3)
 
             # 获取操作后页面
             page = self.device.dump_page(refresh=True) 
-            base64_image = encode_image(page.img)
+            base64_image = page.encoded_image()
+            if parsed_output.get("status") == "success":
+                # 在页面进入PTG队列之前发出请求，保证PTG构建器能取到
+                self._speculate_page_info(page)
 
             with self.ptg_data_lock:
                 if parsed_output.get("status") == "success":
@@ -454,6 +652,10 @@ class BugExplorer:
         return records
 
     def _verify_instruction(self, records: list, instruction: str) -> str:
+        """验证操作序列，只返回feedback字符串。详见 `_verify_instruction_status`。"""
+        return self._verify_instruction_status(records, instruction)[1]
+
+    def _verify_instruction_status(self, records: list, instruction: str):
         """
         根据一系列操作记录和高阶指令，验证其执行结果是否符合预期。
 
@@ -467,13 +669,13 @@ class BugExplorer:
             instruction (str): 执行此次操作序列的原始高阶指令。
 
         Returns:
-            str: 从LLM返回的feedback字符串。如果操作成功，它是一个总结；
-                如果失败，它会详细描述每一个发现的故障。
+            (str, str): 验证状态 ('success'、'error'，验证本身出错时为None) 与从LLM返回的feedback字符串。
+                如果操作成功，feedback是一个总结；如果失败，它会详细描述每一个发现的故障。
         """
         # 如果记录为空，说明没有执行任何操作，直接返回成功。
         if not records:
             logger.info("验证记录为空，无需验证，默认成功。")
-            return "Success: No actions were executed, so no failures to report."
+            return "success", "Success: No actions were executed, so no failures to report."
 
         # message_content 将用于构建发送给LLM的完整多模态消息
         message_content = []
@@ -490,15 +692,15 @@ class BugExplorer:
         # 3. 按照 "初始截图 -> 操作1 -> 结果截图1 -> 操作2 -> 结果截图2..." 的顺序构建图文序列
         try:
             # 添加初始状态截图
-            initial_state_img = records[0]['before'].img
+            initial_state_page = records[0]['before']
             message_content.append({"type": "text", "text": "Initial State (Screenshot 0):"})
             message_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encode_image(initial_state_img)}"}
+                "image_url": {"url": f"data:image/jpeg;base64,{initial_state_page.encoded_image()}"}
             })
         except (IndexError, AttributeError, KeyError) as e:
             logger.error(f"无法从记录中获取初始状态截图，错误: {e}")
-            return "Verification Error: Could not process the initial state from the records."
+            return None, "Verification Error: Could not process the initial state from the records."
 
         # 循环添加每个操作及其结果截图
         for i, record in enumerate(records):
@@ -516,7 +718,7 @@ class BugExplorer:
             message_content.append({"type": "text", "text": f"Post-Operation State (Screenshot {step_num}):"})
             message_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encode_image(after_page.img)}"}
+                "image_url": {"url": f"data:image/jpeg;base64,{after_page.encoded_image()}"}
             })
 
         # 4. 调用LLM进行分析，并加入重试机制以提高稳定性
@@ -525,7 +727,8 @@ class BugExplorer:
             try:
                 logger.info(f"正在调用LLM验证 {len(records)} 个操作步骤... (第 {attempt + 1}/{MAX_RETRIES} 次尝试)")
                 message = HumanMessage(content=message_content)
-                response = self.llm_pro.invoke([message])
+                # 重试时跳过缓存，避免重复得到同一个无效响应
+                response = self.llm_pro.invoke([message], cache=(attempt == 0))
                 raw_content = response.content
 
                 # 5. 清理并解析LLM返回的JSON响应
@@ -545,35 +748,33 @@ class BugExplorer:
                 if status not in ['success', 'error'] or feedback is None:
                     logger.warning(f"LLM响应格式不完整，缺少 'status' 或 'feedback'。响应: {parsed_json}")
                     if attempt < MAX_RETRIES - 1:
-                        time.sleep(2)  # 等待后重试
                         continue
-                    return f"Verification Error: LLM response was malformed. Raw content: {raw_content}"
+                    return None, f"Verification Error: LLM response was malformed. Raw content: {raw_content}"
 
                 logger.info(f"验证完成。状态: {status}")
                 
                 # 如果发现错误，将其记录到全局Bug报告中
                 if status == 'error':
                     self.bugs_report.append(f"Instruction: '{instruction}'\nFailure Details: {feedback}")
+                    if self.store:
+                        self.store.log("bug", {"instruction": instruction, "feedback": feedback})
 
-                return feedback
+                return status, feedback
 
             except json.JSONDecodeError:
                 logger.warning(f"无法解析LLM返回的JSON (第 {attempt + 1}/{MAX_RETRIES} 次尝试)。响应: {raw_content}")
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(2)
                     continue
-                return f"Verification Error: Could not parse the LLM's JSON response. Raw response: {raw_content}"
+                return None, f"Verification Error: Could not parse the LLM's JSON response. Raw response: {raw_content}"
             except Exception as e:
-                logger.error(f"验证过程中发生未知错误 (第 {attempt + 1}/{MAX_RETRIES} 次尝试): {e}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(2)
-                    continue
-                return f"Verification Error: An unexpected error occurred: {e}"
+                # 请求失败已由 AsyncLLM 退避重试过，这里不再重试
+                logger.error(f"验证过程中发生未知错误: {e}")
+                return None, f"Verification Error: An unexpected error occurred: {e}"
         
         # 如果所有重试都失败了
-        return "Verification Error: After multiple retries, failed to get a valid response from the LLM."
+        return None, "Verification Error: After multiple retries, failed to get a valid response from the LLM."
 
-    def _get_page_info(self, page: Page, index: int):
+    def _page_info_messages(self, page: Page) -> list:
         content = HumanMessage(
             content=[
                 {
@@ -583,12 +784,52 @@ class BugExplorer:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{encode_image(page.img)}"
+                        "url": f"data:image/jpeg;base64,{page.encoded_image()}"
                     }
                 }
             ]
         )
-        response = self.llm_flash.invoke([content]).content
+        return [content]
+
+    def _speculate_page_info(self, page: Page):
+        """
+        若页面的结构指纹和截图哈希都没有见过，则在后台提前请求页面摘要。
+        已知页面的请求会在PTG构建器判定后取消；已完成的响应保留在LLM响应缓存中。
+        """
+        if not self.speculative_page_info:
+            return
+        fingerprint = page.fingerprint
+        if fingerprint in self.page_fingerprints:
+            return
+        if page.img_hash and self.page_hashes.find(page.img_hash, 5):
+            return
+        with self.page_info_lock:
+            if fingerprint in self.page_info_futures:
+                return
+            logger.debug(f"推测式请求页面摘要: {fingerprint}")
+            self.page_info_futures[fingerprint] = self.llm_flash.submit(self._page_info_messages(page))
+
+    def _take_page_info_future(self, page: Page):
+        """取出页面对应的推测式页面摘要请求，没有则返回None。"""
+        with self.page_info_lock:
+            return self.page_info_futures.pop(page.fingerprint, None)
+
+    def _summarize_page(self, page: Page, future=None) -> dict:
+        """
+        请求LLM生成页面摘要，返回解析后的JSON。
+
+        Args:
+            page (Page): 页面。
+            future (Future): 推测式请求，若给出则等待其结果，失败时重新请求。
+        """
+        response = None
+        if future is not None:
+            try:
+                response = future.result().content
+            except Exception as e:
+                logger.warning(f"推测式页面摘要请求失败，重新请求: {e}")
+        if response is None:
+            response = self.llm_flash.invoke(self._page_info_messages(page)).content
         # 处理可能包含```json前缀和后缀的返回数据
         if response.strip().startswith('```json'):
             # 使用正则表达式提取JSON内容
@@ -606,9 +847,11 @@ class BugExplorer:
             else:
                 response = response.strip()[3:].strip()
         
-        response_json = json.loads(response)
+        return json.loads(response)
 
-        # 构造新的PageNode对象
+    def _get_page_info(self, page: Page, index: int, future=None):
+        """根据页面摘要构造新的PageNode对象。"""
+        response_json = self._summarize_page(page, future)
         page_node = PageNode(
             index=index,
             page=page,
@@ -625,55 +868,48 @@ class BugExplorer:
     
     def _get_localized_map_str(self, current_page_index: int) -> str:
         """
-        根据新的 PageNode 结构，生成一个局部化的探索地图字符串。
-        它只包含当前页面及其直接邻居（出邻居和入邻居）的信息。
+        生成一个局部化的探索地图字符串，只包含当前页面及其直接邻居（出邻居和入邻居）的信息。
         """
-        if not self.pages:
-            return "No pages explored yet."
-
-        current_page_node = self.pages[current_page_index]
-        # 使用集合来自动去重，并首先包含当前页面自身的索引
-        neighbor_indices = {current_page_index}
-
-        # 步骤 1: 找出所有“出邻居” (Outgoing Neighbors)
-        # 遍历当前页面的所有已探索操作
-        for op in current_page_node.explored_operations:
-            dest_index = op.get('dest_index', -1)
-            if dest_index != -1 and dest_index < len(self.pages):
-                neighbor_indices.add(dest_index)
-
-        # 步骤 2: 找出所有“入邻居” (Incoming Neighbors)
-        # 遍历地图中的所有页面
-        for page_node in self.pages:
-            # 遍历每个页面的所有操作
-            for op in page_node.explored_operations:
-                # 如果某个操作的目标是当前页面，那么这个页面就是“入邻居”
-                if op.get('dest_index') == current_page_index:
-                    neighbor_indices.add(page_node.index)
-                    # 优化：一旦找到，就无需再检查该页面的其他操作
-                    break 
-
-        # 步骤 3: 根据收集到的邻居索引，生成最终的描述字符串
-        localized_descriptions = []
-        # 对索引进行排序以保证输出顺序的稳定性
-        for index in sorted(list(neighbor_indices)):
-            page_to_describe = self.pages[index]
-            # 调用新的 describe 方法，该方法不再需要任何参数
-            description = page_to_describe.describe()
-            
-            # 为了保持可读性，我们手动为当前页面的描述添加一个特殊标记
-            if index == current_page_index:
-                marked_description = f"(*** THIS IS THE CURRENT PAGE ***)\n{description}"
-                localized_descriptions.append(marked_description)
-            else:
-                localized_descriptions.append(description)
-                    
-        return "\n---\n".join(localized_descriptions)
+        return self.pages.localized_map(current_page_index)
+
+    def _add_page_node(self, page_node: PageNode):
+        """添加页面节点，并将其结构指纹和截图哈希加入索引。"""
+        self.pages.append(page_node)
+        if self.store and page_node.page:
+            self.store.put_page(page_node.index, page_node.page, meta={
+                "page_abstract": page_node.page_abstract,
+                "widgets": page_node.widgets,
+                "functions": page_node.functions,
+            })
+        self._index_page(page_node.index, page_node.page)
+
+    def _index_page(self, index: int, page: Page):
+        """将页面的结构指纹和截图哈希加入索引。"""
+        if page:
+            self.page_fingerprints.setdefault(page.fingerprint, []).append(index)
+        if page and page.img_hash:
+            self.page_hashes.add(page.img_hash, index)
+
+    def _reindex_page(self, page_node: PageNode, old_page: Page):
+        """页面节点的页面被替换后，从索引中移除旧页面，再加入新页面，使索引与候选页面一致。"""
+        page = page_node.page
+        # 每一步都会替换当前页面，指纹和截图哈希都未变化时索引无需更新
+        if old_page and page and old_page.fingerprint == page.fingerprint and old_page.img_hash == page.img_hash:
+            return
+        if old_page:
+            indices = self.page_fingerprints.get(old_page.fingerprint, [])
+            if page_node.index in indices:
+                indices.remove(page_node.index)
+                if not indices:
+                    del self.page_fingerprints[old_page.fingerprint]
+            if old_page.img_hash:
+                self.page_hashes.remove(old_page.img_hash, page_node.index)
+        self._index_page(page_node.index, page_node.page)
 
     def _is_page_exist(self, page: Page) -> int:
         """
         判断当前页面是否已存在于页面列表中。
-        首先判断Activity是否为新，若是则为新页面；否则，与同Activity的页面进行LLM视觉对比。
+        首先判断Activity是否为新，若是则为新页面；否则，交由等价判定引擎与同Activity的页面逐层对比。
         """
         # 初始情况：如果还没有任何页面，则当前页面是第一个
         if not self.pages:
@@ -687,20 +923,17 @@ class BugExplorer:
             self.explored_abilities.append(page.info.ability)
             return len(self.pages)
 
-        # 快速筛选：根据 ability 找到所有可能的候选页面索引
-        found_indices = [
-            p.index for p in self.pages
-            if p.page and p.page.info and page and page.info and p.page.info.ability == page.info.ability
-        ]
+        # 由等价判定引擎从低成本到高成本逐层判断：Ability、结构指纹、感知哈希、树编辑距离、LLM视觉对比
+        candidates = [(p.index, p.page) for p in self.pages if p.page]
+        index = self.equivalence.match(page, candidates)
+        return len(self.pages) if index is None else index
 
-        for index in found_indices:
-            candidate_node = self.pages[index]
-            # 检查图像感知哈希
-            if page.img_hash and candidate_node.page.img_hash:
-                distance = page.img_hash - candidate_node.page.img_hash
-                if distance <= 5: 
-                    logger.info(f"图像感知哈希与 Page {index} 高度相似 (距离: {distance})。确认为同一页面。")
-                    return index
+    def _judge_pages_with_llm(self, page: Page, candidates: list):
+        """
+        使用LLM多图对比判断页面是否为候选页面之一。
+        返回匹配的候选页面索引，若为新页面则返回None。
+        """
+        found_indices = [index for index, _ in candidates]
 
         # 准备Prompt和图像内容
         prompt_text = page_exist_prompt
@@ -709,7 +942,7 @@ class BugExplorer:
         content.append({"type": "text", "text": "--- \n## 1. New Screenshot"})
         content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{encode_image(page.img)}"}
+            "image_url": {"url": f"data:image/jpeg;base64,{page.encoded_image()}"}
         })
 
         content.append({"type": "text", "text": "\n## 2. Known Candidate Pages"})
@@ -718,7 +951,7 @@ class BugExplorer:
             content.append({"type": "text", "text": f"--- \n### Candidate Index: {index}"})
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{encode_image(candidate_node.page.img)}"}
+                "image_url": {"url": f"data:image/jpeg;base64,{candidate_node.page.encoded_image()}"}
             })
         # 调用LLM进行视觉判断
         try:
@@ -732,17 +965,17 @@ class BugExplorer:
             response_json = json.loads(response_text)
 
             if response_json.get("is_new", True):
-                return len(self.pages)
+                return None
             else:
                 existing_index = response_json.get("existing_index", -1)
                 if existing_index in found_indices:
                     return existing_index
                 else:
-                    return len(self.pages)
+                    return None
 
         except (json.JSONDecodeError, KeyError, AttributeError) as e:
             logger.error(f"处理LLM多图对比响应时出错: {e}。将默认视为新页面。")
-            return len(self.pages)
+            return None
 
     def _save_bugs_report(self, output_dir: str):
         """保存完整的探索报告，并根据要求调整输出格式。"""
@@ -0,0 +1,356 @@
+import time
+import json
+import os
+import atexit
+from collections import OrderedDict
+from loguru import logger
+from hmbot.utils.ted import tree_distance
+
+
+NEW = object()
+"""The verdict of a tier that is sure the page is not any of the candidates."""
+
+
+def content_key(page):
+    """
+    The content address of a page: its structural fingerprint and its screenshot hash.
+    """
+    return '%s:%r' % (page.fingerprint, page.img_hash)
+
+
+class PairCache(object):
+    """
+    A symmetric LRU cache of pairwise page verdicts keyed by the content of both pages,
+    optionally persisted to a JSON file between runs.
+
+    New pairs are written in batches, once enough of them or enough time has piled up,
+    and on close() or at exit.
+    """
+    def __init__(self, capacity=4096, path=None, flush_every=32, flush_interval=30.0):
+        """
+        Args:
+            capacity (int): The maximum number of pairs kept.
+            path (str, optional): The JSON file the cache is loaded from and saved to.
+            flush_every (int): The number of unsaved pairs that triggers a save.
+            flush_interval (float): The seconds after which unsaved pairs are saved on the next put.
+        """
+        self.capacity = capacity
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for key1, key2, value in json.load(f):
+                        self._entries[(key1, key2)] = value
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Ignore unreadable page pair cache {path}: {e}")
+                self._entries.clear()
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        if path:
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(page1, page2):
+        # the layout fingerprint keeps apart pages whose approximate screenshot hashes collide
+        key1, key2 = content_key(page1), content_key(page2)
+        return (key1, key2) if key1 <= key2 else (key2, key1)
+
+    def get(self, page1, page2):
+        """
+        Returns:
+            object: The cached verdict of the pair, or None.
+        """
+        key = self._key(page1, page2)
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, page1, page2, value):
+        key = self._key(page1, page2)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        if self.path:
+            self._unsaved += 1
+            if self._unsaved >= self.flush_every or time.monotonic() - self._saved_at >= self.flush_interval:
+                self.save()
+
+    def close(self):
+        """
+        Save the pairs not written yet.
+        """
+        if self.path and self._unsaved:
+            self.save()
+
+    def save(self):
+        """
+        Write the cache to its file atomically.
+        """
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([[key1, key2, value] for (key1, key2), value in self._entries.items()], f)
+        os.replace(tmp_path, self.path)
+
+
+class Tier(object):
+    """
+    A step of the page-equivalence cascade.
+
+    A tier looks at a page and the candidates left by the cheaper tiers, and either
+    decides (the key of the matching candidate, or NEW) or returns None together
+    with the candidates that are still possible.
+    """
+    name = 'tier'
+
+    def decide(self, page, candidates):
+        """
+        Args:
+            page (Page): The page to identify.
+            candidates (list): (key, Page) pairs, in order of preference.
+
+        Returns:
+            (object, list): The verdict (a key, NEW or None) and the remaining candidates.
+        """
+        raise NotImplementedError
+
+
+class AbilityTier(Tier):
+    """
+    Keep the candidates of the same ability, and optionally the same resources.
+    """
+    name = 'ability'
+
+    def __init__(self, resources=False):
+        self.resources = resources
+
+    def decide(self, page, candidates):
+        if page.info is None:
+            return NEW, []
+        remaining = [(key, candidate) for key, candidate in candidates
+                     if candidate.info is not None and candidate.info.ability == page.info.ability
+                     and (not self.resources or candidate.rsc == page.rsc)]
+        return (None if remaining else NEW), remaining
+
+
+class StructureTier(Tier):
+    """
+    Match a candidate with the same structural fingerprint.
+    """
+    name = 'structure'
+
+    def __init__(self, index=None):
+        """
+        Args:
+            index (dict, optional): A map from fingerprints to lists of candidate keys,
+                used instead of comparing against every candidate.
+        """
+        self.index = index
+
+    def decide(self, page, candidates):
+        fingerprint = page.fingerprint
+        if self.index is not None:
+            keys = self.index.get(fingerprint, ())
+            for key, _ in candidates:
+                if key in keys:
+                    return key, candidates
+            return None, candidates
+        for key, candidate in candidates:
+            if candidate.fingerprint == fingerprint:
+                return key, candidates
+        return None, candidates
+
+
+class PerceptualTier(Tier):
+    """
+    Match the candidate with the nearest screenshot hash within a Hamming distance.
+    """
+    name = 'perceptual'
+
+    def __init__(self, threshold=5, index=None):
+        """
+        Args:
+            threshold (int): The maximum Hamming distance of two hashes of the same page.
+            index (BKTree, optional): A tree of the candidate hashes whose values are candidate keys,
+                used instead of comparing against every candidate.
+        """
+        self.threshold = threshold
+        self.index = index
+
+    def decide(self, page, candidates):
+        img_hash = page.img_hash
+        if not img_hash:
+            return None, candidates
+        if self.index is not None:
+            keys = {key for key, _ in candidates}
+            for distance, _, key in self.index.find(img_hash, self.threshold):
+                if key in keys:
+                    return key, candidates
+            return None, candidates
+        best = None
+        for key, candidate in candidates:
+            if not candidate.img_hash:
+                continue
+            distance = img_hash - candidate.img_hash
+            if distance <= self.threshold and (best is None or distance < best[0]):
+                best = (distance, key)
+        return (best[1] if best else None), candidates
+
+
+class TreeDistanceTier(Tier):
+    """
+    Compare the view hierarchies by tree edit distance. Close trees match, and
+    candidates beyond the upper threshold are dropped.
+    """
+    name = 'tree_distance'
+
+    def __init__(self, same_below=3, different_above=30, distance=None, cache=None):
+        """
+        Args:
+            same_below (int): Distances below this mean the same page.
+            different_above (int): Distances above this mean a different page.
+            distance (callable, optional): distance(vht1, vht2), defaults to the unit-cost Zhang-Shasha
+                distance bounded by different_above.
+            cache (PairCache, optional): Remembers the distance of each pair of pages.
+        """
+        self.same_below = same_below
+        self.different_above = different_above
+        self.distance = distance or self._bounded_distance
+        self.cache = cache
+
+    def _bounded_distance(self, vht1, vht2):
+        # Distances above different_above all mean a different page, so they are not computed exactly
+        return tree_distance(vht1, vht2, self.different_above)
+
+    def decide(self, page, candidates):
+        remaining = []
+        best = None
+        for key, candidate in candidates:
+            distance = self.cache.get(candidate, page) if self.cache is not None else None
+            if distance is None:
+                distance = self.distance(candidate.vht, page.vht)
+                if self.cache is not None:
+                    self.cache.put(candidate, page, distance)
+            logger.debug(f"Tree distance to candidate {key}: {distance}")
+            if distance < self.same_below and (best is None or distance < best[0]):
+                best = (distance, key)
+            if distance <= self.different_above:
+                remaining.append((key, candidate))
+        if best:
+            return best[1], remaining
+        return (None if remaining else NEW), remaining
+
+
+class JudgeTier(Tier):
+    """
+    Ask a judge, usually a vision LLM, which always decides.
+    """
+    name = 'llm'
+
+    def __init__(self, judge):
+        """
+        Args:
+            judge (callable): judge(page, candidates) returning the key of the matching candidate or None.
+        """
+        self.judge = judge
+
+    def decide(self, page, candidates):
+        key = self.judge(page, candidates)
+        if key is None or key not in {candidate_key for candidate_key, _ in candidates}:
+            return NEW, candidates
+        return key, candidates
+
+
+class PairJudgeTier(Tier):
+    """
+    Ask a judge about each remaining candidate in turn, remembering its verdicts.
+    """
+    name = 'llm'
+
+    def __init__(self, judge, cache=None):
+        """
+        Args:
+            judge (callable): judge(candidate, page) returning True if both are the same page.
+            cache (PairCache, optional): Remembers the verdict of each pair of pages.
+        """
+        self.judge = judge
+        self.cache = cache
+
+    def decide(self, page, candidates):
+        for key, candidate in candidates:
+            same = self.cache.get(candidate, page) if self.cache is not None else None
+            if same is None:
+                same = bool(self.judge(candidate, page))
+                if self.cache is not None:
+                    self.cache.put(candidate, page, same)
+            if same:
+                return key, candidates
+        return NEW, candidates
+
+
+class EquivalenceEngine(object):
+    """
+    Decide which known page a page is, running tiers from the cheapest to the most expensive
+    and stopping at the first one that is sure.
+    """
+    def __init__(self, tiers):
+        """
+        Args:
+            tiers (list): The Tier objects, cheapest first.
+        """
+        self.tiers = list(tiers)
+        self.metrics = {tier.name: {'calls': 0, 'decided': 0, 'seconds': 0.0} for tier in self.tiers}
+        self.metrics['undecided'] = {'calls': 0, 'decided': 0, 'seconds': 0.0}
+
+    def match(self, page, candidates):
+        """
+        Find the candidate that is the same page as page.
+
+        Args:
+            page (Page): The page to identify.
+            candidates (list): (key, Page) pairs, in order of preference.
+
+        Returns:
+            object: The key of the matching candidate, or None if the page is new.
+        """
+        candidates = list(candidates)
+        if not candidates:
+            return None
+        for tier in self.tiers:
+            metric = self.metrics[tier.name]
+            start = time.perf_counter()
+            verdict, candidates = tier.decide(page, candidates)
+            metric['calls'] += 1
+            metric['seconds'] += time.perf_counter() - start
+            if verdict is not None:
+                metric['decided'] += 1
+                logger.debug(f"Page equivalence decided by {tier.name}: {'new' if verdict is NEW else verdict}")
+                return None if verdict is NEW else verdict
+        self.metrics['undecided']['calls'] += 1
+        return None
+
+    def report(self):
+        """
+        Log how often each tier decided and how long it took.
+        """
+        for name, metric in self.metrics.items():
+            if metric['calls']:
+                logger.info(f"Equivalence tier {name}: {metric['decided']}/{metric['calls']} decided, "
+                            f"{metric['seconds']:.3f}s total")
+        return self.metrics
@@ -2,34 +2,64 @@ from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from pydantic import SecretStr
+from hmbot.explorer.llm_cache import CachedChatModel, open_cache, DEFAULT_CACHE_PATH
+from hmbot.explorer.llm_async import AsyncLLM, limits
 import os
 
 load_dotenv()
 
+# Responses are only cached on disk when LLM_CACHE_PATH is set or enable_cache() is called
+llm_cache = open_cache()
+
 # llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", max_retries=3, temperature=1.0) 
-llm_flash = ChatOpenAI(
+llm_flash = CachedChatModel(ChatOpenAI(
     model=os.getenv("GOOGLE_MODEL"),
     base_url=os.getenv("GOOGLE_BASE_URL"),
     api_key=SecretStr(os.getenv("GOOGLE_API_KEY")),
     temperature=0,
-    max_retries=3
-)     
-llm_pro = ChatOpenAI(
+    max_retries=0
+), llm_cache)
+llm_pro = CachedChatModel(ChatOpenAI(
     model="gemini-2.5-flash-thinking",
     base_url=os.getenv("GOOGLE_BASE_URL"),
     api_key=SecretStr(os.getenv("GOOGLE_API_KEY")),
     temperature=1.0,
-    max_retries=3
-) 
-uitars = ChatOpenAI(
+    max_retries=0
+), llm_cache)
+uitars = CachedChatModel(ChatOpenAI(
     model=os.getenv("SPECIALIZED_MODEL"),
     base_url=os.getenv("SPECIALIZED_BASE_URL"),
     api_key=SecretStr(os.getenv("SPECIALIZED_API_KEY")),
     temperature=0.0,
     max_completion_tokens= 400,
-    max_retries=3,
-)     
+    max_retries=0,
+), llm_cache)
+
+
+
+def enable_cache(path=None):
+    """
+    Cache the responses of every model in a local SQLite file, created on the first request.
+
+    Args:
+        path (str, optional): The SQLite file, LLM_CACHE_PATH or .hmbot_cache/llm_cache.sqlite by default.
 
+    Returns:
+        LLMCache: The cache.
+    """
+    global llm_cache
+    llm_cache = open_cache(path or os.getenv('LLM_CACHE_PATH') or DEFAULT_CACHE_PATH)
+    for model in (llm_flash, llm_pro, uitars):
+        model.cache = llm_cache
+    return llm_cache
 
 
+# Asynchronous clients sharing per-model concurrency and rate limits, see llm_async.limits for the settings.
+# They are the only layer that retries failed requests, so the wrapped clients above do not retry.
+llm_flash_async = AsyncLLM(llm_flash, 'flash', **limits('flash'))
+llm_pro_async = AsyncLLM(llm_pro, 'pro', **limits('pro'))
+uitars_async = AsyncLLM(uitars, 'uitars', **limits('uitars'))
 
+# General and GUI-agent models used by the path explorer and the PTG verifier
+llm = llm_flash_async
+phone_llm = uitars_async
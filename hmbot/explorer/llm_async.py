@@ -0,0 +1,151 @@
+from loguru import logger
+import asyncio, threading, random, time, os
+
+
+class Backoff(object):
+    """
+    Jittered exponential backoff: the n-th retry waits a random time in [0, min(max_delay, base * factor ** n)].
+    """
+    def __init__(self, base=1.0, factor=2.0, max_delay=30.0):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """
+        Args:
+            attempt (int): The number of failed attempts so far, starting from 0.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        return random.uniform(0, min(self.max_delay, self.base * self.factor ** attempt))
+
+
+class TokenBucket(object):
+    """
+    An asyncio token bucket that lets at most `rate` requests per second through, with bursts up to `capacity`.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _EventLoopThread(object):
+    """
+    The event loop that runs every asynchronous LLM request, in a daemon thread,
+    so that synchronous explorers can submit requests and keep working.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='llm-event-loop', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class AsyncLLM(object):
+    """
+    An asynchronous front end to a chat model with a concurrency limit, a rate limit and retries.
+    """
+    def __init__(self, model, name, max_concurrency=4, rate=None, max_retries=3, backoff=None):
+        """
+        Args:
+            model (CachedChatModel | BaseChatModel): The model, which must provide ainvoke().
+            name (str): The name of the model in logs.
+            max_concurrency (int): The maximum number of requests in flight.
+            rate (float, optional): The maximum requests per second, None for no limit.
+            max_retries (int): The number of retries after a failed request.
+            backoff (Backoff, optional): The wait between retries.
+        """
+        self.model = model
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff or Backoff()
+        self._bucket = TokenBucket(rate) if rate else None
+        self._semaphore = None
+
+    async def ainvoke(self, messages, cache=True):
+        """
+        Send a request, waiting for a free slot and a rate token, and retrying failures with backoff.
+
+        Args:
+            messages (list): The messages of the request.
+            cache (bool): Read the response from the response cache, if the model has one.
+
+        Returns:
+            AIMessage: The response.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    if hasattr(self.model, 'cache'):
+                        # retries skip the cached response, like the explorers do
+                        return await self.model.ainvoke(messages, cache=cache and attempt == 0)
+                    return await self.model.ainvoke(messages)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff.delay(attempt)
+                logger.warning(f"{self.name} request failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def submit(self, messages, cache=True):
+        """
+        Start a request on the background event loop without waiting for it.
+
+        Returns:
+            concurrent.futures.Future: The future of the response.
+        """
+        return _EventLoopThread.get().submit(self.ainvoke(messages, cache))
+
+    def invoke(self, messages, cache=True):
+        """
+        Send a request and block until its response, within the limits shared with submitted requests.
+        """
+        return self.submit(messages, cache).result()
+
+
+def limits(name):
+    """
+    Read the concurrency and rate limits of a model from LLM_<NAME>_MAX_CONCURRENCY and
+    LLM_<NAME>_RATE_LIMIT (requests per second), falling back to LLM_MAX_CONCURRENCY and LLM_RATE_LIMIT.
+    """
+    prefix = 'LLM_%s_' % name.upper()
+    concurrency = os.getenv(prefix + 'MAX_CONCURRENCY') or os.getenv('LLM_MAX_CONCURRENCY') or 4
+    rate = os.getenv(prefix + 'RATE_LIMIT') or os.getenv('LLM_RATE_LIMIT')
+    return {'max_concurrency': int(concurrency), 'rate': float(rate) if rate else None}
@@ -0,0 +1,194 @@
+from langchain_core.messages import AIMessage
+from loguru import logger
+import sqlite3, threading, hashlib, json, time, os, atexit
+
+
+class LLMCache(object):
+    """
+    A content-addressed store of LLM responses in a local SQLite file.
+
+    Entries are keyed by a hash of the model, its sampling settings, the prompt text
+    and the image payloads, expire after a TTL, and the least recently used entries
+    are evicted beyond a maximum count. The file is only created on first use.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=20000):
+        """
+        Args:
+            path (str): The SQLite file.
+            ttl (float): Seconds an entry stays valid, 0 for no expiry.
+            max_entries (int): The maximum number of entries kept.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._failed = False
+
+    def _connect(self):
+        """
+        Open the SQLite file on first use, called with the lock held.
+
+        Returns:
+            sqlite3.Connection: The connection, or None if the file cannot be opened.
+        """
+        if self._db is None and not self._failed:
+            try:
+                self._db = self._open()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"LLM cache disabled, cannot open {self.path}: {e}")
+                self._failed = True
+        return self._db
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                   'key TEXT PRIMARY KEY, model TEXT, content TEXT, created REAL, accessed REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        db.commit()
+        return db
+
+    @staticmethod
+    def key(model, messages):
+        """
+        Hash a request. Image payloads (data URLs) are part of the message content, so they are hashed too.
+        """
+        h = hashlib.sha256()
+        h.update(model.encode())
+        for message in messages:
+            h.update(b'\0')
+            h.update(getattr(message, 'type', type(message).__name__).encode())
+            content = message.content if hasattr(message, 'content') else message
+            h.update(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            if self._connect() is None:
+                return None
+            row = self._db.execute('SELECT content, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, content):
+        now = time.time()
+        with self._lock:
+            if self._connect() is None:
+                return
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, model, content, now, now))
+            if self.ttl:
+                self._db.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            count = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute('DELETE FROM responses WHERE key IN '
+                                 '(SELECT key FROM responses ORDER BY accessed LIMIT ?)', (count - self.max_entries,))
+            self._db.commit()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self):
+        if self.hits + self.misses:
+            logger.info(f"LLM cache: {self.hits} hits, {self.misses} misses, hit ratio {self.hit_ratio():.1%}")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class CachedChatModel(object):
+    """
+    A chat model whose invoke() answers repeated requests from an LLMCache.
+    Every other attribute is delegated to the wrapped model.
+    """
+    def __init__(self, model, cache, name=None):
+        """
+        Args:
+            model (BaseChatModel): The wrapped chat model.
+            cache (LLMCache): The response store, None to disable caching.
+            name (str, optional): The model identity used in cache keys.
+        """
+        self.model = model
+        self.cache = cache
+        self.name = name or '%s:%s:%s' % (getattr(model, 'model_name', ''),
+                                          getattr(model, 'temperature', ''),
+                                          getattr(model, 'max_tokens', ''))
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def invoke(self, messages, cache=True, **kwargs):
+        """
+        Args:
+            messages (list): The messages of the request.
+            cache (bool): Read the response from the cache. With False, e.g. for retries or
+                sampling decisions, the model is always called but its response is still stored.
+
+        Returns:
+            AIMessage: The response.
+        """
+        if self.cache is None or kwargs:
+            return self.model.invoke(messages, **kwargs)
+        key = LLMCache.key(self.name, messages)
+        if cache:
+            content = self.cache.get(key)
+            if content is not None:
+                return AIMessage(content=json.loads(content))
+        response = self.model.invoke(messages)
+        self.cache.put(key, self.name, json.dumps(response.content, ensure_ascii=False))
+        return response
+
+    async def ainvoke(self, messages, cache=True, **kwargs):
+        """
+        The asynchronous counterpart of invoke().
+        """
+        if self.cache is None or kwargs:
+            return await self.model.ainvoke(messages, **kwargs)
+        key = LLMCache.key(self.name, messages)
+        if cache:
+            content = self.cache.get(key)
+            if content is not None:
+                return AIMessage(content=json.loads(content))
+        response = await self.model.ainvoke(messages)
+        self.cache.put(key, self.name, json.dumps(response.content, ensure_ascii=False))
+        return response
+
+
+DEFAULT_CACHE_PATH = '.hmbot_cache/llm_cache.sqlite'
+
+
+def open_cache(path=None):
+    """
+    Open the response cache, which is off unless a caller asks for it or LLM_CACHE_PATH is set.
+    LLM_CACHE_TTL and LLM_CACHE_MAX_ENTRIES configure it.
+
+    Args:
+        path (str, optional): The SQLite file, LLM_CACHE_PATH by default.
+
+    Returns:
+        LLMCache: The cache, or None when it is off.
+    """
+    path = path or os.getenv('LLM_CACHE_PATH')
+    if not path:
+        return None
+    cache = LLMCache(path,
+                     ttl=float(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600)),
+                     max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', 20000)))
+    atexit.register(cache.report)
+    return cache
@@ -0,0 +1,182 @@
+import heapq
+import time
+from loguru import logger
+
+
+class EdgeStats(object):
+    """
+    The measured replays of a transition.
+    """
+    __slots__ = ('attempts', 'successes', 'seconds', 'timed')
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.seconds = 0.0
+        self.timed = 0
+
+    def success_rate(self):
+        # Laplace smoothing, so that unmeasured edges count as even odds and failed edges stay usable
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def latency(self, default):
+        return self.seconds / self.timed if self.timed else default
+
+
+class Navigator(object):
+    """
+    Move the device between pages of a PTG by replaying recorded events along the
+    cheapest known path.
+
+    The cost of a transition is its expected time: the mean replay latency divided
+    by the replay success rate, both measured as the navigator is used.
+    """
+    def __init__(self, ptg, device, arrived=None, locate=None, default_latency=2.0, settle_timeout=3):
+        """
+        Args:
+            ptg (PTG): The graph, whose forward table holds the recorded events of each transition.
+            device (Device): The device to replay the events on.
+            arrived (callable, optional): arrived(page, expected) telling whether the device shows the
+                expected page, cheap by default: same fingerprint or a close screenshot hash.
+            locate (callable, optional): locate(page) returning the id of a page of the graph or None,
+                used to re-plan after a replay ends up elsewhere. Defaults to a fingerprint lookup.
+            default_latency (float): The latency in seconds assumed for transitions never replayed.
+            settle_timeout (float): The maximum wait for the UI to settle after each transition.
+        """
+        self.ptg = ptg
+        self.device = device
+        self.arrived = arrived or self._same_page
+        self.locate = locate or self._locate
+        self.default_latency = default_latency
+        self.settle_timeout = settle_timeout
+        self.stats = {}
+
+    @staticmethod
+    def _same_page(page, expected, threshold=5):
+        if page.fingerprint == expected.fingerprint:
+            return True
+        if page.img_hash and expected.img_hash:
+            return page.img_hash - expected.img_hash <= threshold
+        return False
+
+    def _locate(self, page):
+        ids = self.ptg.fingerprints.get(page.fingerprint)
+        return ids[0] if ids else None
+
+    def record(self, src_id, tgt_id, success, seconds=None):
+        """
+        Record a replay of a transition.
+
+        Args:
+            src_id (int): The id of the source page.
+            tgt_id (int): The id of the target page.
+            success (bool): Whether the replay reached the target page.
+            seconds (float, optional): How long the replay took.
+        """
+        stats = self.stats.get((src_id, tgt_id))
+        if stats is None:
+            stats = self.stats[(src_id, tgt_id)] = EdgeStats()
+        stats.attempts += 1
+        stats.successes += bool(success)
+        if seconds is not None:
+            stats.seconds += seconds
+            stats.timed += 1
+
+    def weight(self, src_id, tgt_id):
+        """
+        Returns:
+            float: The expected seconds to go through a transition.
+        """
+        stats = self.stats.get((src_id, tgt_id))
+        if stats is None:
+            return self.default_latency * 2
+        return stats.latency(self.default_latency) / stats.success_rate()
+
+    def shortest_path(self, src_id, tgt_id, avoid=()):
+        """
+        Find the cheapest path of recorded transitions with Dijkstra's algorithm.
+
+        Args:
+            src_id (int): The id of the start page.
+            tgt_id (int): The id of the target page.
+            avoid (collection): (src_id, tgt_id) transitions not to use.
+
+        Returns:
+            list: The page ids of the path from src_id to tgt_id, or None if there is none.
+        """
+        if src_id == tgt_id:
+            return [src_id]
+        costs = {src_id: 0.0}
+        parents = {}
+        heap = [(0.0, src_id)]
+        while heap:
+            cost, id = heapq.heappop(heap)
+            if id == tgt_id:
+                path = [id]
+                while id != src_id:
+                    id = parents[id]
+                    path.append(id)
+                path.reverse()
+                return path
+            if cost > costs[id]:
+                continue
+            for next_id, events in self.ptg.forward.get(id, {}).items():
+                if not events or (id, next_id) in avoid:
+                    continue
+                next_cost = cost + self.weight(id, next_id)
+                if next_cost < costs.get(next_id, float('inf')):
+                    costs[next_id] = next_cost
+                    parents[next_id] = id
+                    heapq.heappush(heap, (next_cost, next_id))
+        return None
+
+    def navigate(self, src_id, tgt_id, max_replans=2):
+        """
+        Replay the cheapest path from one page to another, checking the page after each transition
+        and re-planning from wherever the device ends up if it is a known page.
+
+        Args:
+            src_id (int): The id of the page the device shows.
+            tgt_id (int): The id of the page to reach.
+            max_replans (int): The number of times a failed replay may be re-planned.
+
+        Returns:
+            (bool, Page): Whether the target page was reached, and the page the device shows
+                (None if no path was found).
+        """
+        avoid = set()
+        current_id, page = src_id, None
+        if src_id == tgt_id:
+            # nothing to replay, but the device may not show the page it is said to
+            page = self.device.dump_page(refresh=True)
+            if self.arrived(page, self.ptg.pages[tgt_id]):
+                return True, page
+            current_id = self.locate(page)
+            if current_id is None or current_id == tgt_id:
+                return False, page
+        for _ in range(max_replans + 1):
+            path = self.shortest_path(current_id, tgt_id, avoid)
+            if path is None:
+                logger.info(f"No recorded path from page {current_id} to page {tgt_id}")
+                return False, page
+            logger.info(f"Replaying path {path}")
+            for next_id in path[1:]:
+                start = time.perf_counter()
+                self.device.execute(self.ptg.forward[current_id][next_id])
+                self.device.wait_settle(timeout=self.settle_timeout)
+                page = self.device.dump_page(refresh=True)
+                success = self.arrived(page, self.ptg.pages[next_id])
+                self.record(current_id, next_id, success, time.perf_counter() - start)
+                if not success:
+                    logger.info(f"Replay of {current_id} -> {next_id} did not reach page {next_id}")
+                    avoid.add((current_id, next_id))
+                    break
+                current_id = next_id
+            else:
+                return True, page
+            current_id = self.locate(page)
+            if current_id is None:
+                return False, page
+            if current_id == tgt_id:
+                return self.arrived(page, self.ptg.pages[tgt_id]), page
+        return False, page
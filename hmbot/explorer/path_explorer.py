@@ -4,9 +4,9 @@ from hmbot.explorer.llm import llm, phone_llm
 from langchain_core.messages import HumanMessage, AIMessage
 import json
 import re
-from hmbot.utils.cv import encode_image
 from hmbot.explorer.prompt import event_llm_prompt
 from hmbot.explorer.action_parser import action_parser
+from hmbot.explorer.equivalence import EquivalenceEngine, AbilityTier, JudgeTier
 from loguru import logger
 from hmbot.model.event import *
 import time
@@ -104,6 +104,12 @@ class PathExplorer:
         self.pages = []
         self.current_path = []
         self.summarized_strategies = []
+        # Content changes make a new page here, so layout-only and perceptual tiers (structure,
+        # tree distance, dHash, which cannot see text changes) are left out
+        self.equivalence = EquivalenceEngine([
+            AbilityTier(),
+            JudgeTier(self._judge_page_with_llm),
+        ])
 
     def get_page_info(self, page: Page, index: int):
         prompt = f'''你是一位精通UI分析的专家。我会上传一张安卓App的界面截图，请严格按照以下规则分析这张图片：
@@ -149,7 +155,7 @@ class PathExplorer:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{encode_image(page.img)}"
+                        "url": f"data:image/jpeg;base64,{page.encoded_image()}"
                     }
                 }
             ]
@@ -267,7 +273,7 @@ class PathExplorer:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{encode_image(current_page.page.img)}"
+                        "url": f"data:image/jpeg;base64,{current_page.page.encoded_image()}"
                     }
                 }
             ]
@@ -276,7 +282,7 @@ class PathExplorer:
         max_retries = 3
         for i in range(max_retries):
             try:
-                response = self.llm.invoke([content]).content
+                response = self.llm.invoke([content], cache=(i == 0)).content
                 logger.debug(f"LLM response: {response}")
                 # 处理可能包含```json前缀和后缀的返回数据
                 if response.strip().startswith('```json'):
@@ -297,7 +303,7 @@ class PathExplorer:
                 
                 response_json = json.loads(response)
                 return response_json
-            except Exception as e:
+            except ValueError as e:
                 logger.error(f"Error parsing LLM response on attempt {i+1}/{max_retries}: {e}")
                 if i < max_retries - 1:
                     logger.info("Retrying...")
@@ -308,7 +314,7 @@ class PathExplorer:
     def execute_operation(self, page_node: PageNode, operation_description: str):
         page = self.device.dump_page(refresh=True)
         page_node.page = page
-        base64_image = encode_image(page.img)
+        base64_image = page.encoded_image()
         
         parsed_output = None
         max_retries = 3
@@ -317,7 +323,6 @@ class PathExplorer:
         while not (parsed_output and parsed_output.get("action")) and retry_count < max_retries:
             if retry_count > 0:
                 logger.info(f"Retrying to get a valid action ({retry_count}/{max_retries})...")
-                time.sleep(2)  # 等待2秒后重试
 
             # 创建包含图片和文本的消息
             message = HumanMessage(content=[
@@ -332,7 +337,7 @@ class PathExplorer:
                     }
                 }
             ])
-            response = self.phone_llm.invoke([message])
+            response = self.phone_llm.invoke([message], cache=False)
             logger.debug(f"LLM response: {response.text()}")
 
             parsed_output = action_parser.parse_action_output(response.text(), page.img.shape[1], page.img.shape[0])
@@ -345,10 +350,10 @@ class PathExplorer:
                 center_pos = parsed_output["point"]
                 logger.info(f"Click coordinates: {center_pos}")
                 self.device.click(center_pos[0], center_pos[1])
-                time.sleep(3)
+                self.device.wait_settle(timeout=3)
                 
             elif parsed_output["action"] == "type" and parsed_output["content"]:
-                nodes = page.vht._root(clickable='true', focused='true', enabled='true', type='android.widget.EditText')
+                nodes = page.vht(clickable='true', focused='true', enabled='true', type='android.widget.EditText')
                 if nodes:
                     new_event = InputEvent(nodes[0], parsed_output["content"])
                 else:
@@ -362,7 +367,7 @@ class PathExplorer:
 
             if new_event:
                 new_event.execute()
-                time.sleep(3)
+                self.device.wait_settle(timeout=3)
             return f"操作成功完成：{parsed_output['action']}"
         else:
             logger.error("Failed to get a valid action after multiple retries.")
@@ -378,10 +383,19 @@ class PathExplorer:
         if not self.pages:
             return 0
 
-        # Build the description of existing pages for the prompt
+        candidates = [(p.index, p.page) for p in self.pages if p.page]
+        index = self.equivalence.match(page, candidates)
+        return len(self.pages) if index is None else index
+
+    def _judge_page_with_llm(self, page: Page, candidates: list):
+        """
+        让LLM根据候选页面的文字描述判断截图是否为其中之一
+        返回匹配的页面index，新页面返回None
+        """
+        # Build the description of candidate pages for the prompt
         pages_description = ""
-        for p in self.pages:
-            pages_description += f"Page {p.index}: {p.page_description}\n"
+        for index, _ in candidates:
+            pages_description += f"Page {index}: {self.pages[index].page_description}\n"
 
         prompt = f'''你是一位精通UI对比分析的专家。你的任务是**极其严格地**判断我上传的新截图是否与任何一个已知的页面完全相同。
 
@@ -444,7 +458,7 @@ class PathExplorer:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{encode_image(page.img)}"
+                        "url": f"data:image/jpeg;base64,{page.encoded_image()}"
                     }
                 }
             ]
@@ -470,22 +484,22 @@ class PathExplorer:
             response_json = json.loads(response_text)
 
             if response_json.get("is_new"):
-                # The page is new, return the next available index.
-                return len(self.pages)
+                # The page is new.
+                return None
             else:
                 # The page exists, return its index.
                 existing_index = response_json.get("existing_index", -1)
-                if 0 <= existing_index < len(self.pages):
+                if existing_index in [index for index, _ in candidates]:
                     return existing_index
                 else:
                     # If the LLM gives an invalid index, treat it as a new page as a fallback.
                     logger.warning(f"LLM returned an invalid existing_index: {existing_index}. Treating as a new page.")
-                    return len(self.pages)
+                    return None
 
         except (json.JSONDecodeError, KeyError) as e:
             logger.error(f"Error processing LLM response for page existence check: {e}. Defaulting to new page.")
             # In case of any error, assume it's a new page to avoid getting stuck.
-            return len(self.pages)
+            return None
 
     def summarize_path(self, path: list, target: str):
         path_description = ""
@@ -549,19 +563,19 @@ class PathExplorer:
 现在，请分析我上传的截图，并返回有效的JSON格式数据。'''
 
         # 编码操作前后的图像
-        base64_image_before = encode_image(page_node_before.page.img)
-        base64_image_after = encode_image(page_node_after.page.img)
+        base64_image_before = page_node_before.page.encoded_image()
+        base64_image_after = page_node_after.page.encoded_image()
 
         content = HumanMessage(
             content=[
                 {"type": "text", "text": prompt},
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image_before}"},
+                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image_before}"},
                 },
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image_after}"},
+                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image_after}"},
                 },
             ]
         )
@@ -569,7 +583,7 @@ class PathExplorer:
         max_retries = 3
         for i in range(max_retries):
             try:
-                response_text = self.llm.invoke([content]).content
+                response_text = self.llm.invoke([content], cache=(i == 0)).content
                 
                 # 清理响应，移除可能的Markdown代码块
                 if response_text.strip().startswith('```json'):
@@ -712,7 +726,7 @@ class PathExplorer:
 
     def execute_operations_continuous_dialogue(self, operation_description: str):
         page = self.device.dump_page(refresh=True)
-        base64_image = encode_image(page.img)
+        base64_image = page.encoded_image()
 
         conversation_history = [
             HumanMessage(content=[
@@ -732,7 +746,7 @@ class PathExplorer:
         parsed_output = None
         
         while True:
-            response = self.phone_llm.invoke(conversation_history)
+            response = self.phone_llm.invoke(conversation_history, cache=False)
             logger.debug(f"LLM response: {response.text()}")
             
             conversation_history.append(AIMessage(content=response.text()))
@@ -755,11 +769,11 @@ class PathExplorer:
                 center_pos = parsed_output["point"]
                 logger.info(f"Executing click at coordinates: {center_pos}")
                 self.device.click(center_pos[0], center_pos[1])
-                time.sleep(3) # 等待界面更新
+                self.device.wait_settle(timeout=3) # 等待界面更新
                 
                 logger.info("Capturing screen after operation.")
                 page = self.device.dump_page(refresh=True) # page对象在这里被更新
-                base64_image = encode_image(page.img)
+                base64_image = page.encoded_image()
                 
                 # 5. 将新截图作为新的用户消息添加到对话历史中，为下一次决策做准备
                 conversation_history.append(
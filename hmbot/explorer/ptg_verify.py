@@ -10,8 +10,11 @@ from hmbot.model.event import *
 from hmbot.model.vht import VHTNode
 from hmbot.utils.cv import encode_image
 from hmbot.model.ptg import PTGParser
+from hmbot.explorer.navigator import Navigator
 from hmbot.explorer.prompt import *
 from hmbot.explorer.action_parser import action_parser
+from hmbot.explorer.equivalence import (EquivalenceEngine, PairCache, AbilityTier, StructureTier, TreeDistanceTier,
+                                        PairJudgeTier)
 from dotenv import load_dotenv
 from langchain.schema import HumanMessage, SystemMessage, BaseMessage
 from hmbot.explorer.llm import phone_llm, llm
@@ -23,20 +26,34 @@ load_dotenv()
 
 
 class PTG_IR(object):
+    """
+    The id-keyed view of a PTG used during verification. Pages, transitions and
+    fingerprints are the tables of the PTG itself, so changes go to the graph.
+    """
     def __init__(self, ptg):
-        self.pages = []
-        self.transitions = {}
-        self._ptg_to_ir(ptg)
-
-    def _ptg_to_ir(self, ptg):
-        for page in ptg.pages:
-            self.pages.append(page)
-            if page.id not in self.transitions:
-                self.transitions[page.id] = {}
-            
-            if page in ptg._adj_list:
-                for tgt_page, events in ptg._adj_list[page].items():
-                    self.transitions[page.id][tgt_page.id] = events
+        self.ptg = ptg
+        self.pages = ptg.pages
+        self.transitions = ptg.forward
+        self.fingerprints = ptg.fingerprints
+
+    def add_page(self, page):
+        """
+        Append a page discovered during verification, assigning its id.
+        """
+        self.ptg.add_page(page)
+        return page.id
+
+    def add_transition(self, src_id, tgt_id, events):
+        """
+        Set the events that lead from one page to another.
+        """
+        self.ptg.add_transition(src_id, tgt_id, events)
+
+    def refresh_fingerprint(self, page, old_fingerprint):
+        """
+        Re-index a page whose content was replaced.
+        """
+        self.ptg.refresh_fingerprint(page, old_fingerprint)
 
     def print_ir(self):
         for page in self.pages:
@@ -50,17 +67,36 @@ class PTG_IR(object):
             
 
 class PTGVerifier:
-    def __init__(self, device, ptg_dir_path):
+    def __init__(self, device, ptg_dir_path, lazy=True):
         """
         Initialize the PTGVerifier
 
         Args:
             device: Device object, the device to execute the operation
             ptg_dir_path: str, the path to the PTG directory
+            lazy: bool, load screenshots and hierarchies of the PTG pages only when they are used
         """
         self.device = device
         # self.ptg = PTGParser.parse(device, ptg_dir_path)
-        self.ptg_ir = PTG_IR(PTGParser.parse(device, ptg_dir_path))
+        self.ptg_ir = PTG_IR(PTGParser.parse(device, ptg_dir_path, lazy=lazy))
+        # Pairwise verdicts are kept across runs, as every LLM comparison costs seconds
+        self.distance_cache = PairCache()
+        self.verdict_cache = PairCache(path=os.path.join(ptg_dir_path, 'output', 'page_pairs.json'))
+        # TODO: need to update the resource comparison and the distance thresholds
+        self.equivalence = EquivalenceEngine([
+            AbilityTier(resources=True),
+            StructureTier(index=self.ptg_ir.fingerprints),
+            TreeDistanceTier(same_below=3, different_above=30, cache=self.distance_cache),
+            PairJudgeTier(self._verify_same_page_with_llm, cache=self.verdict_cache),
+        ])
+        # Replay navigation checks arrival with the tiers that need no LLM. Resources are not compared,
+        # as the resources of pages loaded from the PTG are those of the recording run
+        self.arrival = EquivalenceEngine([
+            AbilityTier(),
+            StructureTier(),
+            TreeDistanceTier(same_below=3, different_above=30, cache=self.distance_cache),
+        ])
+        self.navigator = Navigator(self.ptg_ir.ptg, device, arrived=self._arrived, locate=self._locate_page)
         # self.ptg_ir.print_ir()
         self.visited_pages_id = set()
         
@@ -83,7 +119,7 @@ class PTGVerifier:
         
         if page_before.id in self.ptg_ir.transitions:
             # Check all adjacent pages and events of current page
-            for page_after_id, events in self.ptg_ir.transitions[page_before.id].items():
+            for page_after_id, events in list(self.ptg_ir.transitions[page_before.id].items()):
                 logger.info(f"Checking transition to: {page_after_id}")
                 
                 # If target page is not visited, execute events to reach target page and visit recursively
@@ -94,6 +130,7 @@ class PTGVerifier:
                     page_after = self.ptg_ir.pages[page_after_id]
                     # page_before -> current_page
                     result, error_type, current_page = self._verify_event_with_llm(page_before, page_after, events)
+                    self.navigator.record(page_before.id, page_after_id, result)
 
                     retry_count = 0
 
@@ -106,35 +143,31 @@ class PTGVerifier:
                         logger.info(f"Event verification failed: {error_type}")
                         # current_page -> page_before
                         if error_type == "wrong_page":
-                            current_page.id = len(self.ptg_ir.pages)
-                            self.ptg_ir.pages.append(current_page)
-                            self.ptg_ir.transitions[page_before.id][current_page.id] = events
-                            return_event_command = self._generate_return_event_command(page_before, current_page, events)
-                            self._execute_event_command(return_event_command, current_page)
+                            self.ptg_ir.add_page(current_page)
+                            self.ptg_ir.add_transition(page_before.id, current_page.id, events)
+                            self._return_to_page(page_before, current_page, events, current_page.id)
                         # page_before -> page_after
                         while retry_count < 3:
                             next_event_command = self._generate_next_event_command(page_before, page_after)
                             new_events = self._execute_event_command(next_event_command, page_before)
                             result, error_type, current_page = self._verify_event_with_llm(page_before, page_after, new_events)
+                            self.navigator.record(page_before.id, page_after_id, result)
                             if result:
-                                self.ptg_ir.transitions[page_before.id][page_after_id] = new_events
+                                self.ptg_ir.add_transition(page_before.id, page_after_id, new_events)
                                 self.verify_ptg_dfs(page_after)
                                 break
                             else:
                                 # current_page -> page_before
                                 if error_type == "wrong_page":
-                                    return_event_command = self._generate_return_event_command(page_before, current_page, new_events)
-                                    self._execute_event_command(return_event_command, current_page)
+                                    self._return_to_page(page_before, current_page, new_events)
                             retry_count += 1
 
                     if retry_count == 0:
-                        return_event_command = self._generate_return_event_command(page_before, page_after, events)
-                        self._execute_event_command(return_event_command, page_after)
+                        self._return_to_page(page_before, page_after, events, page_after.id)
                     elif retry_count == 3:
                         continue
                     else:
-                        return_event_command = self._generate_return_event_command(page_before, page_after, new_events)
-                        self._execute_event_command(return_event_command, page_after)
+                        self._return_to_page(page_before, page_after, new_events, page_after.id)
         else:
             # if no outgoing transitions, explore new page
             self._explore_new_page(page_before, max_depth=3, current_depth=0)
@@ -226,7 +259,7 @@ class PTGVerifier:
         #     HumanMessage(
         #         content=[
         #             {"type": "text", "text": "Please analyze this interface screenshot and identify ONLY the most important clickable elements:"},
-        #             {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page1.img)}"}},
+        #             {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page1.encoded_image()}"}},
         #         ]
         #     ),
         # ]
@@ -246,21 +279,17 @@ class PTGVerifier:
         if current_depth >= max_depth:
             return
         
-        # Initialize transitions for this page if not exists
-        if page.id not in self.ptg_ir.transitions:
-            self.ptg_ir.transitions[page.id] = {}
-        
         messages = [
             SystemMessage(content=explore_page_events_prompt),
             HumanMessage(
                 content=[
                     {"type": "text", "text": "Please analyze this interface screenshot and identify ONLY the most important clickable elements:"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page.img)}"}},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page.encoded_image()}"}},
                 ]
             ),
         ]
             
-        response = llm.invoke(messages)
+        response = llm.invoke(messages, cache=False)
         response_content = response.text().strip()
         
         if response_content.startswith('```'):
@@ -276,53 +305,74 @@ class PTGVerifier:
             new_page = self.device.dump_page(refresh=True)
             index = self._is_page_exist(new_page)
             if index == -1:
-                new_page.id = len(self.ptg_ir.pages)
-                self.ptg_ir.pages.append(new_page)
-                self.ptg_ir.transitions[page.id][new_page.id] = new_events
+                self.ptg_ir.add_page(new_page)
+                self.ptg_ir.add_transition(page.id, new_page.id, new_events)
                 self._explore_new_page(new_page, max_depth, current_depth + 1)
             else:
-                self.ptg_ir.transitions[page.id][index] = new_events
-            return_event_command = self._generate_return_event_command(page, new_page, new_events)
-            self._execute_event_command(return_event_command, new_page)
+                self.ptg_ir.add_transition(page.id, index, new_events)
+            self._return_to_page(page, new_page, new_events, new_page.id if index == -1 else index)
+
+    def _return_to_page(self, page_before, current_page, events, current_id=None):
+        """
+        Go back to page_before, replaying the cheapest recorded path first and asking the LLM
+        for a return command only when there is no path or the replay fails.
+
+        Args:
+            page_before: Page object, the page to return to
+            current_page: Page object, the page the device shows
+            events: List of events that led from page_before to current_page
+            current_id: int, the id of current_page in the PTG, located by fingerprint if not provided
+        """
+        if current_id is None:
+            current_id = self._locate_page(current_page)
+        if current_id is not None:
+            reached, page = self.navigator.navigate(current_id, page_before.id)
+            if reached:
+                logger.info(f"Returned to page {page_before.id} by replaying recorded events")
+                return
+            if page is not None:
+                current_page = page
+        return_event_command = self._generate_return_event_command(page_before, current_page, events)
+        self._execute_event_command(return_event_command, current_page)
+
+    def _arrived(self, page, expected):
+        """
+        Check cheaply, without the LLM, whether the device shows the expected page
+        """
+        return self.arrival.match(page, [(expected.id, expected)]) is not None
+
+    def _locate_page(self, page):
+        """
+        Find a PTG page with the same fingerprint, or None
+        """
+        ids = self.ptg_ir.fingerprints.get(page.fingerprint)
+        return ids[-1] if ids else None
             
     def _update_page(self, page):
         """
         Update the page with the current page from the device
         """
         current_page = self.device.dump_page(refresh=True)
+        fingerprint = page.fingerprint
         page.img = current_page.img
         page.vht = current_page.vht
         page.info = current_page.info
+        page.rsc = current_page.rsc
+        self.ptg_ir.refresh_fingerprint(page, fingerprint)
 
     def _is_page_exist(self, current_page):
         """
         Check if the page exists in the PTG
         """
-        for page in reversed(self.ptg_ir.pages):
-            if self._is_pages_same(page, current_page):
-                return page.id
-        return -1
+        candidates = [(page.id, page) for page in reversed(self.ptg_ir.pages)]
+        page_id = self.equivalence.match(current_page, candidates)
+        return -1 if page_id is None else page_id
 
     def _is_pages_same(self, page1, page2):
         """
         Check if the two pages are the same
         """
-        # TODO: need to update the resource comparison
-        if page1.info.ability != page2.info.ability or page1.rsc != page2.rsc:
-            return False
-        else:
-            distance = zss.simple_distance(page1.vht._root, page2.vht._root, get_children=VHTNode.get_children, get_label=VHTNode.get_label)
-            logger.info(f"Distance between page1 and page2: {distance}")
-            distance_value = distance[0] if isinstance(distance, tuple) else distance
-            
-            # TODO: need to update the distance threshold
-            if distance_value < 3:
-                return True
-            elif distance_value > 30:
-                return False
-            else:
-                # When tree structure is similar, use LLM to verify if they are the same interface
-                return self._verify_same_page_with_llm(page1, page2)
+        return self.equivalence.match(page2, [(page1.id, page1)]) is not None
 
     def _verify_same_page_with_llm(self, page1, page2):
         """
@@ -333,9 +383,9 @@ class PTGVerifier:
             SystemMessage(content=verify_same_page_prompt),
             HumanMessage(content=[
                 {"type": "text", "text": "First interface screenshot:"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page1.img)}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page1.encoded_image()}"}},
                 {"type": "text", "text": "Second interface screenshot:"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page2.img)}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page2.encoded_image()}"}},
                 {"type": "text", "text": "Please determine whether these two interfaces are the same interface?"}
             ])
         ]
@@ -368,18 +418,18 @@ class PTGVerifier:
         """
         logger.info("=====================event verify===========================")
         self.device.execute(events)
-        time.sleep(3)
+        self.device.wait_settle(timeout=3)
         current_page = self.device.dump_page(refresh=True)
         messages = [
             SystemMessage(content=verify_ptg_system_prompt),
             HumanMessage(
                 content=[
                     {"type": "text", "text": "First image: PTG before node screenshot"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page_before.img)}"}},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page_before.encoded_image()}"}},
                     {"type": "text", "text": "Second image: PTG after node screenshot"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page_after.img)}"}},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page_after.encoded_image()}"}},
                     {"type": "text", "text": "Third image: screenshot after actual event execution"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(current_page.img)}"}},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{current_page.encoded_image()}"}},
                 ]
             ),
         ]
@@ -418,12 +468,12 @@ class PTGVerifier:
             SystemMessage(content=generate_next_event_prompt),
             HumanMessage(content=[
                 {"type": "text", "text": "First image: page before action"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page_before.img)}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page_before.encoded_image()}"}},
                 {"type": "text", "text": "Second image: page after action"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(page_after.img)}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page_after.encoded_image()}"}},
             ]),
         ]
-        response = llm.invoke(messages)
+        response = llm.invoke(messages, cache=False)
         logger.info(f"Generated next operation command: {response.text()}")
         return response.text()
 
@@ -450,10 +500,10 @@ class PTGVerifier:
                 {"type": "text", "text": "Target page (the page we want to return to, the page before the action is executed). The red boxes mark the locations that were clicked to transition from target page to current page."},
                 {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{marked_image}"}},
                 {"type": "text", "text": "Current page (the page after the action is executed, need to return to the target page)"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(current_page.img)}"}},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{current_page.encoded_image()}"}},
             ]),
         ]
-        response = llm.invoke(messages)
+        response = llm.invoke(messages, cache=False)
         logger.info(f"Generated return operation command: {response.text()}")
         return response.text()
 
@@ -524,7 +574,7 @@ class PTGVerifier:
             ])
             message_history.append(current_message)
             
-            response = phone_llm.invoke(message_history)
+            response = phone_llm.invoke(message_history, cache=False)
 
             parsed_output = action_parser.parse_action_output(response.text(), current_page.img.shape[1], current_page.img.shape[0])
             
@@ -559,7 +609,7 @@ class PTGVerifier:
                 logger.error("No clickable node found")
             
         elif parsed_output["action"] == "type" and parsed_output["content"]:
-            nodes = page.vht._root(clickable='true', focused='true', enabled='true', type='android.widget.EditText')
+            nodes = page.vht(clickable='true', focused='true', enabled='true', type='android.widget.EditText')
             if nodes:
                 new_event = InputEvent(nodes[0], parsed_output["content"])
             else:
@@ -573,7 +623,7 @@ class PTGVerifier:
 
         if new_event:
             new_event.execute()
-            time.sleep(3)
+            self.device.wait_settle(timeout=3)
 
         return new_event
 
@@ -674,70 +724,9 @@ class PTGVerifier:
         Returns:
             VHTNode object, the node extracted from the page
         """
-        def point_in_bounds(x, y, bounds):
-            if not bounds or len(bounds) != 2:
-                return False
-            
-            x1, y1 = bounds[0]
-            x2, y2 = bounds[1]
-            
-            return x1 <= x <= x2 and y1 <= y <= y2
-        
-        def find_node_by_coordinates(vht_node, x, y):
-            candidates = []  
-            
-            def collect_clickable_candidates(node, x, y, candidates_list):
-                if hasattr(node, 'attribute') and 'bounds' in node.attribute:
-                    bounds = node.attribute['bounds']
-                    
-                    # Exclude invalid bounds [0, 0][0, 0] of root node
-                    if bounds == [[0, 0], [0, 0]]:
-                        if hasattr(node, '_children'):
-                            for child in node._children:
-                                collect_clickable_candidates(child, x, y, candidates_list)
-                        return
-                    
-                    if point_in_bounds(x, y, bounds):
-                        # If current node is clickable, add to candidate list
-                        if (hasattr(node, 'attribute') and 
-                            node.attribute.get('clickable') == 'true'):
-                            candidates_list.append(node)
-                        
-                        # Continue searching child nodes
-                        if hasattr(node, '_children'):
-                            for child in node._children:
-                                collect_clickable_candidates(child, x, y, candidates_list)
-            
-            def calculate_area(bounds):
-                if not bounds or len(bounds) != 2:
-                    return float('inf')  # Return infinite area for invalid bounds
-                x1, y1 = bounds[0]
-                x2, y2 = bounds[1]
-                return (x2 - x1) * (y2 - y1)
-            
-            # Collect all candidate nodes
-            collect_clickable_candidates(vht_node, x, y, candidates)
-            
-            # If no candidate nodes, return None
-            if not candidates:
-                return None
-            
-            # Find candidate node with smallest area
-            min_area = float('inf')
-            best_candidate = None
-            
-            for candidate in candidates:
-                if hasattr(candidate, 'attribute') and 'bounds' in candidate.attribute:
-                    area = calculate_area(candidate.attribute['bounds'])
-                    if area < min_area:
-                        min_area = area
-                        best_candidate = candidate
-            
-            return best_candidate
-        
         try:
-            if hasattr(page, 'vht') and hasattr(page.vht, '_root'):
-                return find_node_by_coordinates(page.vht._root, click_x, click_y)
+            if hasattr(page, 'vht') and hasattr(page.vht, 'node_at'):
+                return page.vht.node_at(click_x, click_y, clickable=True)
             else:
                 logger.error("Page does not have valid VHT structure")
                 return None
@@ -40,9 +40,9 @@ class HMBot(object):
             llm = LLM(device=device, url=self.llm_config['base_url'], model=self.llm_config['model'],
                       api_key=self.llm_config['api_key'])
             device.install_app(self.app)
-            time.sleep(5)
+            device.wait_settle(timeout=5)
             device.start_app(self.app)
-            time.sleep(10)
+            device.wait_settle(timeout=10, min_wait=1.0)
 
             output_dir = args.output
             if not output_dir.endswith('/'):
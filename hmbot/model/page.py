@@ -1,5 +1,31 @@
-from .vht import VHT, VHTParser
-from ..utils.cv import write
+from .vht import VHT, VHTParser, LazyVHT
+from ..utils.cv import write, dhash, encoded_images, LazyImage
+from ..utils.proto import Resource, AudioInfo, AudioType, CameraInfo, CameraType, Status
+from dataclasses import asdict, is_dataclass
+import itertools
+
+_img_tokens = itertools.count()
+_vht_tokens = itertools.count()
+
+
+def _rsc_dict(rsc):
+    # Resource and its infos are dataclasses of str enums, so their dict form is plain JSON
+    return asdict(rsc) if is_dataclass(rsc) else rsc
+
+
+def _parse_rsc(data):
+    """
+    Rebuild the Resource of a page from its dict form, or None if it was not stored as one.
+    """
+    if not isinstance(data, dict):
+        return None
+    audio, camera = data.get('audio'), data.get('camera')
+    if audio:
+        audio = AudioInfo(AudioType(audio['type']), Status(audio['stat']))
+    if camera:
+        camera = CameraInfo(CameraType(camera['type']), Status(camera['stat']))
+    return Resource(audio=audio, camera=camera)
+
 
 class Page(object):
     def __init__(self, vht, img, rsc, info, id=0):
@@ -8,7 +34,46 @@ class Page(object):
         self.rsc = rsc
         self.info = info
         self.id = id # extract from vht
+        self._dumped = None
         self._standardize()
+
+    @property
+    def vht(self):
+        """
+        The view hierarchy tree. A LazyVHT is parsed on first access.
+        """
+        if isinstance(self._vht, LazyVHT):
+            self._vht = self._vht.load()
+        return self._vht
+
+    @vht.setter
+    def vht(self, vht):
+        self._vht = vht
+        self._vht_token = next(_vht_tokens)
+
+    @property
+    def img(self):
+        """
+        The screenshot. A LazyImage is decoded on access, and may be evicted back to its compressed bytes.
+        """
+        if isinstance(self._img, LazyImage):
+            return self._img.decode()
+        return self._img
+
+    @img.setter
+    def img(self, img):
+        self._img = img
+        self._img_hash = None
+        self._img_token = next(_img_tokens)
+
+    @property
+    def img_hash(self):
+        """
+        The perceptual hash (dHash) of the screenshot, computed on first use.
+        """
+        if self._img_hash is None and self._img is not None:
+            self._img_hash = dhash(self._img.data if isinstance(self._img, LazyImage) else self._img)
+        return self._img_hash
     
     def _standardize(self):
         if not self.info:
@@ -19,30 +84,61 @@ class Page(object):
                 self.vht = VHT(roots[0])
                 self.info.name = self.vht._root.attribute['page']
 
+    def encoded_image(self, quality=85, max_size=(800, 1400)):
+        """
+        The base64 JPEG of the screenshot for LLM payloads, encoded once per setting
+        and kept in a memory-bounded cache.
+        """
+        image = self._img.decode if isinstance(self._img, LazyImage) else self._img
+        return encoded_images.get(self._img_token, image, quality, max_size)
+
+    @property
+    def fingerprint(self):
+        """
+        The identity of the page layout: the ability and the structure hash of its VHT.
+        Layout-identical screens of the same ability share the fingerprint.
+        """
+        ability = self.info.ability if self.info else ''
+        # a LazyVHT knows its structure hash without being parsed
+        structure = self._vht.structure_hash if self._vht is not None else ''
+        return '%s#%s' % (ability, structure)
+
+    @property
+    def version(self):
+        """
+        Changes whenever the screenshot or the VHT of the page is replaced or its VHT is mutated.
+        """
+        # a LazyVHT is unparsed, hence unchanged since it was dumped
+        generation = self._vht.generation if isinstance(self._vht, VHT) else 0
+        return (self._img_token, self._vht_token, generation)
+
     def __call__(self, **kwds):
         return self.vht(**kwds)
     
     def _dump(self, id, dir_path):
         vht_file = dir_path + str(id) + '.json'
         img_file = dir_path + str(id) + '.png'
-        VHTParser.dump(self.vht, vht_file)
-        write(img_file, self.img)
+        # skip pages written to the same files since their last change
+        if self._dumped != (vht_file, img_file, self.version):
+            VHTParser.dump(self.vht, vht_file)
+            write(img_file, self.img)
+            self._dumped = (vht_file, img_file, self.version)
         return (vht_file, img_file)
     
     def _dict(self, vht_file='', img_file=''):
         return {'vht': vht_file,
                 'img': img_file,
-                'rsc': self.rsc,
-                'ability': self.ability,
-                'audio_type': self.audio_type,
-                'bundle': self.bundle,
+                'rsc': _rsc_dict(self.rsc),
+                'ability': self.info.ability if self.info else '',
+                'audio_type': self.rsc.audio.type if self.rsc and self.rsc.audio else None,
+                'bundle': self.info.bundle if self.info else '',
+                'structure_hash': self._vht.structure_hash if self._vht is not None else '',
                 }
 
     def _is_same(self, page):
-        # todo
-        if self == page:
+        if self is page:
             return True
-        return False
+        return self.fingerprint == page.fingerprint
         if isinstance(new_window, Window):
             vht_sim = self.vht_similarity(new_window)
             img_sim = self.img_similarity(new_window)
@@ -1,16 +1,91 @@
 from hmbot.utils.proto import PageInfo
-from .vht import VHT, VHTNode, VHTParser
-from .page import Page
+from hmbot.utils.cv import LazyImage
+from .vht import VHT, VHTNode, VHTParser, LazyVHT
+from .page import Page, _parse_rsc
 from .event import *
 import json
 import cv2
 
-class PTG(object):
+
+class FingerprintTable(dict):
+    """
+    The ids of the pages of each fingerprint. Pages can be deferred, so that their
+    fingerprints, which may need their hierarchy parsed, are only computed on the first read.
+    """
     def __init__(self):
+        super().__init__()
+        self._pending = []
+
+    def defer(self, page):
+        self._pending.append(page)
+
+    def _flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            for page in pending:
+                dict.setdefault(self, page.fingerprint, []).append(page.id)
+
+    def get(self, key, default=None):
+        self._flush()
+        return dict.get(self, key, default)
+
+    def setdefault(self, key, default=None):
+        self._flush()
+        return dict.setdefault(self, key, default)
+
+    def __getitem__(self, key):
+        self._flush()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._flush()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._flush()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._flush()
+        return dict.__len__(self)
+
+    def keys(self):
+        self._flush()
+        return dict.keys(self)
+
+    def values(self):
+        self._flush()
+        return dict.values(self)
+
+    def items(self):
+        self._flush()
+        return dict.items(self)
+
+
+class PTG(object):
+    """
+    The page transition graph.
+
+    Pages get consecutive ids when they are added, and the graph keeps id-keyed
+    tables that are all updated incrementally: the pages, the forward and reverse
+    adjacency, and the pages of each fingerprint.
+    """
+    def __init__(self, dedupe=True, store=None):
+        """
+        Args:
+            dedupe (bool): Merge pages with the same fingerprint into one node. Without it, the
+                fingerprints of added pages are only computed when the table is first read.
+            store (PTGStore, optional): Persists pages and transitions as they are added.
+        """
         self.main_pages = []
         self.pages = []
-        self._adj_list = {}
+        self.forward = {}
+        self.reverse = {}
+        self.fingerprints = FingerprintTable()
+        self._ids = {}
         self._visited = {}
+        self.dedupe = dedupe
+        self.store = store
     
     def add_main_page(self, page):
         if self.add_page(page):
@@ -19,31 +94,96 @@ class PTG(object):
         return False
 
     def add_page(self, page):
-        if self._is_new_page(page):
-            self.pages.append(page)
-            self._adj_list[page] = {}
-            return True
-        return False
+        """
+        Add a page unless the graph already has it, and assign its id.
+
+        Returns:
+            bool: Whether the page is new.
+        """
+        if not self._is_new_page(page):
+            return False
+        page.id = len(self.pages)
+        self.pages.append(page)
+        self._ids[page] = page.id
+        self.forward[page.id] = {}
+        self.reverse[page.id] = set()
+        if self.dedupe:
+            self.fingerprints.setdefault(page.fingerprint, []).append(page.id)
+        else:
+            # a lazily loaded page keeps its hierarchy unparsed until a lookup needs its fingerprint
+            self.fingerprints.defer(page)
+        if self.store is not None:
+            self.store.put_page(page.id, page)
+        return True
     
     def add_edge(self, src_page, tgt_page, events):
         self.add_page(src_page)
         self.add_page(tgt_page)
-        self._adj_list[src_page][tgt_page] = events
+        self.add_transition(self.id_of(src_page), self.id_of(tgt_page), events)
+
+    def add_transition(self, src_id, tgt_id, events):
+        """
+        Set the events of the transition between two pages of the graph, given their ids.
+        """
+        self.forward[src_id][tgt_id] = events
+        self.reverse[tgt_id].add(src_id)
+        if self.store is not None:
+            self.store.put_edge(src_id, tgt_id, [event._json() for event in events])
+
+    def successors(self, id):
+        """
+        Returns:
+            dict: The ids of the pages reached from a page, mapped to the events of each transition.
+        """
+        return self.forward[id]
+
+    def predecessors(self, id):
+        """
+        Returns:
+            set: The ids of the pages with a transition to a page.
+        """
+        return self.reverse[id]
+
+    def id_of(self, page):
+        """
+        Get the id of the node of the graph that stands for the given page, or None.
+        """
+        id = self._ids.get(page)
+        if id is None and self.dedupe:
+            ids = self.fingerprints.get(page.fingerprint)
+            if ids:
+                id = ids[0]
+        return id
+
+    def refresh_fingerprint(self, page, old_fingerprint):
+        """
+        Re-index a page of the graph whose content was replaced.
+        """
+        ids = self.fingerprints.get(old_fingerprint, [])
+        if page.id in ids:
+            ids.remove(page.id)
+            if not ids:
+                del self.fingerprints[old_fingerprint]
+        self.fingerprints.setdefault(page.fingerprint, []).append(page.id)
+        if self.store is not None:
+            self.store.put_page(page.id, page)
     
     def _is_new_page(self, new_page):
-        for page in self.pages:
-            if page._is_same(new_page):
-                return False
-        return True
+        return self.id_of(new_page) is None
+
+    def _canonical(self, page):
+        """
+        Get the page of the graph that stands for the given page, or None.
+        """
+        id = self.id_of(page)
+        return None if id is None else self.pages[id]
     
     def _json_list(self, dir_path):
         res = []
-        for id in range(len(self.pages)):
-            src_page = self.pages[id]
+        for id, src_page in enumerate(self.pages):
             vht_file, img_file = src_page._dump(id, dir_path)
             edge_list = []
-            for (tgt_page, events) in self._adj_list[src_page].items():
-                tgt_id = self.pages.index(tgt_page)
+            for tgt_id, events in self.forward[id].items():
                 event_list = [event._json() for event in events]
                 edge_dict = {'target_id': tgt_id,
                              'events': event_list}
@@ -91,28 +231,46 @@ class PTGParser(object):
         }
 
     @classmethod
-    def parse(cls, device, dir_path):
+    def parse(cls, device, dir_path, lazy=False):
+        """
+        Load the PTG dumped in dir_path/output.
+
+        Args:
+            device (Device): The device of the pages.
+            dir_path (str): The directory of the dump.
+            lazy (bool): Keep screenshots compressed and hierarchies unparsed until they are used.
+
+        Returns:
+            PTG: The graph.
+        """
         with open(dir_path + 'output/ptg.json', 'r') as f:
             json_data = json.load(f)
-        ptg = PTG()
+        # keep every dumped page, so that the ids in the file stay valid
+        ptg = PTG(dedupe=False)
 
         pages = []
         for item in json_data:
             info = item['info']
             vht_path = info['vht']
             img_path = info['img']
-            rsc = info['rsc']
+            rsc = _parse_rsc(info['rsc'])
             ability = info['ability']
             bundle = info['bundle']
             id = info['id']
-            with open(dir_path + vht_path, 'r') as f:
-                vht_str = f.read()
-            vht_json = json.loads(vht_str)
-            vht = VHTParser._parse_hdc_json(vht_json, device)
-            img = cv2.imread(dir_path + img_path)
+            if lazy:
+                vht = LazyVHT(dir_path + vht_path, device, info.get('structure_hash'))
+                img = LazyImage(dir_path + img_path)
+            else:
+                with open(dir_path + vht_path, 'r') as f:
+                    vht_str = f.read()
+                vht_json = json.loads(vht_str)
+                vht = VHTParser._parse_hdc_json(vht_json, device)
+                img = cv2.imread(dir_path + img_path)
             page_info = PageInfo(bundle=bundle, ability=ability, name=ability)
             page = Page(vht, img, rsc, page_info, id)
             pages.append(page)
+            # add the pages in file order, so that they get the ids of the file
+            ptg.add_page(page)
 
         for item in json_data:
             src_id = item['info']['id']
@@ -120,36 +278,43 @@ class PTGParser(object):
             for edge in item['edge']:
                 tgt_id = edge['target_id']
                 tgt_page = pages[tgt_id]
-                events = []
-                for event in edge['events']:
-                    type = event['type']
-                    if type == 'Click':
-                        node_data = event['node']
-                        attrib = cls._extract_node_attributes(node_data)
-                        node = VHTNode(device, attrib)
-                        event = ClickEvent(node)
-                    elif type == 'LongClick':
-                        node_data = event['node']
-                        attrib = cls._extract_node_attributes(node_data)
-                        node = VHTNode(device, attrib)
-                        event = LongClickEvent(node)
-                    elif type == 'Input':
-                        node_data = event['node']
-                        attrib = cls._extract_node_attributes(node_data)
-                        node = VHTNode(device, attrib)
-                        text = event['node']['text']
-                        event = InputEvent(node, text)
-                    elif type == 'SwipeExt':
-                        event = SwipeExtEvent(device, None, event['direction'])
-                    elif type == 'Key':
-                        event = KeyEvent(device, None, event['key'])
-                    elif type == 'StartApp':
-                        event = StartAppEvent(device, event['app'])
-                    if event:
-                        events.append(event)
+                events = cls._parse_events(device, edge['events'])
                 ptg.add_edge(src_page, tgt_page, events)
         return ptg
 
+    @classmethod
+    def _parse_events(cls, device, event_list):
+        """
+        Rebuild the events of a transition from their JSON form.
+        """
+        events = []
+        for event in event_list:
+            type = event['type']
+            if type == 'Click':
+                node_data = event['node']
+                attrib = cls._extract_node_attributes(node_data)
+                node = VHTNode(device, attrib)
+                event = ClickEvent(node)
+            elif type == 'LongClick':
+                node_data = event['node']
+                attrib = cls._extract_node_attributes(node_data)
+                node = VHTNode(device, attrib)
+                event = LongClickEvent(node)
+            elif type == 'Input':
+                node_data = event['node']
+                attrib = cls._extract_node_attributes(node_data)
+                node = VHTNode(device, attrib)
+                text = event['node']['text']
+                event = InputEvent(node, text)
+            elif type == 'SwipeExt':
+                event = SwipeExtEvent(device, None, event['direction'])
+            elif type == 'Key':
+                event = KeyEvent(device, None, event['key'])
+            elif type == 'StartApp':
+                event = StartAppEvent(device, event['app'])
+            if event:
+                events.append(event)
+        return events
 
     @classmethod
     def dump(cls, ptg, dir_path, indent=2):
@@ -0,0 +1,165 @@
+from hmbot.utils.proto import PageInfo
+from hmbot.utils.cv import encode, LazyImage
+from .vht import VHTParser
+from .page import Page, _rsc_dict, _parse_rsc
+from loguru import logger
+import sqlite3, threading, hashlib, json, time, os
+
+
+class PTGStore(object):
+    """
+    An append-only SQLite store of a page transition graph, written as pages,
+    transitions and events are discovered.
+
+    Every write is committed at once in WAL mode, so checkpoints are cheap and a
+    crashed run loses at most the write in progress. Screenshots are kept once
+    per content in a blob table as JPEG, and a page is only rewritten when it changed.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The SQLite file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._versions = {}
+        # page id -> (screenshot object, blob hash) of the last write, so an unchanged screenshot is not encoded again
+        self._images = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                         'id INTEGER PRIMARY KEY, fingerprint TEXT, bundle TEXT, ability TEXT, rsc TEXT, '
+                         'vht TEXT, img TEXT, meta TEXT, updated REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS edges ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, src INTEGER, tgt INTEGER, '
+                         'events TEXT, operation TEXT, created REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS events ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, created REAL)')
+        self._db.commit()
+
+    def put_page(self, id, page, meta=None):
+        """
+        Write a page unless it is unchanged since it was last written.
+
+        Args:
+            id (int): The id of the page in the graph.
+            page (Page): The page.
+            meta (dict, optional): Extra data of the page, e.g. its summary.
+
+        Returns:
+            bool: Whether the page was written.
+        """
+        version = page.version
+        if self._versions.get(id) == (version, meta):
+            return False
+        img_key, data = self._encode_image(id, page)
+        vht = json.dumps(page.vht._root._json_dict(), ensure_ascii=False) if page.vht is not None else None
+        info = page.info
+        with self._lock:
+            if data is not None:
+                self._db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)', (img_key, sqlite3.Binary(data)))
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (id, page.fingerprint, info.bundle if info else '', info.ability if info else '',
+                              json.dumps(_rsc_dict(page.rsc)), vht, img_key,
+                              json.dumps(meta, ensure_ascii=False) if meta is not None else None, time.time()))
+            self._db.commit()
+        self._versions[id] = (version, meta)
+        return True
+
+    def _encode_image(self, id, page):
+        """
+        Returns:
+            (str, bytes): The blob hash of the screenshot of a page, and its JPEG bytes unless they were written before.
+        """
+        img = page._img
+        if img is None:
+            return None, None
+        last = self._images.get(id)
+        if last is not None and last[0] is img:
+            return last[1], None
+        # compressed screenshots are stored as they are; JPEG encodes an order of magnitude faster than PNG
+        data = img.data if isinstance(img, LazyImage) else encode(img, '.jpg')
+        img_key = hashlib.sha1(data).hexdigest()
+        self._images[id] = (img, img_key)
+        return img_key, data
+
+    def put_edge(self, src_id, tgt_id, events=None, operation=None):
+        """
+        Append a transition.
+
+        Args:
+            src_id (int): The id of the source page.
+            tgt_id (int): The id of the target page.
+            events (list, optional): The JSON form of the events of the transition.
+            operation (str, optional): A description of the operation, for explorers without events.
+        """
+        with self._lock:
+            self._db.execute('INSERT INTO edges (src, tgt, events, operation, created) VALUES (?, ?, ?, ?, ?)',
+                             (src_id, tgt_id, json.dumps(events, ensure_ascii=False) if events is not None else None,
+                              operation, time.time()))
+            self._db.commit()
+
+    def log(self, kind, payload):
+        """
+        Append an event of the run, such as an executed step or a bug.
+
+        Args:
+            kind (str): The kind of the event.
+            payload (dict): Its JSON-serializable data.
+        """
+        with self._lock:
+            self._db.execute('INSERT INTO events (kind, payload, created) VALUES (?, ?, ?)',
+                             (kind, json.dumps(payload, ensure_ascii=False, default=str), time.time()))
+            self._db.commit()
+
+    def events(self, kind=None):
+        """
+        Returns:
+            list: The payloads of the logged events, optionally of one kind, in order.
+        """
+        with self._lock:
+            if kind is None:
+                rows = self._db.execute('SELECT payload FROM events ORDER BY seq').fetchall()
+            else:
+                rows = self._db.execute('SELECT payload FROM events WHERE kind = ? ORDER BY seq', (kind,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def load(self, device):
+        """
+        Rebuild the graph from the store. Later writes of the loaded pages are skipped until they change.
+
+        Returns:
+            PTG: The graph, with pages keeping their stored ids and this store attached.
+        """
+        from .ptg import PTG, PTGParser
+        ptg = PTG(dedupe=False)
+        with self._lock:
+            pages = self._db.execute('SELECT p.id, p.bundle, p.ability, p.rsc, p.vht, p.meta, p.img, b.data FROM pages p '
+                                     'LEFT JOIN blobs b ON p.img = b.hash ORDER BY p.id').fetchall()
+            edges = self._db.execute('SELECT src, tgt, events FROM edges WHERE events IS NOT NULL '
+                                     'ORDER BY seq').fetchall()
+        for id, bundle, ability, rsc, vht, meta, img_key, data in pages:
+            if id != len(ptg.pages):
+                logger.warning(f"PTG store {self.path} has no page {len(ptg.pages)}, stop loading at page {id}")
+                break
+            vht = VHTParser._parse_hdc_json(json.loads(vht), device) if vht else None
+            img = LazyImage(data=data) if data is not None else None
+            page = Page(vht, img, _parse_rsc(json.loads(rsc) if rsc else None), PageInfo(bundle=bundle, ability=ability, name=ability), id)
+            ptg.add_page(page)
+            if img is not None:
+                self._images[id] = (img, img_key)
+            self._versions[id] = (page.version, json.loads(meta) if meta else None)
+        for src_id, tgt_id, events in edges:
+            if src_id < len(ptg.pages) and tgt_id < len(ptg.pages):
+                ptg.add_transition(src_id, tgt_id, PTGParser._parse_events(device, json.loads(events)))
+        ptg.store = self
+        return ptg
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,87 @@
+class SpatialIndex(object):
+    """
+    A uniform grid over the bounds of the nodes of a view hierarchy tree.
+
+    Every node with a non-empty bounds is registered in each cell it overlaps, so
+    point and rectangle queries only look at the nodes of the cells they touch.
+    """
+    def __init__(self, nodes, cols=16, rows=32):
+        """
+        Args:
+            nodes (list): The nodes to index, in preorder.
+            cols (int): The number of grid columns.
+            rows (int): The number of grid rows.
+        """
+        self._entries = []
+        for order, node in enumerate(nodes):
+            if node._x1 is None or node._x2 <= node._x1 or node._y2 <= node._y1:
+                continue
+            area = (node._x2 - node._x1) * (node._y2 - node._y1)
+            self._entries.append((order, area, node))
+        self._cells = {}
+        self._cols, self._rows = cols, rows
+        if not self._entries:
+            self._x0 = self._y0 = 0
+            self._cell_w = self._cell_h = 1
+            return
+        self._x0 = min(node._x1 for _, _, node in self._entries)
+        self._y0 = min(node._y1 for _, _, node in self._entries)
+        width = max(node._x2 for _, _, node in self._entries) - self._x0
+        height = max(node._y2 for _, _, node in self._entries) - self._y0
+        self._cell_w = max(1, -(-width // cols))
+        self._cell_h = max(1, -(-height // rows))
+        for entry in self._entries:
+            node = entry[2]
+            c1, r1 = self._cell(node._x1, node._y1)
+            c2, r2 = self._cell(node._x2, node._y2)
+            for c in range(c1, c2 + 1):
+                for r in range(r1, r2 + 1):
+                    self._cells.setdefault((c, r), []).append(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cell(self, x, y):
+        return (x - self._x0) // self._cell_w, (y - self._y0) // self._cell_h
+
+    def node_at(self, x, y, clickable=True):
+        """
+        Find the smallest node containing a point.
+
+        Args:
+            x (int): The x coordinate of the point.
+            y (int): The y coordinate of the point.
+            clickable (bool): Only consider nodes whose clickable attribute is 'true'.
+
+        Returns:
+            VHTNode: The node with the smallest area, the first in preorder on ties, or None.
+        """
+        best = None
+        for entry in self._cells.get(self._cell(x, y), ()):
+            order, area, node = entry
+            if clickable and node._clickable != 'true':
+                continue
+            if not (node._x1 <= x <= node._x2 and node._y1 <= y <= node._y2):
+                continue
+            if best is None or (area, order) < (best[1], best[0]):
+                best = entry
+        return best[2] if best else None
+
+    def nodes_in(self, x1, y1, x2, y2):
+        """
+        Find the nodes intersecting a rectangle.
+
+        Returns:
+            list: The intersecting nodes in preorder.
+        """
+        c1, r1 = self._cell(x1, y1)
+        c2, r2 = self._cell(x2, y2)
+        found = {}
+        for c in range(max(c1, 0), min(c2, self._cols) + 1):
+            for r in range(max(r1, 0), min(r2, self._rows) + 1):
+                for order, _, node in self._cells.get((c, r), ()):
+                    if order in found:
+                        continue
+                    if node._x1 <= x2 and x1 <= node._x2 and node._y1 <= y2 and y1 <= node._y2:
+                        found[order] = node
+        return [found[order] for order in sorted(found)]
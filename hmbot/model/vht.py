@@ -1,6 +1,16 @@
 import xml.etree.ElementTree as ET
+from collections.abc import MutableMapping
 from ..utils.exception import*
-import json, re
+from .spatial import SpatialIndex
+from loguru import logger
+import json, re, sys, io, time, hashlib
+
+_HDC_BOUNDS_RE = re.compile(r'\[(\d+),\s*(\d+)\]\[(\d+),\s*(\d+)\]')
+_ADB_BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+def _intern(value):
+    # JSON dumps may hold booleans or numbers where strings are expected, which sys.intern rejects
+    return sys.intern(value) if type(value) is str else value
 
 class VHT(object):
     """
@@ -10,63 +20,365 @@ class VHT(object):
         self._root = root
         if compressed:
             self._compress(self._root)
+        # bumped by every mutation of a node of the tree, so that the indexes and the hash know when to rebuild
+        self.generation = 0
+        if root is not None:
+            root._adopt(self)
+        self._index = {}
+        self._index_generation = -1
+        self._spatial = None
+        self._structure_hash = self._hash_structure()
+        self._structure_generation = self.generation
 
     def __str__(self):
         return str(self._root._json_dict())
     
     def __call__(self, **kwds):
-        return self._root(**kwds)
-    
-    def _compress(self, node):
-        if self._assert_compress(node):
-            node._compress(node._children[0])
-            node._children = node._children[0]._children
-            self._compress(node)
-        else:
+        if self._root is None:
+            return []
+        if not kwds:
+            return self._root()
+        self._check_indexes()
+        matches = []
+        for key, value in kwds.items():
+            try:
+                matches.append(self._key_index(key).get(_freeze(value), ()))
+            except TypeError:
+                # the value cannot be indexed, fall back to a walk of the tree
+                return self._root(**kwds)
+        matches.sort(key=len)
+        if len(matches) == 1:
+            return list(matches[0])
+        others = [set(nodes) for nodes in matches[1:]]
+        return [node for node in matches[0] if all(node in other for other in others)]
+
+    @property
+    def structure_hash(self):
+        """
+        A bottom-up (Merkle) hash of the layout of the tree, as a hex string.
+
+        Text, bounds and volatile state (selected, checked, focused) are left out, so
+        screens with the same layout but different content share the hash.
+        """
+        if self._structure_generation != self.generation:
+            self._structure_hash = self._hash_structure()
+            self._structure_generation = self.generation
+        return self._structure_hash
+
+    def _hash_structure(self):
+        if self._root is None:
+            return ''
+        digests = {}
+        stack = [(self._root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node._children)
+                continue
+            h = hashlib.blake2b(digest_size=16)
+            h.update(('%s|%s|%s|%s|%s|%s|%d' % (node._type, node._id, node._clickable, node._longClickable,
+                                                 node._checkable, node._enabled, len(node._children))).encode())
             for child in node._children:
-                self._compress(child)
+                h.update(digests.pop(id(child)))
+            digests[id(node)] = h.digest()
+        return digests[id(self._root)].hex()
+
+    def node_at(self, x, y, clickable=True):
+        """
+        Find the smallest node containing a point, e.g. to map a click back to its widget.
+
+        Args:
+            x (int): The x coordinate of the point.
+            y (int): The y coordinate of the point.
+            clickable (bool): Only consider clickable nodes.
+
+        Returns:
+            VHTNode: The smallest matching node, or None.
+        """
+        return self.spatial_index.node_at(x, y, clickable)
+
+    def nodes_in(self, x1, y1, x2, y2):
+        """
+        Find the nodes whose bounds intersect the rectangle [x1,y1][x2,y2], in preorder.
+        """
+        return self.spatial_index.nodes_in(x1, y1, x2, y2)
+
+    @property
+    def spatial_index(self):
+        self._check_indexes()
+        if self._spatial is None:
+            self._spatial = SpatialIndex(self._root() if self._root is not None else [])
+        return self._spatial
+
+    def _check_indexes(self):
+        if self._index_generation != self.generation:
+            self._index = {}
+            self._spatial = None
+            self._index_generation = self.generation
+
+    def _key_index(self, key):
+        """
+        Get the index of one attribute, mapping each value to its nodes in preorder,
+        building it on first use.
+        """
+        index = self._index.get(key)
+        if index is None:
+            index = {}
+            for node in self._root():
+                value = node._get(key)
+                if value is _MISSING:
+                    continue
+                try:
+                    index.setdefault(_freeze(value), []).append(node)
+                except TypeError:
+                    pass
+            self._index[key] = index
+        return index
+
+    def _compress(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            while self._assert_compress(node):
+                child = node._children[0]
+                node._compress(child)
+                node._children = child._children
+            stack.extend(node._children)
 
     def _assert_compress(self, node):
         if len(node._children) == 1:
-            s_attri = node.attribute
-            c_attri = node._children[0].attribute
-            if s_attri['bounds'] == c_attri['bounds']:
+            if node._has_same_bounds(node._children[0]):
                 return True
         return False
 
     def get_node_count(self):
-        def _count(node):
-            cnt = 1 
-            for child in getattr(node, "_children", []):
-                cnt += _count(child)
-            return cnt
-
         if self._root is None:
             return 0
-        return _count(self._root)
-    
+        count = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node._children)
+        return count
+
+
+_STR_SLOTS = {'bundle': '_bundle', 'page': '_page', 'clickable': '_clickable', 'longClickable': '_longClickable',
+              'selected': '_selected', 'checkable': '_checkable', 'checked': '_checked', 'type': '_type',
+              'id': '_id', 'text': '_text', 'enabled': '_enabled', 'focused': '_focused'}
+_KEYS = ('bundle', 'page', 'bounds', 'clickable', 'longClickable', 'selected', 'checkable', 'checked',
+         'type', 'id', 'text', 'enabled', 'focused', 'center')
+_FLAG_SLOTS = ('_clickable', '_longClickable', '_selected', '_checkable', '_checked', '_focused', '_enabled')
+_MISSING = object()
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+
+
+class VHTAttribute(MutableMapping):
+    """
+    A dict-like view of the attributes of a VHTNode, so that node.attribute[...] keeps working
+    although the node stores its attributes in slots.
+    """
+    __slots__ = ('_node',)
+
+    def __init__(self, node):
+        self._node = node
+
+    def __getitem__(self, key):
+        value = self._node._get(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._node._get(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self._node._get(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._node._set(key, value)
+        self._node._touch()
+
+    def __delitem__(self, key):
+        if self._node._get(key) is _MISSING:
+            raise KeyError(key)
+        self._node._set(key, _MISSING)
+        self._node._touch()
+
+    def __iter__(self):
+        node = self._node
+        for key in _KEYS:
+            if node._get(key) is not _MISSING:
+                yield key
+        if node._extra:
+            for key in node._extra:
+                if key not in _KEYS:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
 
 class VHTNode(object):
     """
     The class describes a node of view hierarchy tree
+
+    Attributes are kept in slots, with bounds as four ints and repeated strings interned,
+    and are exposed as a mapping through node.attribute.
     """
+    __slots__ = ('_bundle', '_page', '_clickable', '_longClickable', '_selected', '_checkable', '_checked',
+                 '_type', '_id', '_text', '_enabled', '_focused', '_x1', '_y1', '_x2', '_y2', '_center',
+                 '_extra', '_children', '_device', '_compressed_nodes', '_tree')
+
     def __init__(self, device=None, attrib={}, **extra):
         if not isinstance(attrib, dict):
             raise TypeError("attrib must be dict, not %s" % (attrib.__class__.__name__,))
-        self.attribute = {**attrib, **extra}
+        for slot in _STR_SLOTS.values():
+            setattr(self, slot, None)
+        self._x1 = self._y1 = self._x2 = self._y2 = None
+        self._center = None
+        self._extra = None
         self._children = []
         self._device = device
-        self._compressed = set()
+        self._compressed_nodes = None
+        self._tree = None
+        for key, value in attrib.items():
+            self._set(key, value)
+        for key, value in extra.items():
+            self._set(key, value)
+
+    @classmethod
+    def _make(cls, device, bundle, page, x1, y1, x2, y2, clickable, longClickable, selected,
+              checkable, checked, type, id, text, enabled, focused):
+        """
+        Build a node from parsed values, bypassing the generic attribute handling.
+        """
+        intern = _intern
+        node = cls.__new__(cls)
+        node._bundle = intern(bundle)
+        node._page = intern(page)
+        node._clickable = intern(clickable)
+        node._longClickable = intern(longClickable)
+        node._selected = intern(selected)
+        node._checkable = intern(checkable)
+        node._checked = intern(checked)
+        node._type = intern(type)
+        node._id = intern(id)
+        node._text = text
+        node._enabled = intern(enabled)
+        node._focused = intern(focused)
+        node._x1, node._y1, node._x2, node._y2 = x1, y1, x2, y2
+        node._center = None
+        node._extra = None
+        node._children = []
+        node._device = device
+        node._compressed_nodes = None
+        node._tree = None
+        return node
+
+    def _adopt(self, tree):
+        """
+        Make a VHT the tree of this node and its descendants, whose mutations then bump its generation.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._tree = tree
+            stack.extend(node._children)
+
+    def _touch(self):
+        if self._tree is not None:
+            self._tree.generation += 1
+
+    @property
+    def attribute(self):
+        return VHTAttribute(self)
+
+    @property
+    def _compressed(self):
+        if self._compressed_nodes is None:
+            return set()
+        return self._compressed_nodes
+
+    def _get(self, key):
+        slot = _STR_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return _MISSING if value is None else value
+        if key == 'bounds' and self._x1 is not None:
+            return [[self._x1, self._y1], [self._x2, self._y2]]
+        if key == 'center':
+            if self._center is not None:
+                return list(self._center)
+            if self._x1 is not None:
+                return [int((self._x1 + self._x2) / 2), int((self._y1 + self._y2) / 2)]
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        return _MISSING
+
+    def _set(self, key, value):
+        slot = _STR_SLOTS.get(key)
+        if slot is not None:
+            if value is _MISSING:
+                value = None
+            elif key != 'text':
+                value = _intern(value)
+            setattr(self, slot, value)
+            return
+        if self._extra:
+            self._extra.pop(key, None)
+        if key == 'bounds':
+            self._x1 = self._y1 = self._x2 = self._y2 = None
+            if value is _MISSING:
+                return
+            try:
+                (x1, y1), (x2, y2) = value
+                self._x1, self._y1, self._x2, self._y2 = int(x1), int(y1), int(x2), int(y2)
+                return
+            except (TypeError, ValueError):
+                pass
+        elif key == 'center':
+            self._center = None
+            if value is _MISSING:
+                return
+            try:
+                x, y = value
+                self._center = (int(x), int(y))
+                return
+            except (TypeError, ValueError):
+                pass
+        if value is _MISSING:
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def _has_same_bounds(self, node):
+        if self._x1 is not None and node._x1 is not None:
+            return (self._x1, self._y1, self._x2, self._y2) == (node._x1, node._y1, node._x2, node._y2)
+        return self._get('bounds') == node._get('bounds')
 
     def __str__(self):
         return str(self.attribute)
-    
+
     def __len__(self):
         return len(self._children)
-    
+
     def __getitem__(self, index):
         return self._children[index]
-    
+
     def __setitem__(self, index, node):
         if isinstance(index, slice):
             for child in node:
@@ -74,27 +386,40 @@ class VHTNode(object):
         else:
             self._assert_is_node(node)
         self._children[index] = node
-    
+        if self._tree is not None:
+            for child in (node if isinstance(index, slice) else [node]):
+                child._adopt(self._tree)
+        self._touch()
+
     def __delitem__(self, index):
         del self._children[index]
-    
+        self._touch()
+
     def __call__(self, **kwds):
         nodes = []
-        if self._satisfy(kwds):
-            nodes.append(self)
-        for child in self._children:
-            nodes.extend(child(**kwds))
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._satisfy(kwds):
+                nodes.append(node)
+            stack.extend(reversed(node._children))
         return nodes
-    
+
     def append(self, node):
         self._assert_is_node(node)
         self._children.append(node)
-    
+        if self._tree is not None:
+            node._adopt(self._tree)
+        self._touch()
+
     def extend(self, nodes):
         for node in nodes:
             self._assert_is_node(node)
             self._children.append(node)
-    
+            if self._tree is not None:
+                node._adopt(self._tree)
+        self._touch()
+
     def _assert_is_node(self, node):
         if not isinstance(node, VHTNode):
             raise TypeError('expected a VHTNode, not %s' % type(node).__name__)
@@ -107,31 +432,35 @@ class VHTNode(object):
         }
 
     def _json(self):
-        attribute = self.attribute
-        attribute['bounds'] = ''.join([str(sublist) for sublist in self.attribute['bounds']])
-        attribute['center'] = str(attribute['center'])
+        attribute = dict(self.attribute.items())
+        if 'bounds' in attribute:
+            attribute['bounds'] = ''.join([str(sublist) for sublist in attribute['bounds']])
+        if 'center' in attribute:
+            attribute['center'] = str(attribute['center'])
         return attribute
-    
+
     def _satisfy(self, attrib):
         for key, value in attrib.items():
-            if key not in self.attribute or self.attribute[key] != value:
+            if self._get(key) != value:
                 return False
         return True
-    
+
     def _compress(self, node):
-        for (key, value) in self.attribute.items():
-             if key in ['clickable', 'longClickable', 'selected', 'checkable', 'checked', 'focused', 'enabled']:
-                if value == 'true' or node.attribute[key] == 'true':
-                    self.attribute[key] = 'true'
-        if self.attribute['text'] == '':
-            self.attribute['text'] = node.attribute['text']
-        elif node.attribute['text'] not in self.attribute['text']:
-            self.attribute['text'] += ',' + node.attribute['text']
-        if node.attribute['type'] not in self.attribute['type']:
-            self.attribute['type'] = node.attribute['type']
-        self._compressed.add(node)
-        self._compressed.add(self)
-    
+        for slot in _FLAG_SLOTS:
+            value = getattr(self, slot)
+            if value is not None and (value == 'true' or getattr(node, slot) == 'true'):
+                setattr(self, slot, 'true')
+        if self._text == '':
+            self._text = node._text
+        elif node._text not in self._text:
+            self._text += ',' + node._text
+        if node._type not in self._type:
+            self._type = node._type
+        if self._compressed_nodes is None:
+            self._compressed_nodes = set()
+        self._compressed_nodes.add(node)
+        self._compressed_nodes.add(self)
+
     def click(self):
         x, y = self.attribute['center']
         self._device.click(x, y)
@@ -143,19 +472,58 @@ class VHTNode(object):
     def input(self, text):
         self._device.input(self, text)
 
+    def get_label(self):
+        return self._type
+
     def get_children(self):
-        if self.attribute['bundle'] == 'com.android.systemui':
+        if self._bundle == 'com.android.systemui':
             return []
         # if self.attribute['type'] and ('Layout' not in self.attribute['type'] and 'Group' not in self.attribute['type']):
         #     return []
         return self._children
-    
-    
+
+
+
+class LazyVHT(object):
+    """
+    A view hierarchy tree dumped to a JSON file, parsed on first use.
+    """
+    def __init__(self, path, device, structure_hash=None):
+        """
+        Args:
+            path (str): The VHT JSON file.
+            device (Device): The device of the nodes.
+            structure_hash (str, optional): The structure hash recorded when the tree was dumped,
+                so that fingerprints are known without parsing.
+        """
+        self.path = path
+        self.device = device
+        self._structure_hash = structure_hash
+        self._vht = None
+
+    @property
+    def structure_hash(self):
+        if self._structure_hash is None:
+            # dumps without a recorded hash are parsed once, and load() keeps the tree
+            self._structure_hash = self.load().structure_hash
+        return self._structure_hash
+
+    def load(self):
+        """
+        Returns:
+            VHT: The parsed tree.
+        """
+        if self._vht is None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._vht = VHTParser._parse_hdc_json(json.load(f), self.device)
+        return self._vht
 
 class VHTParser(object):
     """
     The class describes a parser for view hierarchy tree
     """
+    last_stats = {}
+
     def __init__(self):
         pass
 
@@ -177,95 +545,101 @@ class VHTParser(object):
     
     @classmethod
     def _parse_hdc_json(cls, source, device):
-        root = VHTParser.__parse_hdc_json(source, device)
+        start = time.perf_counter()
+        root, count = VHTParser.__parse_hdc_json(source, device)
+        cls._report(count, start)
         return VHT(root)
 
     @classmethod
     def __parse_hdc_json(cls, source, device):
-        if 'attributes' in source:
+        # Walk the decoded JSON with an explicit stack, so deep trees cannot overflow the call stack.
+        root = None
+        count = 0
+        stack = [(source, None)]
+        while stack:
+            source, parent = stack.pop()
+            if 'attributes' not in source:
+                raise JsonKeyError('expected key: attributes')
             extra = source['attributes']
-            bound_re = r'\[(\d+),\s*(\d+)\]\[(\d+),\s*(\d+)\]'
-            match = re.match(bound_re, extra['bounds'])
+            match = _HDC_BOUNDS_RE.match(extra['bounds'])
             if match:
                 (x1, y1, x2, y2) = map(int, match.groups())
-            else: 
+            else:
                 raise BoundsError('%s is not in form [x1,y1][x2,y2]' % extra['bounds'])
-            attrib = {'bundle': '', 'page': ''}
+            bundle, page = '', ''
             if 'bundleName' in extra:
-                attrib['bundle'] = extra['bundleName']
-                attrib['page'] = extra['pagePath']
-
-            root = VHTNode(device=device,
-                           attrib=attrib,
-                           bounds = [[x1,y1],[x2,y2]],
-                           clickable = extra['clickable'],
-                           longClickable = extra['longClickable'],
-                           selected = extra['selected'],
-                           checkable = extra['checkable'],
-                           checked = extra['checked'],
-                           type = extra['type'],
-                           id = extra['id'],
-                           text = extra['text'],
-                           enabled = extra['enabled'],
-                           focused = extra['focused'],
-                           center = [int((x1 + x2)/2), int((y1 + y2)/2)])
+                bundle = extra['bundleName']
+                page = extra['pagePath']
+            elif 'bundle' in extra:
+                # a tree dumped by VHTParser.dump or a PTGStore keeps the attribute names
+                bundle = extra['bundle']
+                page = extra.get('page', '')
+            node = VHTNode._make(device, bundle, page, x1, y1, x2, y2,
+                                 extra['clickable'], extra['longClickable'], extra['selected'],
+                                 extra['checkable'], extra['checked'], extra['type'], extra['id'],
+                                 extra['text'], extra['enabled'], extra['focused'])
+            count += 1
+            if parent is None:
+                root = node
+            else:
+                parent._children.append(node)
             if 'children' in source:
-                children = source['children']
-                for child in children:
-                    root.append(VHTParser.__parse_hdc_json(child, device))
-            return root
-        else:
-            raise JsonKeyError('expected key: attributes')
+                for child in reversed(source['children']):
+                    stack.append((child, node))
+        return root, count
 
     @classmethod
     def _parse_adb_xml(cls, source, device):
-        source = ET.fromstring(source)
-        root = VHTParser.__parse_adb_xml(source, device)
+        start = time.perf_counter()
+        root, count = VHTParser.__parse_adb_xml(source, device)
+        cls._report(count, start)
         return VHT(root)
 
     @classmethod
     def __parse_adb_xml(cls, source, device):
-        attrib = {'bundle': '', 'page': ''}
-        if source.tag == 'hierarchy':
-            root = VHTNode(device=device,
-                           attrib=attrib,
-                           bounds = [[0,0],[0,0]],
-                           clickable = '',
-                           longClickable = '',
-                           selected = '',
-                           checkable = '',
-                           checked = '',
-                           type = '',
-                           id = '',
-                           text = '',
-                           enabled = '',
-                           focused = '',
-                           center = [0,0])
-        elif source.tag == 'node':
-            extra = source.attrib
-            bound_re = '\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]'
-            match = re.match(bound_re, extra['bounds'])
-            if match:
-                (x1, y1, x2, y2) = map(int, match.groups())
-                if x1 == 2147483647 and y1 == 2147483647 and x2 == -2147483648 and y2 == -2147483648:
+        # Build the nodes while the XML is being read, and drop every element once it is closed.
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        root = None
+        count = 0
+        stack = []
+        for event, elem in ET.iterparse(io.BytesIO(source), events=('start', 'end')):
+            if event == 'end':
+                stack.pop()
+                elem.clear()
+                continue
+            parent = stack[-1] if stack else None
+            if elem.tag == 'hierarchy':
+                node = VHTNode._make(device, '', '', 0, 0, 0, 0, '', '', '', '', '', '', '', '', '', '')
+            elif elem.tag == 'node':
+                extra = elem.attrib
+                match = _ADB_BOUNDS_RE.match(extra['bounds'])
+                if match:
+                    (x1, y1, x2, y2) = map(int, match.groups())
+                    if x1 == 2147483647 and y1 == 2147483647 and x2 == -2147483648 and y2 == -2147483648:
+                        x1, y1, x2, y2 = 0, 0, 100, 100
+                else:
                     x1, y1, x2, y2 = 0, 0, 100, 100
-            else: 
-                x1, y1, x2, y2 = 0, 0, 100, 100
-            attrib['bundle'] = extra['package']
-            root = VHTNode(device=device,
-                           attrib=attrib,
-                           bounds = [[x1,y1],[x2,y2]],
-                           clickable = extra['clickable'],
-                           longClickable = extra['long-clickable'],
-                           selected = extra['selected'],
-                           checkable = extra['checkable'],
-                           checked = extra['checked'],
-                           type = extra['class'],
-                           id = extra['resource-id'],
-                           text = extra['text'],
-                           enabled = extra['enabled'],
-                           focused =  extra['focused'],
-                           center = [int((x1 + x2)/2), int((y1 + y2)/2)])
-        for child in source:
-            root.append(VHTParser.__parse_adb_xml(child, device))
-        return root
\ No newline at end of file
+                node = VHTNode._make(device, extra['package'], '', x1, y1, x2, y2,
+                                     extra['clickable'], extra['long-clickable'], extra['selected'],
+                                     extra['checkable'], extra['checked'], extra['class'], extra['resource-id'],
+                                     extra['text'], extra['enabled'], extra['focused'])
+            else:
+                # unknown elements are skipped, their children belong to the enclosing node
+                stack.append(parent)
+                continue
+            count += 1
+            if parent is None:
+                root = node
+            else:
+                parent._children.append(node)
+            stack.append(node)
+        return root, count
+
+    @classmethod
+    def _report(cls, count, start):
+        elapsed = time.perf_counter() - start
+        cls.last_stats = {'nodes': count,
+                          'seconds': elapsed,
+                          'nodes_per_second': count / elapsed if elapsed > 0 else float('inf')}
+        logger.debug('parsed %d nodes in %.3fs (%.0f nodes/s)' % (count, elapsed, cls.last_stats['nodes_per_second']))
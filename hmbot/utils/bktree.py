@@ -0,0 +1,105 @@
+class BKTree(object):
+    """
+    A Burkhard-Keller tree over a discrete metric, e.g. the Hamming distance of image hashes.
+
+    Lookups of every key within distance k only visit the subtrees whose edge
+    distance lies in [d - k, d + k], instead of comparing against every key.
+    """
+    def __init__(self, distance=lambda a, b: a - b):
+        """
+        Args:
+            distance (callable): The metric of two keys, returning a non-negative int.
+        """
+        self.distance = distance
+        self._root = None
+        self._size = 0
+        self._removed = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value=None):
+        """
+        Add a key and the value it stands for, e.g. the hash of a page and the page index.
+        """
+        entry = [key, value, {}, True]
+        self._size += 1
+        if self._root is None:
+            self._root = entry
+            return
+        node = self._root
+        while True:
+            d = self.distance(key, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = entry
+                return
+            node = child
+
+    def remove(self, key, value=None):
+        """
+        Remove an entry added with the key and value. Entries are only marked as removed,
+        as the tree cannot be re-linked around them, and the tree is rebuilt from the live
+        entries once the removed ones outnumber them.
+
+        Returns:
+            bool: Whether the entry was found.
+        """
+        node = self._root
+        while node is not None:
+            d = self.distance(key, node[0])
+            if d == 0 and node[3] and node[1] == value:
+                node[3] = False
+                self._size -= 1
+                self._removed += 1
+                if self._removed > self._size:
+                    self._rebuild()
+                return True
+            node = node[2].get(d)
+        return False
+
+    def _rebuild(self):
+        entries = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            if node[3]:
+                entries.append((node[0], node[1]))
+            stack.extend(node[2].values())
+        self._root = None
+        self._size = 0
+        self._removed = 0
+        for key, value in entries:
+            self.add(key, value)
+
+    def find(self, key, k):
+        """
+        Find every entry within distance k of key.
+
+        Returns:
+            list: (distance, key, value) tuples sorted by distance.
+        """
+        found = []
+        if self._root is None:
+            return found
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = self.distance(key, node[0])
+            if d <= k and node[3]:
+                found.append((d, node[0], node[1]))
+            for edge, child in node[2].items():
+                if d - k <= edge <= d + k:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def nearest(self, key, k):
+        """
+        Find the nearest entry within distance k of key.
+
+        Returns:
+            (int, object, object): The (distance, key, value) of the entry, or None.
+        """
+        found = self.find(key, k)
+        return found[0] if found else None
@@ -3,6 +3,9 @@ import numpy as np
 import time
 import math
 import base64
+import threading
+import os
+from collections import OrderedDict
 
 def read(img_path):
     img = cv2.imread(img_path, cv2.IMREAD_COLOR)
@@ -11,6 +14,16 @@ def read(img_path):
 def write(img_path, img):
     cv2.imwrite(img_path, img)
 
+def decode(buf):
+    """Decode encoded image bytes (JPEG, PNG) into a BGR image without touching the filesystem."""
+    return cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def encode(img, ext='.png'):
+    """Encode a BGR image into image bytes (PNG by default). Already encoded bytes are returned as they are."""
+    if isinstance(img, (bytes, bytearray)):
+        return bytes(img)
+    return cv2.imencode(ext, img)[1].tobytes()
+
 def _crop(img, bound):
     (x1, y1), (x2, y2) = bound
     return img[y1:y2, x1:x2]
@@ -39,3 +52,170 @@ def encode_image(image, quality=85, max_size=(800, 1400)):
     encoded_image = base64.b64encode(buffer).decode('utf-8')
     return encoded_image
 
+
+
+class EncodedImageCache(object):
+    """
+    A memory-bounded LRU cache of encode_image results, keyed by an image token and the encoding settings.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): The total size of the cached base64 strings before the least recently used are evicted.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token, image, quality=85, max_size=(800, 1400)):
+        """
+        Get the base64 JPEG of an image, encoding it on a miss.
+
+        Args:
+            token (object): A hashable value that identifies the image content, e.g. one per screenshot.
+            image (ndarray | callable): The image, or a function returning it, used only on a miss.
+
+        Returns:
+            str: The base64 encoded image.
+        """
+        key = (token, quality, tuple(max_size))
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                return encoded
+        if callable(image):
+            image = image()
+        encoded = encode_image(image, quality, max_size)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = encoded
+                self.size += len(encoded)
+                while self.size > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return encoded
+
+encoded_images = EncodedImageCache()
+
+
+class DecodedImageCache(object):
+    """
+    A memory-bounded LRU of decoded LazyImage arrays. Evicted images keep only their compressed bytes.
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): The total size of the decoded arrays before the least recently used are evicted.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image):
+        """
+        Get the decoded array of a LazyImage, decoding it on a miss.
+        """
+        # entries hold their image, so its id is not reused while it is cached
+        key = id(image)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+        array = decode(image.data)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1].nbytes
+            self._entries[key] = (image, array)
+            self.size += array.nbytes
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+        return array
+
+    def discard(self, image):
+        with self._lock:
+            entry = self._entries.pop(id(image), None)
+            if entry is not None:
+                self.size -= entry[1].nbytes
+
+
+decoded_images = DecodedImageCache(int(os.getenv('HMBOT_DECODED_IMAGE_BYTES', 512 * 1024 * 1024)))
+
+
+class LazyImage(object):
+    """
+    A screenshot kept as its compressed file bytes, read on first use and decoded on demand
+    into the shared, memory-bounded decoded_images cache.
+    """
+    def __init__(self, path=None, data=None):
+        """
+        Args:
+            path (str, optional): The image file, read on first use.
+            data (bytes, optional): The compressed image bytes.
+        """
+        self.path = path
+        self._data = data
+
+    @property
+    def data(self):
+        if self._data is None:
+            with open(self.path, 'rb') as f:
+                self._data = f.read()
+        return self._data
+
+    def decode(self):
+        """
+        Returns:
+            ndarray: The decoded BGR image.
+        """
+        return decoded_images.get(self)
+
+
+class ImageHash(object):
+    """
+    A perceptual hash of an image; subtracting two hashes gives their Hamming distance.
+    """
+    __slots__ = ('value', 'bits')
+
+    def __init__(self, value, bits=64):
+        self.value = value
+        self.bits = bits
+
+    def __sub__(self, other):
+        return bin(self.value ^ other.value).count('1')
+
+    def __eq__(self, other):
+        return isinstance(other, ImageHash) and self.value == other.value and self.bits == other.bits
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return '%0*x' % ((self.bits + 3) // 4, self.value)
+
+def dhash(image, size=8):
+    """
+    Compute the difference hash (dHash) of an image.
+
+    Args:
+        image (ndarray): A BGR or gray image.
+        size (int): The hash has size * size bits.
+
+    Returns:
+        ImageHash: The hash, or None if the image is empty.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = decode(image)
+    if image is None or image.size == 0:
+        return None
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    value = 0
+    for bit in (small[:, 1:] > small[:, :-1]).flatten():
+        value = (value << 1) | int(bit)
+    return ImageHash(value, size * size)
@@ -14,4 +14,7 @@ class HDCError(Exception):
     pass
 
 class ADBError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ShellSessionError(Exception):
+    pass
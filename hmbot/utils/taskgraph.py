@@ -0,0 +1,48 @@
+class TaskGraph(object):
+    """
+    A small dependency graph of tasks run on a thread pool.
+
+    Each task starts as soon as the tasks it depends on have finished, and gets
+    their results as its first positional arguments.
+    """
+    def __init__(self, executor):
+        """
+        Args:
+            executor (ThreadPoolExecutor): The pool to run on. It needs a worker for every
+                task that can wait at the same time.
+        """
+        self.executor = executor
+        self._futures = {}
+
+    def add(self, name, fn, *args, deps=(), **kwargs):
+        """
+        Add a task.
+
+        Args:
+            name (str): The name of the task.
+            fn (callable): The function to run.
+            deps (tuple): The names of the tasks whose results are passed to fn before args.
+
+        Returns:
+            concurrent.futures.Future: The future of the task.
+        """
+        if name in self._futures:
+            raise ValueError('duplicate task: %s' % name)
+        for dep in deps:
+            if dep not in self._futures:
+                raise ValueError('task %s depends on unknown task %s' % (name, dep))
+        dep_futures = [self._futures[dep] for dep in deps]
+
+        def run():
+            results = [future.result() for future in dep_futures]
+            return fn(*results, *args, **kwargs)
+
+        future = self.executor.submit(run)
+        self._futures[name] = future
+        return future
+
+    def result(self, name, timeout=None):
+        """
+        Wait for a task and return its result, raising its exception if it failed.
+        """
+        return self._futures[name].result(timeout)
@@ -0,0 +1,303 @@
+"""
+Bounded tree edit distance between view hierarchy trees.
+
+The distance is the unit-cost Zhang-Shasha distance with node types as labels,
+the same as zss.simple_distance(..., get_label=VHTNode.get_label), but callers
+give a bound k and only learn the exact distance when it is at most k: larger
+distances are reported as k + 1. That allows these shortcuts:
+
+- cheap lower bounds (node counts and label histograms) reject far trees
+  without running the dynamic program at all;
+- the dynamic program only fills cells whose forests differ in size by at
+  most k, and caps every value at k + 1. Cells outside the band are at least
+  k + 1 apart, so leaving them capped is exact;
+- a mapping keeps the postorder of the mapped nodes, so a mapping of cost at
+  most k only splits both trees at postorder positions (counted from either
+  end) at most k apart. Cells of other splits are left capped, and keyroot
+  pairs with no such cell are skipped;
+- the smallest value of the band grows from one row of a forest to the next,
+  so a keyroot pair stops as soon as a whole row exceeds k.
+
+`python -m hmbot.utils.ted --bench` times the distance of VHT-shaped trees of
+201 to 1601 nodes to a copy with 5 random edits, with k = 30.
+"""
+from collections import Counter
+
+
+def _postorder(vht):
+    """
+    Flatten a tree into postorder arrays.
+
+    Returns:
+        (list, list, list): The labels, the index of the leftmost leaf of each subtree,
+            and the keyroots, all 1-indexed (index 0 is unused).
+    """
+    labels = [None]
+    leftmost = [0]
+    root = vht._root
+    if root is None:
+        return labels, leftmost, []
+    stack = [(root, False)]
+    # the postorder index of the first node emitted below each open subtree
+    firsts = []
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            firsts.append(len(labels))
+            stack.extend((child, False) for child in reversed(node.get_children()))
+            continue
+        labels.append(node._type)
+        leftmost.append(firsts.pop())
+    seen = set()
+    keyroots = []
+    for i in range(len(labels) - 1, 0, -1):
+        if leftmost[i] not in seen:
+            seen.add(leftmost[i])
+            keyroots.append(i)
+    keyroots.reverse()
+    return labels, leftmost, keyroots
+
+
+def lower_bound(labels1, labels2):
+    """
+    A lower bound of the distance of two trees given their labels: every node of the
+    larger tree that cannot be paired with a node of the same label costs at least one.
+    """
+    n1, n2 = len(labels1), len(labels2)
+    if n1 == 0 or n2 == 0:
+        return max(n1, n2)
+    common = sum((Counter(labels1) & Counter(labels2)).values())
+    return max(n1, n2) - common
+
+
+def tree_distance(vht1, vht2, k=30):
+    """
+    Compute the bounded tree edit distance of two view hierarchy trees.
+
+    Args:
+        vht1 (VHT): The first tree.
+        vht2 (VHT): The second tree.
+        k (int): The bound; None computes the exact distance.
+
+    Returns:
+        int: The distance if it is at most k, else k + 1.
+    """
+    labels1, leftmost1, keyroots1 = _postorder(vht1)
+    labels2, leftmost2, keyroots2 = _postorder(vht2)
+    n1, n2 = len(labels1) - 1, len(labels2) - 1
+    if k is None:
+        k = n1 + n2
+    cap = k + 1
+    if abs(n1 - n2) > k or lower_bound(labels1[1:], labels2[1:]) > k:
+        return cap
+    if n1 == 0 or n2 == 0:
+        return min(max(n1, n2), cap)
+
+    treedist = [[cap] * (n2 + 1) for _ in range(n1 + 1)]
+    # one forest table is shared by the passes, each only reading cells it wrote itself
+    forest = [[cap] * (n2 + 2) for _ in range(n1 + 2)]
+    bounds = [(0, 0)] * (n1 + 2)
+    # A pass over a keyroot pair fills the distances of the subtrees on the leftmost paths of both
+    # keyroots, nodes li..i and lj..j. Only nodes ix, jy with ix - jy in [low, high] can be matched
+    # by a mapping of cost at most k, so passes whose nodes are all outside that range are skipped.
+    low, high = max(-k, n1 - n2 - k), min(k, n1 - n2 + k)
+    for i in keyroots1:
+        li = leftmost1[i]
+        for j in keyroots2:
+            lj = leftmost2[j]
+            if li - j > high or i - lj < low:
+                continue
+            _forest_distance(labels1, leftmost1, labels2, leftmost2, treedist, forest, bounds,
+                             li, i, lj, j, k, cap, low, high)
+    return treedist[n1][n2]
+
+
+def _forest_distance(labels1, leftmost1, labels2, leftmost2, treedist, forest, bounds, li, i, lj, j, k, cap, low, high):
+    """
+    Fill the forest distances of one keyroot pair. Row x of the pass only holds the cells from
+    bounds[x][0] to bounds[x][1], with a capped cell on each side; the first column is x while x <= k.
+    """
+    rows, cols = i - li + 2, j - lj + 2
+    top = forest[0]
+    last = min(cols - 1, k)
+    for y in range(last + 1):
+        top[y] = y
+    if last + 1 < cols:
+        top[last + 1] = cap
+    bounds[0] = (1, last)
+    for x in range(1, rows):
+        ix = li + x - 1
+        lx = leftmost1[ix]
+        label = labels1[ix]
+        row, above = forest[x], forest[x - 1]
+        first = max(1, x - k, ix - high - lj + 1)
+        last = min(cols - 1, x + k, ix - low - lj + 1)
+        row[0] = x if x <= k else cap
+        if 1 < first <= cols:
+            row[first - 1] = cap
+        if 0 < last + 1 < cols:
+            row[last + 1] = cap
+        bounds[x] = (first, last)
+        for y in range(first, last + 1):
+            jy = lj + y - 1
+            ly = leftmost2[jy]
+            cost = row[y - 1] + 1
+            if above[y] + 1 < cost:
+                cost = above[y] + 1
+            if lx == li and ly == lj:
+                change = above[y - 1] + (label != labels2[jy])
+                if change < cost:
+                    cost = change
+                if cost > cap:
+                    cost = cap
+                row[y] = cost
+                treedist[ix][jy] = cost
+            else:
+                fx, fy = lx - li, ly - lj
+                if fy == 0:
+                    change = fx if fx <= k else cap
+                else:
+                    fy_first, fy_last = bounds[fx]
+                    change = forest[fx][fy] if fy_first <= fy <= fy_last else cap
+                change += treedist[ix][jy]
+                if change < cost:
+                    cost = change
+                row[y] = cost if cost < cap else cap
+        # the rows below never go under the smallest value of this one, and cells left at cap are exact
+        if row[0] >= cap and (first > last or min(row[first:last + 1]) >= cap):
+            return
+
+
+def _random_check(trials=500, seed=0):
+    """
+    Compare tree_distance against zss.simple_distance on random trees for several bounds.
+
+    Returns:
+        int: The number of mismatches.
+    """
+    import random
+    import zss
+    from hmbot.model.vht import VHT, VHTNode
+
+    rng = random.Random(seed)
+
+    def random_node(depth):
+        node = VHTNode._make(None, '', '', 0, 0, 1, 1, 'false', 'false', 'false', 'false', 'false',
+                             rng.choice('ABC'), '', '', 'true', 'false')
+        if depth > 0:
+            for _ in range(rng.randint(0, 3)):
+                node._children.append(random_node(depth - 1))
+        return node
+
+    mismatches = 0
+    for _ in range(trials):
+        vht1 = VHT(random_node(rng.randint(0, 4)), compressed=False)
+        vht2 = VHT(random_node(rng.randint(0, 4)), compressed=False)
+        expected = zss.simple_distance(vht1._root, vht2._root, get_children=VHTNode.get_children,
+                                       get_label=VHTNode.get_label)
+        for k in (0, 1, 2, 3, 5, 10, 30, None):
+            distance = tree_distance(vht1, vht2, k)
+            if distance != (expected if k is None else min(expected, k + 1)):
+                mismatches += 1
+                print('MISMATCH k=%s: zss=%d bounded=%d' % (k, expected, distance))
+    return mismatches
+
+
+def _synthetic_benchmark(sizes=(201, 401, 801, 1601), edits=5, k=30, seed=1):
+    """
+    Time tree_distance between random VHT-shaped trees and copies with a few random edits,
+    and between unrelated trees of the same size.
+    """
+    import random, time
+    from hmbot.model.vht import VHT, VHTNode
+
+    rng = random.Random(seed)
+    types = ('Text', 'Image', 'Row', 'Column', 'Button', 'List', 'ListItem')
+
+    def make(type):
+        return VHTNode._make(None, '', '', 0, 0, 1, 1, 'false', 'false', 'false', 'false', 'false',
+                             type, '', '', 'true', 'false')
+
+    def random_tree(size):
+        # mostly deep and local, as containers are filled one after another
+        nodes = [make('Root')]
+        while len(nodes) < size:
+            parent = rng.choice(nodes[-20:] if rng.random() < 0.7 else nodes)
+            node = make(rng.choice(types))
+            parent._children.append(node)
+            nodes.append(node)
+        return nodes[0]
+
+    def copy(node):
+        clone = make(node._type)
+        clone._children = [copy(child) for child in node._children]
+        return clone
+
+    def edit(root):
+        for _ in range(edits):
+            nodes = root()
+            node = rng.choice(nodes)
+            if rng.random() < 0.5 or node is root:
+                node._children.append(make(rng.choice(types)))
+            else:
+                node._type = 'Edited'
+        return root
+
+    for size in sizes:
+        root = random_tree(size)
+        vht1 = VHT(root, compressed=False)
+        vht2 = VHT(edit(copy(root)), compressed=False)
+        vht3 = VHT(random_tree(size), compressed=False)
+        start = time.perf_counter()
+        near = tree_distance(vht1, vht2, k)
+        middle = time.perf_counter()
+        far = tree_distance(vht1, vht3, k)
+        end = time.perf_counter()
+        print('%d nodes: edited copy %d (%.3fs), unrelated tree %d (%.3fs)'
+              % (size, near, middle - start, far, end - middle))
+
+
+if __name__ == '__main__':
+    # Benchmark against zss on VHT dumps: python -m hmbot.utils.ted dump1.json dump2.json ...
+    # or check against zss on random trees: python -m hmbot.utils.ted --random [TRIALS]
+    # or time synthetic trees: python -m hmbot.utils.ted --bench
+    import itertools, json, sys, time
+    import zss
+    from hmbot.model.vht import VHTParser, VHTNode
+
+    if sys.argv[1:2] == ['--random']:
+        trials = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        mismatches = _random_check(trials)
+        print('%d trials, %d mismatches' % (trials, mismatches))
+        sys.exit(1 if mismatches else 0)
+    if sys.argv[1:2] == ['--bench']:
+        _synthetic_benchmark()
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print('usage: python -m hmbot.utils.ted VHT_JSON VHT_JSON [VHT_JSON ...] [--bound K]')
+        sys.exit(1)
+    args = sys.argv[1:]
+    bound = 30
+    if '--bound' in args:
+        index = args.index('--bound')
+        bound = int(args[index + 1])
+        del args[index:index + 2]
+    vhts = []
+    for path in args:
+        with open(path, 'r', encoding='utf-8') as f:
+            vhts.append((path, VHTParser._parse_hdc_json(json.load(f), None)))
+    total_zss = total_bounded = 0.0
+    for (path1, vht1), (path2, vht2) in itertools.combinations(vhts, 2):
+        start = time.perf_counter()
+        expected = zss.simple_distance(vht1._root, vht2._root, get_children=VHTNode.get_children,
+                                       get_label=VHTNode.get_label)
+        middle = time.perf_counter()
+        distance = tree_distance(vht1, vht2, bound)
+        end = time.perf_counter()
+        total_zss += middle - start
+        total_bounded += end - middle
+        status = 'ok' if distance == min(expected, bound + 1) else 'MISMATCH'
+        print('%s %s: zss=%d (%.3fs) bounded=%d (%.3fs) %s'
+              % (path1, path2, expected, middle - start, distance, end - middle, status))
+    print('total: zss %.3fs, bounded %.3fs' % (total_zss, total_bounded))
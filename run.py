@@ -6,6 +6,8 @@ from hmbot.app.android_app import AndroidApp
 from hmbot.app.harmony_app import HarmonyApp
 from hmbot.device.device import Device
 from hmbot.explorer.bug_explorer import BugExplorer
+from hmbot.model.ptg_store import PTGStore
+from hmbot.explorer.llm import enable_cache
 from hmbot.utils.proto import OperatingSystem
 from hmbot.utils.utils import *
 
@@ -45,6 +47,37 @@ def setup_argument_parser() -> argparse.ArgumentParser:
         help='Specify the directory for saving exploration results (default: ./output/).'
     )
 
+    parser.add_argument(
+        '--concurrent_capture',
+        action='store_true',
+        help='(Optional) Capture the hierarchy, screenshot and page info of each step at the same time.'
+    )
+    parser.add_argument(
+        '--pipelined',
+        action='store_true',
+        help='(Optional) Plan the next instruction while the last one is being verified.'
+    )
+    parser.add_argument(
+        '--speculative_page_info',
+        action='store_true',
+        help='(Optional) Start summarizing unseen pages while the PTG builder checks whether they are new.'
+    )
+    parser.add_argument(
+        '--llm_cache',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='FILE',
+        help='(Optional) Cache LLM responses in a SQLite file (default: .hmbot_cache/llm_cache.sqlite).'
+    )
+    parser.add_argument(
+        '--store',
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='(Optional) Write pages, transitions, steps and bugs to a SQLite file as they are discovered.'
+    )
+
     stop_condition_group = parser.add_mutually_exclusive_group(required=True)
     stop_condition_group.add_argument(
         '-m', '--max_steps',
@@ -62,13 +95,13 @@ def setup_argument_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def get_device(os_type: str, serial: Optional[str]) -> Device:
+def get_device(os_type: str, serial: Optional[str], concurrent_capture: bool = False) -> Device:
     """
     获取并初始化设备对象，如果未提供serial则自动查找。
     """
     if serial:
         print(f"Connecting to specified device: {serial}")
-        return Device(serial, os_type)
+        return Device(serial, os_type, concurrent_capture)
     
     print(f"No serial provided. Searching for an available {os_type} device...")
     
@@ -92,7 +125,7 @@ def get_device(os_type: str, serial: Optional[str]) -> Device:
         
     auto_selected_serial = available_devices[0]
     print(f"Automatically selected the only available device: {auto_selected_serial}")
-    return Device(auto_selected_serial, os_type)
+    return Device(auto_selected_serial, os_type, concurrent_capture)
 
 
 def prepare_and_install_app(device: Device, os_type: str, app_path: str):
@@ -126,16 +159,20 @@ def main():
     args = parser.parse_args()
 
     try:
-        device = get_device(args.os, args.serial)
+        device = get_device(args.os, args.serial, args.concurrent_capture)
         app = prepare_and_install_app(device, args.os, args.app_path)
 
         print("Initializing Bug Explorer...")
-        bug_explorer = BugExplorer(device, app)
+        if args.llm_cache is not None:
+            enable_cache(args.llm_cache or None)
+        store = PTGStore(args.store) if args.store else None
+        bug_explorer = BugExplorer(device, app, speculative_page_info=args.speculative_page_info, store=store)
         
         #    注意: BugExplorer.explore_coarse 可能需要更新以接受 max_time 参数
         bug_explorer.explore_coarse(
             max_minutes=args.max_minutes, 
-            output_dir=args.output
+            output_dir=args.output,
+            pipelined=args.pipelined
             # max_time_mins=args.max_time # 假设 explore_coarse 支持此参数
         )
         
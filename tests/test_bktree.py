@@ -0,0 +1,94 @@
+import random
+
+from hmbot.utils.bktree import BKTree
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def brute_find(entries, key, k):
+    return sorted((hamming(key, other), other, value) for other, value in entries if hamming(key, other) <= k)
+
+
+def random_entries(rng, count=300):
+    return [(rng.getrandbits(16), index) for index in range(count)]
+
+
+def test_find_matches_brute_force():
+    rng = random.Random(0)
+    entries = random_entries(rng)
+    tree = BKTree(hamming)
+    for key, value in entries:
+        tree.add(key, value)
+    assert len(tree) == len(entries)
+    for _ in range(100):
+        key = rng.getrandbits(16)
+        for k in (0, 2, 4, 6):
+            assert sorted(tree.find(key, k)) == brute_find(entries, key, k)
+
+
+def test_find_is_sorted_by_distance():
+    tree = BKTree(hamming)
+    for key in (0b0000, 0b0001, 0b0011, 0b0111, 0b1111):
+        tree.add(key, key)
+    assert [d for d, _, _ in tree.find(0, 4)] == [0, 1, 2, 3, 4]
+    assert tree.nearest(0b0110, 1) == (1, 0b0111, 0b0111)
+    assert tree.nearest(0b1000, 0) is None
+
+
+def test_duplicate_keys_keep_every_value():
+    tree = BKTree(hamming)
+    tree.add(5, 'a')
+    tree.add(5, 'b')
+    assert sorted(value for _, _, value in tree.find(5, 0)) == ['a', 'b']
+
+
+def test_empty_tree():
+    tree = BKTree(hamming)
+    assert tree.find(0, 10) == []
+    assert tree.nearest(0, 10) is None
+
+
+def test_remove_matches_brute_force():
+    rng = random.Random(1)
+    entries = random_entries(rng)
+    tree = BKTree(hamming)
+    for key, value in entries:
+        tree.add(key, value)
+    rng.shuffle(entries)
+    while entries:
+        key, value = entries.pop()
+        assert tree.remove(key, value)
+        assert not tree.remove(key, value)
+        assert len(tree) == len(entries)
+        probe = rng.getrandbits(16)
+        assert sorted(tree.find(probe, 5)) == brute_find(entries, probe, 5)
+    assert tree.find(0, 16) == []
+
+
+def test_remove_only_the_matching_value():
+    tree = BKTree(hamming)
+    tree.add(5, 'a')
+    tree.add(5, 'b')
+    assert not tree.remove(5, 'c')
+    assert tree.remove(5, 'a')
+    assert tree.find(5, 0) == [(0, 5, 'b')]
+
+
+def test_rebuild_drops_removed_entries():
+    tree = BKTree(hamming)
+    for value in range(10):
+        tree.add(value, value)
+    for value in range(6):
+        tree.remove(value, value)
+    # the removed entries outnumbered the live ones, so the tree only holds the live ones
+    assert tree._removed == 0
+    stack, keys = [tree._root], []
+    while stack:
+        node = stack.pop()
+        keys.append(node[0])
+        stack.extend(node[2].values())
+    assert sorted(keys) == [6, 7, 8, 9]
+    tree.add(0, 0)
+    assert sorted(value for _, _, value in tree.find(0, 16)) == [0, 6, 7, 8, 9]
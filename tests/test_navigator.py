@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from hmbot.explorer.navigator import Navigator
+
+
+def navigator(edges):
+    forward = {}
+    for src, tgt in edges:
+        forward.setdefault(src, {})[tgt] = ['event']
+    return Navigator(SimpleNamespace(forward=forward), device=None)
+
+
+def test_fewest_transitions_without_measurements():
+    nav = navigator([(0, 1), (1, 2), (2, 3), (0, 3)])
+    assert nav.shortest_path(0, 3) == [0, 3]
+    assert nav.shortest_path(1, 3) == [1, 2, 3]
+
+
+def test_same_page_and_unreachable_page():
+    nav = navigator([(0, 1), (1, 0)])
+    assert nav.shortest_path(1, 1) == [1]
+    assert nav.shortest_path(0, 2) is None
+    assert nav.shortest_path(2, 0) is None
+
+
+def test_measured_latency_reroutes():
+    nav = navigator([(0, 1), (1, 2), (2, 3), (0, 3)])
+    nav.record(0, 3, True, 30.0)
+    for src, tgt in ((0, 1), (1, 2), (2, 3)):
+        nav.record(src, tgt, True, 1.0)
+    assert nav.shortest_path(0, 3) == [0, 1, 2, 3]
+
+
+def test_failed_replays_make_an_edge_expensive():
+    nav = navigator([(0, 1), (1, 3), (0, 2), (2, 3)])
+    for _ in range(5):
+        nav.record(0, 1, False, 1.0)
+    nav.record(0, 2, True, 1.0)
+    assert nav.shortest_path(0, 3) == [0, 2, 3]
+    # a failed edge stays usable when it is the only way
+    assert nav.shortest_path(0, 1) == [0, 1]
+
+
+def test_avoided_and_empty_transitions_are_skipped():
+    nav = navigator([(0, 1), (1, 2), (0, 2)])
+    assert nav.shortest_path(0, 2, avoid={(0, 2)}) == [0, 1, 2]
+    assert nav.shortest_path(0, 2, avoid={(0, 2), (1, 2)}) is None
+    nav.ptg.forward[0][2] = []
+    assert nav.shortest_path(0, 2) == [0, 1, 2]
+
+
+def test_path_is_cheapest_among_alternatives():
+    edges = [(0, 1), (0, 2), (1, 3), (2, 3), (3, 4), (1, 4), (2, 4)]
+    nav = navigator(edges)
+    seconds = {(0, 1): 1.0, (0, 2): 2.0, (1, 3): 1.0, (2, 3): 1.0, (3, 4): 1.0, (1, 4): 5.0, (2, 4): 0.5}
+    for (src, tgt), value in seconds.items():
+        nav.record(src, tgt, True, value)
+    paths = [[0, 1, 3, 4], [0, 2, 3, 4], [0, 1, 4], [0, 2, 4]]
+    cost = lambda path: sum(nav.weight(a, b) for a, b in zip(path, path[1:]))
+    assert nav.shortest_path(0, 4) == min(paths, key=cost)
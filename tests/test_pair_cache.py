@@ -0,0 +1,83 @@
+import json
+from types import SimpleNamespace
+
+from hmbot.explorer.equivalence import PairCache
+
+
+def page(fingerprint, img_hash='0'):
+    return SimpleNamespace(fingerprint=fingerprint, img_hash=img_hash)
+
+
+def test_pairs_are_symmetric():
+    cache = PairCache()
+    a, b = page('a'), page('b')
+    assert cache.get(a, b) is None
+    cache.put(a, b, True)
+    assert cache.get(b, a) is True
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_screenshot_hash_is_part_of_the_key():
+    cache = PairCache()
+    cache.put(page('a', '1'), page('b'), True)
+    assert cache.get(page('a', '2'), page('b')) is None
+
+
+def test_least_recently_used_pairs_are_evicted():
+    cache = PairCache(capacity=2)
+    a, b, c = page('a'), page('b'), page('c')
+    cache.put(a, b, 1)
+    cache.put(a, c, 2)
+    cache.get(a, b)
+    cache.put(b, c, 3)
+    assert len(cache) == 2
+    assert cache.get(a, c) is None
+    assert cache.get(a, b) == 1
+
+
+def test_close_saves_and_a_new_cache_loads(tmp_path):
+    path = str(tmp_path / 'pairs.json')
+    cache = PairCache(path=path)
+    cache.put(page('a'), page('b'), True)
+    cache.put(page('a'), page('c'), False)
+    cache.close()
+    loaded = PairCache(path=path)
+    assert loaded.get(page('b'), page('a')) is True
+    assert loaded.get(page('c'), page('a')) is False
+    loaded.close()
+
+
+def test_pairs_are_saved_in_batches(tmp_path):
+    path = tmp_path / 'pairs.json'
+    cache = PairCache(path=str(path), flush_every=3, flush_interval=3600)
+    cache.put(page('a'), page('b'), 1)
+    cache.put(page('a'), page('c'), 2)
+    assert not path.exists()
+    cache.put(page('a'), page('d'), 3)
+    assert len(json.loads(path.read_text())) == 3
+    cache.put(page('a'), page('e'), 4)
+    assert len(json.loads(path.read_text())) == 3
+    cache.close()
+    assert len(json.loads(path.read_text())) == 4
+
+
+def test_loading_keeps_the_capacity(tmp_path):
+    path = str(tmp_path / 'pairs.json')
+    cache = PairCache(path=path)
+    for name in 'bcde':
+        cache.put(page('a'), page(name), name)
+    cache.close()
+    loaded = PairCache(capacity=2, path=path)
+    assert len(loaded) == 2
+    assert loaded.get(page('a'), page('e')) == 'e'
+    loaded.close()
+
+
+def test_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / 'pairs.json'
+    path.write_text('{not json')
+    cache = PairCache(path=str(path))
+    assert len(cache) == 0
+    cache.put(page('a'), page('b'), True)
+    cache.close()
+    assert PairCache(path=str(path)).get(page('a'), page('b')) is True
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+from hmbot.model.event import KeyEvent
+from hmbot.model.page import Page
+from hmbot.model.ptg import PTG
+from hmbot.model.ptg_store import PTGStore
+from hmbot.model.vht import VHTParser
+from hmbot.utils.proto import PageInfo, Resource, AudioInfo, AudioType, Status
+
+
+def attributes(bounds, type, **extra):
+    attrib = dict(bounds=bounds, clickable='false', longClickable='false', selected='false', checkable='false',
+                  checked='false', type=type, id='', text='', enabled='true', focused='false')
+    attrib.update(extra)
+    return attrib
+
+
+def make_page(text, seed):
+    source = {'attributes': attributes('[0,0][100,200]', 'root', bundleName='com.example', pagePath='pages/Index'),
+              'children': [{'attributes': attributes('[0,0][50,50]', 'Button', text=text, clickable='true')},
+                           {'attributes': attributes('[0,50][100,200]', 'Text', text='body')}]}
+    vht = VHTParser._parse_hdc_json(source, None)
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (200, 100, 3), dtype=np.uint8), (9, 9), 0)
+    return Page(vht, img, None, PageInfo(bundle='com.example', ability='EntryAbility', name='EntryAbility'))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'ptg.db')
+    store = PTGStore(path)
+    ptg = PTG(dedupe=False, store=store)
+    pages = [make_page('ok', 0), make_page('cancel', 1)]
+    pages[1].rsc = Resource(audio=AudioInfo(AudioType.MUSIC, Status.RUNNING), camera=None)
+    for page in pages:
+        ptg.add_page(page)
+    store.put_page(1, pages[1], meta={'summary': 'second'})
+    ptg.add_transition(0, 1, [KeyEvent(None, None, 'back')])
+    store.log('step', {'instruction': 'go'})
+    store.close()
+
+    store = PTGStore(path)
+    loaded = store.load(None)
+    assert len(loaded.pages) == 2
+    for page, original in zip(loaded.pages, pages):
+        assert page.fingerprint == original.fingerprint
+        assert page.vht.structure_hash == original.vht.structure_hash
+        assert page.vht._root.attribute['bundle'] == 'com.example'
+        assert page.vht._root.attribute['page'] == 'pages/Index'
+        assert [n.attribute['text'] for n in page.vht._root()] == [n.attribute['text'] for n in original.vht._root()]
+        assert page.info.bundle == 'com.example' and page.info.ability == 'EntryAbility'
+        assert page.img.shape == original.img.shape
+        assert np.abs(page.img.astype(int) - original.img).mean() < 4
+    assert loaded.pages[0].rsc is None
+    assert loaded.pages[1].rsc == pages[1].rsc
+    assert [event._json() for event in loaded.forward[0][1]] == [{'type': 'Key', 'key': 'back'}]
+    assert loaded.reverse[1] == {0}
+    assert store.events('step') == [{'instruction': 'go'}]
+    assert loaded.store is store
+    store.close()
+
+
+def test_unchanged_pages_are_not_rewritten(tmp_path):
+    path = str(tmp_path / 'ptg.db')
+    store = PTGStore(path)
+    page = make_page('ok', 0)
+    assert store.put_page(0, page)
+    assert not store.put_page(0, page)
+    assert store.put_page(0, page, meta={'summary': 'new'})
+    page.vht._root[0].attribute['text'] = 'changed'
+    assert store.put_page(0, page, meta={'summary': 'new'})
+    store.close()
+
+    store = PTGStore(path)
+    loaded = store.load(None)
+    assert loaded.pages[0].vht._root[0].attribute['text'] == 'changed'
+    assert not store.put_page(0, loaded.pages[0], meta={'summary': 'new'})
+    store.close()
+
+
+def test_screenshots_are_stored_once_per_content(tmp_path):
+    store = PTGStore(str(tmp_path / 'ptg.db'))
+    first, second = make_page('ok', 0), make_page('cancel', 0)
+    second.img = first.img
+    store.put_page(0, first)
+    store.put_page(1, second)
+    assert store._db.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 1
+    store.close()
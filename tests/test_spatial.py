@@ -0,0 +1,68 @@
+import random
+
+from hmbot.model.spatial import SpatialIndex
+from hmbot.model.vht import VHTNode
+
+
+def node(x1, y1, x2, y2, clickable='true'):
+    return VHTNode(attrib={'bounds': [[x1, y1], [x2, y2]], 'clickable': clickable, 'type': 'Button'})
+
+
+def brute_node_at(nodes, x, y, clickable):
+    best = None
+    for order, n in enumerate(nodes):
+        if n._x2 <= n._x1 or n._y2 <= n._y1:
+            continue
+        if clickable and n._clickable != 'true':
+            continue
+        if n._x1 <= x <= n._x2 and n._y1 <= y <= n._y2:
+            key = ((n._x2 - n._x1) * (n._y2 - n._y1), order)
+            if best is None or key < best[0]:
+                best = (key, n)
+    return best[1] if best else None
+
+
+def random_nodes(rng, count=200):
+    nodes = []
+    for _ in range(count):
+        x1, y1 = rng.randint(0, 1000), rng.randint(0, 2000)
+        nodes.append(node(x1, y1, x1 + rng.randint(0, 400), y1 + rng.randint(0, 400),
+                          rng.choice(('true', 'false'))))
+    return nodes
+
+
+def test_node_at_matches_brute_force():
+    rng = random.Random(0)
+    nodes = random_nodes(rng)
+    index = SpatialIndex(nodes)
+    for _ in range(500):
+        x, y = rng.randint(-50, 1450), rng.randint(-50, 2450)
+        for clickable in (True, False):
+            assert index.node_at(x, y, clickable) is brute_node_at(nodes, x, y, clickable)
+
+
+def test_nodes_in_matches_brute_force():
+    rng = random.Random(1)
+    nodes = random_nodes(rng)
+    index = SpatialIndex(nodes)
+    for _ in range(200):
+        x1, y1 = rng.randint(-50, 1400), rng.randint(-50, 2400)
+        x2, y2 = x1 + rng.randint(0, 300), y1 + rng.randint(0, 300)
+        expected = [n for n in nodes if n._x2 > n._x1 and n._y2 > n._y1
+                    and n._x1 <= x2 and x1 <= n._x2 and n._y1 <= y2 and y1 <= n._y2]
+        assert index.nodes_in(x1, y1, x2, y2) == expected
+
+
+def test_smallest_node_wins_and_ties_keep_preorder():
+    outer, inner, twin = node(0, 0, 100, 100), node(10, 10, 20, 20), node(10, 10, 20, 20)
+    index = SpatialIndex([outer, inner, twin])
+    assert index.node_at(15, 15) is inner
+    assert index.node_at(50, 50) is outer
+    assert index.node_at(500, 500) is None
+
+
+def test_empty_bounds_are_skipped():
+    index = SpatialIndex([node(5, 5, 5, 5), VHTNode(attrib={'type': 'root'})])
+    assert len(index) == 0
+    assert index.node_at(5, 5) is None
+    assert index.nodes_in(0, 0, 10, 10) == []
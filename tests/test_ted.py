@@ -0,0 +1,83 @@
+import random
+
+import pytest
+import zss
+
+from hmbot.model.vht import VHT, VHTNode
+from hmbot.utils.ted import tree_distance
+
+
+def make(type):
+    return VHTNode._make(None, '', '', 0, 0, 1, 1, 'false', 'false', 'false', 'false', 'false',
+                         type, '', '', 'true', 'false')
+
+
+def random_tree(rng, size, types='ABC'):
+    nodes = [make('Root')]
+    while len(nodes) < size:
+        parent = rng.choice(nodes[-8:] if rng.random() < 0.7 else nodes)
+        node = make(rng.choice(types))
+        parent._children.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+def copy(node):
+    clone = make(node._type)
+    clone._children = [copy(child) for child in node._children]
+    return clone
+
+
+def edit(rng, root, edits, types='ABC'):
+    for _ in range(edits):
+        nodes = root()
+        node = rng.choice(nodes)
+        if node is not root and rng.random() < 0.3:
+            parent = next(parent for parent in nodes if node in parent._children)
+            index = parent._children.index(node)
+            parent._children[index:index + 1] = node._children
+        elif rng.random() < 0.5:
+            node._children.insert(rng.randint(0, len(node._children)), make(rng.choice(types)))
+        else:
+            node._type = rng.choice(types)
+    return root
+
+
+def zss_distance(vht1, vht2):
+    return zss.simple_distance(vht1._root, vht2._root, get_children=VHTNode.get_children,
+                               get_label=VHTNode.get_label)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_zss_on_random_trees(seed):
+    rng = random.Random(seed)
+    vht1 = VHT(random_tree(rng, rng.randint(1, 30)), compressed=False)
+    vht2 = VHT(random_tree(rng, rng.randint(1, 30)), compressed=False)
+    expected = zss_distance(vht1, vht2)
+    assert tree_distance(vht1, vht2, None) == expected
+    for k in (0, 1, 2, 5, 10, 30):
+        assert tree_distance(vht1, vht2, k) == min(expected, k + 1)
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_matches_zss_on_edited_copies(seed):
+    # large trees a few edits apart exercise the band, the postorder window and the row cutoff
+    rng = random.Random(seed)
+    root = random_tree(rng, 80)
+    vht1 = VHT(root, compressed=False)
+    vht2 = VHT(edit(rng, copy(root), rng.randint(1, 12)), compressed=False)
+    expected = zss_distance(vht1, vht2)
+    for k in (0, 3, 8, 15, 30):
+        assert tree_distance(vht1, vht2, k) == min(expected, k + 1)
+
+
+def test_identical_trees():
+    rng = random.Random(0)
+    root = random_tree(rng, 50)
+    assert tree_distance(VHT(root, compressed=False), VHT(copy(root), compressed=False), 0) == 0
+
+
+def test_empty_trees():
+    vht = VHT(random_tree(random.Random(0), 5), compressed=False)
+    assert tree_distance(VHT(None, compressed=False), vht, None) == 5
+    assert tree_distance(VHT(None, compressed=False), vht, 2) == 3
@@ -0,0 +1,62 @@
+from hmbot.model.vht import VHT, VHTNode
+
+
+def node(type, bounds, children=(), **attrib):
+    attrib.setdefault('clickable', 'false')
+    n = VHTNode(attrib=dict(attrib, type=type, bounds=bounds))
+    n._children = list(children)
+    return n
+
+
+def sample():
+    return VHT(node('root', [[0, 0], [100, 200]], [
+        node('Column', [[0, 0], [100, 100]], [
+            node('Button', [[0, 0], [50, 50]], clickable='true', text='ok', id='ok'),
+            node('Button', [[50, 0], [100, 50]], clickable='true', text='cancel', id='cancel'),
+        ]),
+        node('Text', [[0, 100], [100, 200]], text='ok'),
+    ]), compressed=False)
+
+
+def test_query_matches_walk():
+    vht = sample()
+    for query in ({'type': 'Button'}, {'text': 'ok'}, {'type': 'Button', 'text': 'ok'},
+                  {'clickable': 'true'}, {'type': 'Image'}, {'bounds': [[0, 100], [100, 200]]}):
+        assert vht(**query) == vht._root(**query)
+
+
+def test_query_keeps_preorder():
+    vht = sample()
+    assert [n.attribute['id'] for n in vht(type='Button')] == ['ok', 'cancel']
+
+
+def test_attribute_change_invalidates_index():
+    vht = sample()
+    assert len(vht(type='Button')) == 2
+    vht(id='cancel')[0].attribute['type'] = 'Text'
+    assert [n.attribute['id'] for n in vht(type='Button')] == ['ok']
+    assert len(vht(type='Text')) == 2
+
+
+def test_structural_change_invalidates_index():
+    vht = sample()
+    generation = vht.generation
+    assert len(vht(type='Button')) == 2
+    vht(type='Column')[0].append(node('Button', [[0, 50], [50, 100]]))
+    assert vht.generation > generation
+    assert len(vht(type='Button')) == 3
+    del vht(type='Column')[0][0]
+    assert len(vht(type='Button')) == 2
+
+
+def test_generation_is_per_tree():
+    vht1, vht2 = sample(), sample()
+    vht1(type='Button')[0].attribute['text'] = 'yes'
+    assert vht1.generation > 0
+    assert vht2.generation == 0
+
+
+def test_unhashable_value_falls_back_to_walk():
+    vht = sample()
+    vht(id='ok')[0].attribute['tag'] = {'role': 'primary'}
+    assert [n.attribute['id'] for n in vht(tag={'role': 'primary'})] == ['ok']